@@ -0,0 +1,185 @@
+"""Local stub of the Anthropic Messages API, to check prompt caching of the AI reports agent.
+
+The stub follows the prompt-caching rules of the real API: the prefix up to each
+``cache_control`` breakpoint (tools, then system blocks, then messages) is cached for
+5 minutes if it holds at least the model's minimum (2048 tokens for Haiku models, 1024
+otherwise). A later request starting with a cached prefix reports it in
+``cache_read_input_tokens``. Token counts are estimated (runs of at most 6 ASCII letters,
+digits and other characters count as one token each), close to the real tokenizer on the
+French prompt and SQL. Prefill time is simulated in proportion to the uncached tokens, so
+time-to-first-token reflects cache hits.
+
+Usage:
+
+    python anthropic_stub.py --serve [--port 8765]   # then ANTHROPIC_BASE_URL=http://localhost:8765
+    python anthropic_stub.py                         # run three AI report questions against the stub
+
+The second form imports main (same environment as the API) and prints, per call, the input,
+cache write and cache read tokens and the time to first token, with and without the cache
+breakpoints of build_ai_system().
+"""
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TOKEN_PATTERN = re.compile(r'[A-Za-z]{1,6}|\d|[^\sA-Za-z\d]')
+CACHE_TTL = 300
+PREFILL_SECONDS_PER_1K_TOKENS = 0.05
+REPLY = "# Rapport de test\n\nRéponse du stub."
+
+
+def count_tokens(text):
+    return len(TOKEN_PATTERN.findall(text))
+
+
+def prompt_segments(body):
+    """(text, is_breakpoint) for each block of the prompt, in cache prefix order."""
+    for tool in body.get('tools') or []:
+        yield json.dumps({k: v for k, v in tool.items() if k != 'cache_control'}, sort_keys=True), 'cache_control' in tool
+    system = body.get('system') or []
+    if isinstance(system, str):
+        system = [{'type': 'text', 'text': system}]
+    for block in system:
+        yield block['text'], 'cache_control' in block
+    for message in body['messages']:
+        content = message['content']
+        if isinstance(content, str):
+            content = [{'type': 'text', 'text': content}]
+        for block in content:
+            text = block['text'] if block.get('type') == 'text' else json.dumps(
+                {k: v for k, v in block.items() if k != 'cache_control'}, sort_keys=True)
+            yield f"{message['role']}:{text}", 'cache_control' in block
+
+
+class PromptCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # prefix hash -> expiry
+
+    def usage(self, body):
+        """(input_tokens, cache_creation_input_tokens, cache_read_input_tokens) of a request."""
+        minimum = 2048 if 'haiku' in body.get('model', '') else 1024
+        digest = hashlib.sha256()
+        total = 0
+        breakpoints = []  # (prefix hash, tokens up to the breakpoint)
+        for text, is_breakpoint in prompt_segments(body):
+            digest.update(text.encode('utf-8'))
+            total += count_tokens(text)
+            if is_breakpoint:
+                breakpoints.append((digest.copy().hexdigest(), total))
+
+        now = time.monotonic()
+        read = written = 0
+        with self._lock:
+            for key, tokens in breakpoints:
+                if self._entries.get(key, 0) > now:
+                    read = tokens
+            for key, tokens in breakpoints:
+                if tokens >= minimum and tokens > read:
+                    self._entries[key] = now + CACHE_TTL
+                    written = tokens - read
+        return total - read - written, written, read
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    cache = PromptCache()
+    calls = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        input_tokens, written, read = self.cache.usage(body)
+        usage = {'input_tokens': input_tokens, 'cache_creation_input_tokens': written,
+                 'cache_read_input_tokens': read, 'output_tokens': count_tokens(REPLY)}
+        self.calls.append(usage)
+        time.sleep((input_tokens + written) / 1000 * PREFILL_SECONDS_PER_1K_TOKENS)
+
+        message = {'id': f'msg_stub_{len(self.calls)}', 'type': 'message', 'role': 'assistant',
+                   'model': body.get('model'), 'stop_reason': 'end_turn', 'stop_sequence': None}
+        if not body.get('stream'):
+            self._send('application/json', json.dumps({
+                **message, 'content': [{'type': 'text', 'text': REPLY}], 'usage': usage}).encode())
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        events = [
+            ('message_start', {'message': {**message, 'content': [], 'stop_reason': None,
+                                           'usage': {**usage, 'output_tokens': 1}}}),
+            ('content_block_start', {'index': 0, 'content_block': {'type': 'text', 'text': ''}}),
+            *[('content_block_delta', {'index': 0, 'delta': {'type': 'text_delta', 'text': line + '\n'}})
+              for line in REPLY.split('\n')],
+            ('content_block_stop', {'index': 0}),
+            ('message_delta', {'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+                               'usage': {'output_tokens': usage['output_tokens']}}),
+            ('message_stop', {}),
+        ]
+        for event, data in events:
+            self.wfile.write(f"event: {event}\ndata: {json.dumps({'type': event, **data})}\n\n".encode())
+            self.wfile.flush()
+
+    def _send(self, content_type, data):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_stub(port):
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def without_breakpoints(system):
+    return [{k: v for k, v in block.items() if k != 'cache_control'} for block in system]
+
+
+def check_prompt_cache(port):
+    from anthropic import Anthropic
+
+    import main
+
+    server = start_stub(port)
+    main.anthropic_client = Anthropic(api_key='stub', base_url=f'http://127.0.0.1:{server.server_port}')
+    questions = [
+        "Rapport Meta Ads de Vulcain en décembre 2025",
+        "Top requêtes Search Console de GGP sur les 30 derniers jours",
+        "Rapport complet Groupe Théobald janvier 2026",
+    ]
+
+    for label, prepare in (('system without breakpoint', without_breakpoints), ('build_ai_system', lambda s: s)):
+        StubHandler.cache = PromptCache()
+        print(label)
+        for question in questions:
+            start = time.perf_counter()
+            first_token = None
+            for event, _ in main.ai_agent_events([{'role': 'user', 'content': question}],
+                                                 prepare(main.build_ai_system(question)), stream=True):
+                if event == 'token' and first_token is None:
+                    first_token = time.perf_counter() - start
+            usage = StubHandler.calls[-1]
+            print(f"  input={usage['input_tokens']:5}  cache_write={usage['cache_creation_input_tokens']:5}"
+                  f"  cache_read={usage['cache_read_input_tokens']:5}  ttft={first_token * 1000:6.1f} ms  {question}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--serve', action='store_true', help='only run the stub server')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+    if args.serve:
+        start_stub(args.port)
+        print(f"Anthropic stub on http://127.0.0.1:{args.port}")
+        threading.Event().wait()
+    else:
+        check_prompt_cache(args.port)
@@ -0,0 +1,82 @@
+"""Benchmark of JSON response encoding: previous path vs the serialization layer.
+
+Compares ``jsonify([dict(row) for row in rows])`` with the standard Flask provider
+against ``jsonify_rows(rows)`` on synthetic BigQuery rows shaped like a daily
+campaign timeline (DATE, STRING, INT64, NUMERIC, FLOAT64 columns).
+
+Usage (same environment as the API, so ``import main`` can build its clients):
+
+    python bench_json.py [--rows 20000] [--repeat 5]
+"""
+import argparse
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from google.cloud.bigquery import SchemaField
+from google.cloud.bigquery.table import Row
+
+import main
+
+FIELDS = [
+    ('date', 'DATE'), ('campaign_name', 'STRING'), ('impressions', 'INT64'), ('clicks', 'INT64'),
+    ('cost', 'NUMERIC'), ('conversions', 'FLOAT64'), ('ctr', 'FLOAT64'), ('cpc', 'FLOAT64')
+]
+
+
+class FakeRowIterator(list):
+    """List of Rows carrying a schema, like google.cloud.bigquery.table.RowIterator."""
+
+    def __init__(self, rows, schema):
+        super().__init__(rows)
+        self.schema = schema
+
+
+def make_rows(count):
+    schema = [SchemaField(name, field_type) for name, field_type in FIELDS]
+    field_to_index = {name: i for i, (name, _) in enumerate(FIELDS)}
+    start = date(2024, 1, 1)
+    rows = [
+        Row((start + timedelta(days=i % 730), f'Campagne {i % 40}', i * 13, i % 500,
+             Decimal(i % 9000) / 100, (i % 7) * 0.5, 0.021, 0.87), field_to_index)
+        for i in range(count)
+    ]
+    return FakeRowIterator(rows, schema)
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = len(func())
+        timings.append(time.perf_counter() - start)
+    return min(timings), size
+
+
+def main_benchmark(count, repeat):
+    rows = make_rows(count)
+
+    legacy_app = Flask('legacy')
+    legacy_app.json = DefaultJSONProvider(legacy_app)
+    with legacy_app.app_context():
+        legacy_time, legacy_size = best_of(
+            lambda: legacy_app.json.response([dict(row) for row in rows]).get_data(), repeat)
+
+    with main.app.app_context():
+        fast_time, fast_size = best_of(lambda: main.jsonify_rows(rows).get_data(), repeat)
+
+    backend = 'orjson' if main.USE_ORJSON else 'json'
+    print(f"{count} rows, best of {repeat}")
+    print(f"  jsonify + dict(row) (default provider): {legacy_time * 1000:8.1f} ms  {legacy_size:>10} bytes")
+    print(f"  jsonify_rows ({backend:>6}):               {fast_time * 1000:8.1f} ms  {fast_size:>10} bytes")
+    print(f"  speedup: {legacy_time / fast_time:.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    main_benchmark(args.rows, args.repeat)
@@ -1,19 +1,41 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request, has_request_context, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from flask_caching import Cache
 from google.cloud import bigquery
 from google.cloud import storage
-from datetime import datetime, timedelta
+from google.api_core import exceptions as google_exceptions
+from datetime import date, datetime, timedelta
 import os
+import sys
 import traceback
 import re
 import json
 import uuid
-from anthropic import Anthropic
-from jinja2 import Template
+from decimal import Decimal
+import hashlib
+import gzip
+import csv
+import bisect
+import io
+from anthropic import Anthropic, APIConnectionError as AnthropicConnectionError
+from jinja2 import DictLoader, Environment
+from markupsafe import Markup
+import markdown
 from googleapiclient.discovery import build
-from collections import defaultdict
+from contextlib import contextmanager
+from collections import Counter, OrderedDict, defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, Future, CancelledError, FIRST_COMPLETED, FIRST_EXCEPTION, wait
 import unicodedata
+from urllib.parse import urlencode
+import threading
+import atexit
+import base64
+import sqlite3
+import socket
+import time
+import numpy as np
+import requests
 
 # Dashboard API v2.2 - Materialized views + Flask-Caching for performance
 
@@ -26,7 +48,940 @@ cache = Cache(app, config={
     'CACHE_DEFAULT_TIMEOUT': 300  # 5 minutes
 })
 
-client = bigquery.Client(project='mydigipal')
+# ============================================================================
+# RESPONSE SERIALIZATION
+# ============================================================================
+
+# JSON responses are encoded with orjson when it is installed (JSON_BACKEND=json forces the
+# standard library). Decimal becomes a number and date/datetime ISO-8601 strings with either
+# backend. Query results are encoded from each row's value tuple and the schema field names
+# rather than through the Row mapping interface (dict(row) looks every column up by name).
+JSON_BACKEND = os.environ.get('JSON_BACKEND', 'orjson')
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+USE_ORJSON = orjson is not None and JSON_BACKEND == 'orjson'
+
+
+def json_default(value):
+    """Encode the values neither JSON backend handles natively."""
+    if isinstance(value, Decimal):
+        return float(value)
+    if hasattr(value, 'isoformat'):  # date, datetime, time (orjson already handles them)
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def encode_json(obj):
+    """Serialize obj to compact UTF-8 JSON bytes."""
+    if USE_ORJSON:
+        return orjson.dumps(obj, default=json_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=json_default, separators=(',', ':')).encode('utf-8')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by encode_json (used by jsonify and request.json)."""
+
+    def dumps(self, obj, **kwargs):
+        if USE_ORJSON and not kwargs:
+            return encode_json(obj).decode('utf-8')
+        kwargs.setdefault('default', json_default)
+        return json.dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if USE_ORJSON and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        return json_response(encode_json(self._prepare_response_obj(args, kwargs)))
+
+
+app.json = FastJSONProvider(app)
+
+
+def row_values(row):
+    """Value tuple of a BigQuery Row (Row.values() returns a deep copy)."""
+    values = getattr(row, '_xxx_values', None)
+    return values if values is not None else tuple(row)
+
+
+def row_field_names(rows):
+    """Column names of a query result, from its schema when it has one."""
+    schema = getattr(rows, 'schema', None)
+    return [field.name for field in schema] if schema else None
+
+
+def json_response(body):
+    """application/json response for encoded JSON, with a strong ETag of the body."""
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(hashlib.blake2b(body, digest_size=16).hexdigest())
+    return response
+
+
+def jsonify_rows(rows):
+    """JSON array response with one object per row of a query result."""
+    return json_response(encode_json(rows_to_dicts(rows)))
+
+
+# Timeline-like tables can also be returned column-wise (?format=columnar, a dict of
+# arrays) or as base64 Arrow IPC streams (?format=arrow). The response then lists the
+# encoded fields in "columnar_fields"; js/api.js turns them back into row objects.
+RESPONSE_FORMATS = ('json', 'columnar', 'arrow')
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+class UnsupportedFormatError(ValueError):
+    """?format= asked for an output format the API cannot produce."""
+
+
+@app.errorhandler(UnsupportedFormatError)
+def handle_unsupported_format(e):
+    return jsonify({"error": str(e)}), 400
+
+
+def get_response_format():
+    """Table format requested with ?format= (json when absent)."""
+    fmt = request.args.get('format', 'json')
+    if fmt not in RESPONSE_FORMATS:
+        raise UnsupportedFormatError(f"Unknown format '{fmt}'. Available: {', '.join(RESPONSE_FORMATS)}")
+    if fmt == 'arrow' and pyarrow is None:
+        raise UnsupportedFormatError("format=arrow is not available (pyarrow is not installed)")
+    return fmt
+
+
+def rows_to_columns(rows):
+    """Query result as {column: [values]}, built from the row tuples."""
+    names = row_field_names(rows)
+    if names is None:
+        return records_to_columns([dict(row) for row in rows])
+    columns = list(zip(*[row_values(row) for row in rows])) or [()] * len(names)
+    return {name: list(column) for name, column in zip(names, columns)}
+
+
+def records_to_columns(records):
+    """List of row dicts as {column: [values]}; tables already columnar are returned as-is."""
+    if isinstance(records, dict):
+        return records
+    names = {}
+    for record in records:
+        names.update(dict.fromkeys(record))
+    return {name: [record.get(name) for record in records] for name in names}
+
+
+def columns_to_arrow(columns):
+    """Base64 Arrow IPC stream of a columnar table.
+
+    NUMERIC columns become float64 and dates ISO strings, so both decode in the
+    browser to the same values format=json gives.
+    """
+    arrays = []
+    for values in columns.values():
+        array = pyarrow.array(values)
+        if pyarrow.types.is_decimal(array.type):
+            array = array.cast(pyarrow.float64())
+        elif pyarrow.types.is_temporal(array.type):
+            array = pyarrow.array([value.isoformat() if value is not None else None for value in values])
+        arrays.append(array)
+    table = pyarrow.Table.from_arrays(arrays, names=list(columns))
+
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return base64.b64encode(sink.getvalue().to_pybytes()).decode('ascii')
+
+
+def table_transform():
+    """Transform for a query returned as-is: straight to columns unless ?format=json."""
+    return rows_to_dicts if get_response_format() == 'json' else rows_to_columns
+
+
+def encode_tables(payload, tables):
+    """
+    payload with its table fields resampled (?granularity=, ?max_points=)
+    and encoded in the ?format= requested.
+    """
+    fmt = get_response_format()
+    granularity, max_points = get_timeline_resampling()
+    present = [name for name in tables if payload.get(name) is not None]
+
+    if granularity != 'day' or max_points:
+        resampled = {}
+        for name in present:
+            resampled[name], used = resample_timeline(records_to_columns(payload[name]), granularity, max_points)
+        payload = {**payload, **resampled, 'granularity': used if present else granularity}
+        if fmt == 'json':
+            payload.update({name: columns_to_records(resampled[name]) for name in present})
+
+    if fmt == 'json':
+        return payload
+
+    encode = columns_to_arrow if fmt == 'arrow' else records_to_columns
+    return {
+        **payload,
+        **{name: encode(records_to_columns(payload[name])) for name in present},
+        'format': fmt,
+        'columnar_fields': present
+    }
+
+
+def tables_response(payload, tables):
+    """jsonify(payload) with its table fields encoded as encode_tables() does."""
+    return jsonify(encode_tables(payload, tables))
+
+
+# ============================================================================
+# RESPONSE COMPRESSION
+# ============================================================================
+
+# Responses above COMPRESS_MIN_SIZE are compressed with brotli or gzip, whichever the
+# client prefers (brotli only when the module is installed). Compressed bodies are cached
+# under the response's ETag, so a hot payload is compressed once, not once per request.
+# The ETag is then weakened (the bytes differ per encoding); If-None-Match uses the weak
+# comparison, so revalidation still matches. Streamed responses (SSE, exports) are left as-is.
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', '1024'))  # bytes
+COMPRESS_MIMETYPES = {'application/json', 'text/html', 'text/csv'}
+COMPRESS_CACHE_TIMEOUT = 600  # 10 minutes
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_ENCODINGS = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def compress_body(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+@app.after_request
+def compress_response(response):
+    if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+            or response.mimetype not in COMPRESS_MIMETYPES or 'Content-Encoding' in response.headers):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(COMPRESS_ENCODINGS)
+    data = response.get_data()
+    if encoding is None or len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    etag, _ = response.get_etag()
+    cache_key = f"compressed:{encoding}:{etag}" if etag else None
+    compressed = cache.get(cache_key) if cache_key else None
+    if compressed is None:
+        compressed = compress_body(data, encoding)
+        if cache_key:
+            cache.set(cache_key, compressed, timeout=COMPRESS_CACHE_TIMEOUT)
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+# ============================================================================
+# HTTP CACHING
+# ============================================================================
+
+# JSON responses get a strong ETag (hash of the body) when they are built, so the copies
+# stored by @cache.cached carry theirs and hits never re-hash. Cached GET endpoints answer
+# a matching If-None-Match with 304, and tell browsers how long to reuse a response: briefly
+# while the requested period is still open (data keeps arriving), for a day once it ended
+# more than HTTP_SETTLED_DAYS ago. Responses missing data from a failed optional query
+# (g.partial_response) get no-cache instead. Registered after compress_response, so it runs
+# first (Flask calls after_request functions in reverse order) and 304s are never compressed.
+HTTP_LIVE_MAX_AGE = 300  # 5 minutes, the usual server-side cache timeout
+HTTP_SETTLED_MAX_AGE = 86400  # 1 day
+HTTP_SETTLED_DAYS = 3  # ad platforms still restate the last few days
+
+
+def period_end(args):
+    """Last day covered by a request's period (?date_to= or ?month=), None when open-ended."""
+    try:
+        if args.get('date_to'):
+            return datetime.strptime(args['date_to'], '%Y-%m-%d').date()
+        if args.get('month'):
+            month_start = datetime.strptime(args['month'], '%Y-%m').date()
+            return (month_start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    except ValueError:
+        pass
+    return None
+
+
+@app.after_request
+def add_http_caching(response):
+    view = app.view_functions.get(request.endpoint)
+    timeout = getattr(view, 'cache_timeout', None)
+    if (request.method != 'GET' or timeout is None or response.status_code != 200 or response.is_streamed
+            or 'Warning' in response.headers):
+        return response
+
+    if g.get('partial_response'):
+        response.cache_control.no_cache = True
+        return response
+
+    end = period_end(request.args)
+    settled = end is not None and end <= date.today() - timedelta(days=HTTP_SETTLED_DAYS)
+    response.cache_control.public = True
+    response.cache_control.max_age = HTTP_SETTLED_MAX_AGE if settled else min(timeout, HTTP_LIVE_MAX_AGE)
+    if response.get_etag()[0] is None:
+        response.add_etag()
+    return response.make_conditional(request)
+
+
+# ============================================================================
+# CIRCUIT BREAKERS
+# ============================================================================
+
+# One breaker per dependency: BigQuery per dataset ("bigquery:marts", ...), the Sheets
+# registry, Anthropic and Cloud Storage. After CIRCUIT_FAILURE_THRESHOLD consecutive
+# outage-like errors (5xx, 429, connection problems) the circuit opens and calls fail fast
+# with CircuitOpenError instead of reaching the dependency from every thread. Once the
+# open window is over, one trial call goes through: success closes the circuit, failure
+# reopens it for twice as long (up to CIRCUIT_MAX_BACKOFF).
+#
+# When a cached GET endpoint fails because of an open circuit (one of the breakers it went
+# through is open, or it got CircuitOpenError), it answers with the last good body it
+# returned (within STALE_MAX_AGE) with a Warning header. JSON objects also get "stale": true
+# and "stale_since"; other bodies (JSON lists such as /api/clients, CSV) keep their shape
+# and are marked by the header only.
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_BASE_BACKOFF = float(os.environ.get('CIRCUIT_BASE_BACKOFF', '5'))  # seconds
+CIRCUIT_MAX_BACKOFF = float(os.environ.get('CIRCUIT_MAX_BACKOFF', '300'))
+STALE_MAX_AGE = 86400  # 1 day
+STALE_MAX_BYTES = int(os.environ.get('STALE_MAX_BYTES', str(64 * 1024 * 1024)))
+STALE_WARNING = '110 - "Response is Stale"'
+
+# `project.dataset.table` or `dataset.table` references in SQL
+SQL_DATASET_PATTERN = re.compile(r'`(?:[\w-]+\.)?(\w+)\.[\w*]+`')
+
+
+class CircuitOpenError(Exception):
+    """A call was refused because the circuit of its dependency is open."""
+
+    def __init__(self, dependency, retry_after):
+        super().__init__(f"{dependency} is unavailable (circuit open), retry in {retry_after:.0f}s")
+        self.dependency = dependency
+        self.retry_after = retry_after
+
+
+def is_dependency_failure(e):
+    """Errors that say the dependency is down or overloaded, not that the call was wrong."""
+    if isinstance(e, (ConnectionError, requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                      google_exceptions.RetryError, AnthropicConnectionError)):
+        return True
+    for status in (getattr(e, 'status_code', None), getattr(e, 'code', None),
+                   getattr(getattr(e, 'resp', None), 'status', None)):
+        if isinstance(status, int):
+            return status == 429 or status >= 500
+    return False
+
+
+def note_breakers(*touched):
+    """Remember the breakers the current request goes through (see stale_fallback)."""
+    if has_request_context():
+        g.setdefault('circuit_breakers', set()).update(touched)
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with exponential backoff while open."""
+
+    def __init__(self, name, threshold=CIRCUIT_FAILURE_THRESHOLD, base_backoff=CIRCUIT_BASE_BACKOFF,
+                 max_backoff=CIRCUIT_MAX_BACKOFF):
+        self.name = name
+        self.threshold = threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._trips = 0
+        self._open_until = None
+        self._trial = False
+
+    def _backoff(self):
+        return min(self.base_backoff * 2 ** max(self._trips - 1, 0), self.max_backoff)
+
+    def before_call(self):
+        """Raise CircuitOpenError while open; past the open window, let one trial call through."""
+        note_breakers(self)
+        with self._lock:
+            if self._open_until is None:
+                return
+            now = time.monotonic()
+            if now < self._open_until:
+                raise CircuitOpenError(self.name, self._open_until - now)
+            # Half-open: this call is the trial; the next one waits for another window unless it reports back
+            self._trial = True
+            self._open_until = now + self._backoff()
+
+    def success(self):
+        with self._lock:
+            if self._open_until is not None:
+                print(f"[Circuit] {self.name} closed")
+            self._failures = 0
+            self._trips = 0
+            self._open_until = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._open_until is None:
+                if self._failures < self.threshold:
+                    return
+            elif not self._trial:
+                return  # a call started before the circuit opened
+            self._trial = False
+            self._trips += 1
+            backoff = self._backoff()
+            self._open_until = time.monotonic() + backoff
+        print(f"[Circuit] {self.name} open for {backoff:.0f}s after {self._failures} failures")
+
+    def record(self, e):
+        """Count an error against the dependency, or as a sign of life when it is the caller's fault."""
+        if is_dependency_failure(e):
+            self.failure()
+        elif not isinstance(e, TimeoutError):  # a timeout may just be the request deadline
+            self.success()
+
+    @contextmanager
+    def guard(self):
+        """with breaker.guard(): call the dependency, recording how it went."""
+        self.before_call()
+        try:
+            yield
+        except Exception as e:
+            self.record(e)
+            raise
+        self.success()
+
+    def status(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._open_until is None:
+                state = 'closed'
+            elif now < self._open_until:
+                state = 'open'
+            else:
+                state = 'half_open'
+            return {
+                'state': state,
+                'consecutive_failures': self._failures,
+                'retry_in': round(max(self._open_until - now, 0), 1) if self._open_until is not None else None
+            }
+
+    def is_open(self):
+        with self._lock:
+            return self._open_until is not None
+
+
+class CircuitBreakers:
+    """Breakers by dependency name, created on first use."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._breakers = {}
+
+    def get(self, name):
+        with self._lock:
+            if name not in self._breakers:
+                self._breakers[name] = CircuitBreaker(name)
+            return self._breakers[name]
+
+    def for_sql(self, sql):
+        """Breakers of the BigQuery datasets a query reads."""
+        datasets = sorted({match.lower() for match in SQL_DATASET_PATTERN.findall(sql)})
+        return [self.get(f"bigquery:{dataset}") for dataset in datasets] or [self.get('bigquery')]
+
+    def status(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {name: breaker.status() for name, breaker in sorted(breakers.items())}
+
+
+breakers = CircuitBreakers()
+
+
+@app.errorhandler(CircuitOpenError)
+def handle_circuit_open(e):
+    g.circuit_open = True
+    response = jsonify({"error": str(e), "type": type(e).__name__, "dependency": e.dependency})
+    response.headers['Retry-After'] = str(max(int(e.retry_after), 1))
+    return response, 503
+
+
+class GuardedBigQueryClient(bigquery.Client):
+    """bigquery.Client whose queries, inserts and table reads go through the dataset breakers."""
+
+    def query(self, query, *args, **kwargs):
+        guards = breakers.for_sql(query)
+        for breaker in guards:
+            breaker.before_call()
+        try:
+            job = super().query(query, *args, **kwargs)
+        except Exception as e:
+            for breaker in guards:
+                breaker.record(e)
+            raise
+        if job.dry_run:
+            for breaker in guards:
+                breaker.success()
+            return job
+
+        # Most failures (backend errors, quota) only surface when waiting for the results
+        result = job.result
+
+        def guarded_result(*result_args, **result_kwargs):
+            try:
+                rows = result(*result_args, **result_kwargs)
+            except Exception as e:
+                for breaker in guards:
+                    breaker.record(e)
+                raise
+            for breaker in guards:
+                breaker.success()
+            return rows
+
+        job.result = guarded_result
+        return job
+
+    def insert_rows_json(self, table, json_rows, *args, **kwargs):
+        with breakers.for_sql(f"`{table}`")[0].guard():
+            return super().insert_rows_json(table, json_rows, *args, **kwargs)
+
+    def get_table(self, table, *args, **kwargs):
+        with breakers.for_sql(f"`{table}`")[0].guard():
+            return super().get_table(table, *args, **kwargs)
+
+
+client = GuardedBigQueryClient(project='mydigipal')
+
+
+class StaleResponses:
+    """Last good body of each cached GET URL, bounded by total size (least recently stored out first)."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # full path -> (etag, body, mimetype, stored_at, monotonic)
+        self._size = 0
+
+    def remember(self, path, response):
+        etag, _ = response.get_etag()
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and etag is not None and entry[0] == etag:
+                return
+        body = response.get_data()
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(path, None)
+            if previous is not None:
+                self._size -= len(previous[1])
+            self._entries[path] = (etag, body, response.mimetype, datetime.utcnow().isoformat(), time.monotonic())
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted[1])
+
+    def get(self, path):
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is None or time.monotonic() - entry[4] > STALE_MAX_AGE:
+            return None
+        return entry
+
+
+stale_responses = StaleResponses(STALE_MAX_BYTES)
+
+
+@app.after_request
+def stale_fallback(response):
+    """Remember good cached GET responses; replace their failures by them when a circuit they use is open."""
+    view = app.view_functions.get(request.endpoint)
+    if request.method != 'GET' or getattr(view, 'cache_timeout', None) is None or response.is_streamed:
+        return response
+    if response.status_code == 200:
+        if not g.get('partial_response'):
+            stale_responses.remember(request.full_path, response)
+        return response
+    if response.status_code < 500 or not (
+            g.get('circuit_open') or any(breaker.is_open() for breaker in g.get('circuit_breakers', ()))):
+        return response
+
+    entry = stale_responses.get(request.full_path)
+    if entry is None:
+        return response
+    _, body, mimetype, stored_at, _ = entry
+    if mimetype == 'application/json':
+        payload = json.loads(body)
+        if isinstance(payload, dict):  # lists keep their shape: the Warning header marks them
+            body = encode_json({**payload, 'stale': True, 'stale_since': stored_at})
+    print(f"[Circuit] Serving stale {request.full_path} from {stored_at}")
+    stale = Response(body, mimetype=mimetype)
+    stale.headers['Warning'] = STALE_WARNING
+    stale.cache_control.no_cache = True
+    return stale
+
+
+@app.route('/api/health/circuits')
+def get_circuit_status():
+    """State of the dependency circuit breakers."""
+    return jsonify(breakers.status())
+
+
+# ============================================================================
+# BIGQUERY JOB EXECUTOR
+# ============================================================================
+
+# Shared, bounded pool for the independent BigQuery jobs of a request.
+# Endpoints submit all their sub-queries at once so a detail page costs one
+# round-trip instead of N, without letting 8 gunicorn threads flood BigQuery.
+BQ_MAX_CONCURRENT_JOBS = int(os.environ.get('BQ_MAX_CONCURRENT_JOBS', '16'))
+BQ_REQUEST_DEADLINE = float(os.environ.get('BQ_REQUEST_DEADLINE', '60'))  # seconds
+BQ_POLL_INTERVAL = 0.25  # how often waiting requests check deadline / disconnect
+
+bq_executor = ThreadPoolExecutor(max_workers=BQ_MAX_CONCURRENT_JOBS, thread_name_prefix='bq-job')
+
+
+class QueryDeadlineExceeded(Exception):
+    """The BigQuery jobs of a request did not finish before its deadline."""
+
+
+class ClientDisconnected(Exception):
+    """The HTTP client went away while its BigQuery jobs were still running."""
+
+
+def rows_to_dicts(rows):
+    names = row_field_names(rows)
+    if names is None:
+        return [dict(row) for row in rows]
+    return [dict(zip(names, row_values(row))) for row in rows]
+
+
+def first_row(rows):
+    row = next(iter(rows), None)
+    return dict(row) if row else {}
+
+
+def client_disconnected():
+    """Best-effort check whether the HTTP client closed its connection (gunicorn only)."""
+    if not has_request_context():
+        return False
+    sock = request.environ.get('gunicorn.socket')
+    if sock is None:
+        return False
+    try:
+        data = sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+    except (BlockingIOError, InterruptedError):
+        return False  # Connection open, nothing pending
+    except OSError:
+        return True
+    return data == b''  # EOF: peer closed the connection
+
+
+class QueryBatch:
+    """
+    BigQuery jobs belonging to one HTTP request.
+    Jobs run concurrently on the shared executor. Waiting enforces a request-level
+    deadline, and outstanding jobs are cancelled on timeout, error or client disconnect.
+
+    Usage:
+        with QueryBatch() as batch:
+            batch.submit('summary', summary_query, job_config, transform=first_row)
+            batch.submit('timeline', timeline_query, job_config)
+            results = batch.results()
+    """
+
+    def __init__(self, deadline=None):
+        self.deadline = time.monotonic() + (deadline if deadline is not None else BQ_REQUEST_DEADLINE)
+        self.futures = {}
+        self.errors = {}
+        self._jobs = []
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.cancel()
+        return False
+
+    def remaining(self):
+        return self.deadline - time.monotonic()
+
+    def submit(self, name, query, job_config=None, transform=rows_to_dicts, optional=False,
+               page_size=None, max_results=None):
+        """
+        Start a query in the background; `transform` turns the row iterator into the result.
+        Optional jobs resolve to None instead of failing the whole batch; the error
+        message is kept in `errors[name]`. An open circuit still fails the batch, so that
+        cached endpoints answer with their last good response rather than a partial one
+        (see stale_fallback). `page_size` / `max_results` bound how rows are
+        downloaded (passed to job.result()).
+        """
+        # The job runs outside the request context: note its breakers from here
+        note_breakers(*breakers.for_sql(query))
+        future = bq_executor.submit(self._run, name, query, job_config, transform, optional, page_size, max_results)
+        self.futures[name] = future
+        return future
+
+    def _run(self, name, query, job_config, transform, optional=False, page_size=None, max_results=None):
+        if self._cancelled.is_set():
+            raise CancelledError()
+        try:
+            job = client.query(query, job_config=job_config)
+            with self._lock:
+                self._jobs.append(job)
+            if self._cancelled.is_set():
+                job.cancel()
+                raise CancelledError()
+            rows = job.result(timeout=max(self.remaining(), 1), page_size=page_size, max_results=max_results)
+            return transform(rows)
+        except (CancelledError, CircuitOpenError):
+            raise
+        except Exception as e:
+            if not optional:
+                raise
+            print(f"[BigQuery] Optional job {name} failed: {e}")
+            self.errors[name] = str(e)
+            return None
+
+    def cancel(self):
+        """Cancel queued work and every BigQuery job that is still running."""
+        self._cancelled.set()
+        for future in self.futures.values():
+            future.cancel()
+        with self._lock:
+            jobs = list(self._jobs)
+        for job in jobs:
+            try:
+                if not job.done():
+                    job.cancel()
+                    print(f"[BigQuery] Cancelled job {job.job_id}")
+            except Exception as e:
+                print(f"[BigQuery] Failed to cancel job {job.job_id}: {e}")
+
+    def wait(self, futures=None):
+        """Block until the given futures (default: all) are done, honouring deadline and disconnects."""
+        pending = set(futures if futures is not None else self.futures.values())
+        try:
+            while pending:
+                remaining = self.remaining()
+                if remaining <= 0:
+                    raise QueryDeadlineExceeded(f"BigQuery jobs exceeded the {BQ_REQUEST_DEADLINE:.0f}s request deadline")
+                done, pending = wait(pending, timeout=min(BQ_POLL_INTERVAL, remaining), return_when=FIRST_EXCEPTION)
+                for future in done:
+                    if not future.cancelled() and future.exception() is not None:
+                        raise future.exception()
+                if pending and client_disconnected():
+                    raise ClientDisconnected()
+        except BaseException:
+            self.cancel()
+            raise
+
+    def as_completed(self):
+        """Yield job names as their jobs finish, with the same deadline, error and disconnect handling as wait()."""
+        names = {future: name for name, future in self.futures.items()}
+        pending = set(names)
+        try:
+            while pending:
+                remaining = self.remaining()
+                if remaining <= 0:
+                    raise QueryDeadlineExceeded(f"BigQuery jobs exceeded the {BQ_REQUEST_DEADLINE:.0f}s request deadline")
+                done, pending = wait(pending, timeout=min(BQ_POLL_INTERVAL, remaining), return_when=FIRST_COMPLETED)
+                for future in done:
+                    if not future.cancelled() and future.exception() is not None:
+                        raise future.exception()
+                    yield names[future]
+                if pending and client_disconnected():
+                    raise ClientDisconnected()
+        except BaseException:
+            self.cancel()
+            raise
+
+    def results(self):
+        """Wait for every submitted job and return {name: transformed result}."""
+        self.wait()
+        return {name: future.result() for name, future in self.futures.items()}
+
+
+@app.errorhandler(QueryDeadlineExceeded)
+def handle_query_deadline(e):
+    return jsonify({"error": str(e), "type": type(e).__name__}), 504
+
+
+@app.errorhandler(ClientDisconnected)
+def handle_client_disconnected(e):
+    print("[BigQuery] Client disconnected, outstanding jobs cancelled")
+    return '', 499
+
+
+# ============================================================================
+# BIGQUERY WRITE-BEHIND
+# ============================================================================
+
+# Logging inserts (AI conversations, shared reports) are buffered and streamed to
+# BigQuery from a background thread instead of inside the request.
+BQ_WRITE_FLUSH_ROWS = int(os.environ.get('BQ_WRITE_FLUSH_ROWS', '500'))
+BQ_WRITE_FLUSH_INTERVAL = float(os.environ.get('BQ_WRITE_FLUSH_INTERVAL', '5'))
+BQ_WRITE_MAX_ROWS = int(os.environ.get('BQ_WRITE_MAX_ROWS', '10000'))
+BQ_WRITE_SPILL_DIR = os.environ.get('BQ_WRITE_SPILL_DIR', '/tmp/bq-write-spill')
+BQ_WRITE_OVERFLOW = os.environ.get('BQ_WRITE_OVERFLOW', 'spill')  # 'spill' or 'drop'
+
+
+class WriteBehindBuffer:
+    """
+    Buffers rows for BigQuery streaming inserts, per table, and writes them from a
+    background thread every `flush_interval` seconds or as soon as a table has
+    `flush_rows` rows waiting.
+
+    At most `max_rows` rows are held in memory. Past that, and when an insert fails,
+    rows are appended to a JSONL spill file per table (or dropped with overflow='drop');
+    spill files are replayed on later flushes. close() flushes what is left and is
+    registered to run at interpreter exit.
+
+    Usage:
+        bq_writer.insert('mydigipal.company.ai_conversations', row)
+    """
+
+    def __init__(self, flush_rows, flush_interval, max_rows, spill_dir, overflow='spill'):
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self.spill_dir = spill_dir
+        self.overflow = overflow
+        self._buffers = defaultdict(list)
+        self._size = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name='bq-write-behind', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def insert(self, table_id, row):
+        with self._lock:
+            accepted = self._size < self.max_rows
+            if accepted:
+                self._buffers[table_id].append(row)
+                self._size += 1
+                full = len(self._buffers[table_id]) >= self.flush_rows
+        if not accepted:
+            self._overflow(table_id, [row])
+        elif full:
+            self._wake.set()
+
+    def _overflow(self, table_id, rows):
+        if self.overflow == 'drop':
+            print(f"[BigQuery] Write buffer full, dropped {len(rows)} rows for {table_id}")
+            return
+        self._spill(table_id, rows)
+
+    def _spill_path(self, table_id):
+        return os.path.join(self.spill_dir, f"{table_id}.jsonl")
+
+    def _spill(self, table_id, rows):
+        try:
+            with self._spill_lock:
+                os.makedirs(self.spill_dir, exist_ok=True)
+                with open(self._spill_path(table_id), 'a') as f:
+                    for row in rows:
+                        f.write(json.dumps(row, default=str) + '\n')
+            print(f"[BigQuery] Spilled {len(rows)} rows for {table_id} to disk")
+        except OSError as e:
+            print(f"[BigQuery] Cannot spill rows for {table_id}, dropped {len(rows)}: {e}")
+
+    def _insert(self, table_id, rows):
+        """Stream rows in chunks; rows of a failed call are spilled. Returns False on failure."""
+        for start in range(0, len(rows), self.flush_rows):
+            chunk = rows[start:start + self.flush_rows]
+            try:
+                errors = client.insert_rows_json(table_id, chunk)
+            except Exception as e:
+                print(f"[BigQuery] Insert into {table_id} failed: {e}")
+                self._overflow(table_id, rows[start:])
+                return False
+            if errors:
+                # Rows rejected by BigQuery (schema...) would fail again: logged, not retried
+                print(f"[BigQuery] Insert errors for {table_id}: {errors}")
+        return True
+
+    def _replay_spilled(self):
+        if not os.path.isdir(self.spill_dir):
+            return
+        for filename in os.listdir(self.spill_dir):
+            if not filename.endswith('.jsonl'):
+                continue
+            table_id = filename[:-len('.jsonl')]
+            with self._spill_lock:
+                path = self._spill_path(table_id)
+                try:
+                    with open(path) as f:
+                        rows = [json.loads(line) for line in f if line.strip()]
+                    os.remove(path)
+                except (OSError, ValueError) as e:
+                    print(f"[BigQuery] Cannot read spill file {filename}: {e}")
+                    continue
+            print(f"[BigQuery] Replaying {len(rows)} spilled rows for {table_id}")
+            if not self._insert(table_id, rows):
+                return
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                buffers, self._buffers = self._buffers, defaultdict(list)
+                self._size = 0
+            healthy = all([self._insert(table_id, rows) for table_id, rows in buffers.items()])
+            # Spilled rows are only retried while BigQuery accepts inserts
+            if healthy:
+                self._replay_spilled()
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[BigQuery] Write-behind flush failed: {e}")
+                traceback.print_exc()
+
+    def close(self):
+        """Stop the background thread and flush the remaining rows."""
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join(timeout=BQ_WRITE_FLUSH_INTERVAL + 30)
+        self.flush()
+
+
+bq_writer = WriteBehindBuffer(BQ_WRITE_FLUSH_ROWS, BQ_WRITE_FLUSH_INTERVAL, BQ_WRITE_MAX_ROWS,
+                              BQ_WRITE_SPILL_DIR, BQ_WRITE_OVERFLOW)
 
 # Google Sheets configuration (central account registry)
 SPREADSHEET_ID = '1BFcwuLQ2LbiJK0wpz6oaf44xNcsP5ilWxBwNU04n0Y4'
@@ -44,6 +999,9 @@ def normalize_client_id(client_group):
     normalized = ''.join(c for c in normalized if c.isalnum() or c == '_')
     return normalized
 
+CLIENT_ACCOUNTS_LAST_GOOD_KEY = 'client_accounts_last_good'
+
+
 @cache.cached(timeout=600, key_prefix='client_accounts_from_sheet')
 def get_client_accounts_from_sheet():
     """
@@ -55,15 +1013,15 @@ def get_client_accounts_from_sheet():
         from google.auth import default
         from googleapiclient.discovery import build
 
-        credentials, _ = default()
-        sheets_service = build('sheets', 'v4', credentials=credentials)
-
         # Read sheet - Structure: A=#, B=Canal, C=Client, D=Nom du compte, E=ID, F=Devise, G=Actif, H=Notes
         range_name = f"'{SHEET_NAME}'!A:H"
-        result = sheets_service.spreadsheets().values().get(
-            spreadsheetId=SPREADSHEET_ID,
-            range=range_name
-        ).execute()
+        with breakers.get('sheets').guard():
+            credentials, _ = default()
+            sheets_service = build('sheets', 'v4', credentials=credentials)
+            result = sheets_service.spreadsheets().values().get(
+                spreadsheetId=SPREADSHEET_ID,
+                range=range_name
+            ).execute()
 
         rows = result.get('values', [])
         if not rows:
@@ -152,15 +1110,40 @@ def get_client_accounts_from_sheet():
             }
 
         print(f"[Sheets] Loaded {len(result)} clients from Google Sheet")
+        cache.set(CLIENT_ACCOUNTS_LAST_GOOD_KEY, result, timeout=0)
         return result
 
     except Exception as e:
         print(f"[Sheets] ERROR loading from sheet: {e}")
         traceback.print_exc()
-        return {}
+        # Keep serving the last registry read while the Sheets API is failing
+        return cache.get(CLIENT_ACCOUNTS_LAST_GOOD_KEY) or {}
+
+# Paid media platforms and their account column in the client registry
+PAID_MEDIA_PLATFORMS = {
+    'meta': 'meta_ads_accounts',
+    'google': 'google_ads_accounts',
+    'linkedin': 'linkedin_ads_accounts',
+}
+
+@cache.cached(timeout=600, key_prefix='account_client_index')
+def get_account_client_index():
+    """
+    Reverse index of the client registry for paid media.
+    Returns dict: {platform: {account_name: [client_id, ...]}}
+    """
+    index = {platform: defaultdict(list) for platform in PAID_MEDIA_PLATFORMS}
+    for client_id, data in get_client_accounts_from_sheet().items():
+        for platform, field in PAID_MEDIA_PLATFORMS.items():
+            if not data.get(field):
+                continue
+            for account in data[field].split('|'):
+                index[platform][account.strip()].append(client_id)
+    return {platform: dict(accounts) for platform, accounts in index.items()}
 
 # AI Reports - Anthropic Claude configuration
 ANTHROPIC_API_KEY = os.environ.get('ANTHROPIC_API_KEY')
+# ANTHROPIC_BASE_URL (lu par le SDK) permet de pointer vers un stub local de l'API
 anthropic_client = Anthropic(api_key=ANTHROPIC_API_KEY) if ANTHROPIC_API_KEY else None
 
 # Allowed BigQuery tables for AI Reports (security) - ANALYTICS ONLY
@@ -383,7 +1366,7 @@ def get_clients():
 
     job_config = bigquery.QueryJobConfig(query_parameters=params) if params else None
     rows = client.query(query, job_config=job_config).result()
-    return jsonify([dict(row) for row in rows])
+    return jsonify_rows(rows)
 
 @app.route('/api/clients-with-hours')
 @cache.cached(timeout=300, query_string=True)
@@ -416,7 +1399,7 @@ def get_clients_with_hours():
     
     job_config = bigquery.QueryJobConfig(query_parameters=params) if params else None
     rows = client.query(query, job_config=job_config).result()
-    return jsonify([dict(row) for row in rows])
+    return jsonify_rows(rows)
 
 @app.route('/api/client-timeline/<client_id>')
 @cache.cached(timeout=300, query_string=True)
@@ -449,8 +1432,6 @@ def get_client_timeline(client_id):
         """
         
         job_config = bigquery.QueryJobConfig(query_parameters=params)
-        daily_rows = client.query(query_daily, job_config=job_config).result()
-        daily_data = [dict(row) for row in daily_rows]
         
         query_totals = f"""
         SELECT 
@@ -464,24 +1445,27 @@ def get_client_timeline(client_id):
         ORDER BY 3 DESC
         """
         
-        total_rows = client.query(query_totals, job_config=job_config).result()
-        totals_data = [dict(row) for row in total_rows]
-        
         query_client = f"""
         SELECT 
           COALESCE(c.client_name, @client_id) as client_name
         FROM `mydigipal.company.clients_dim` c
         WHERE c.client_id = @client_id
         """
-        client_rows = list(client.query(query_client, job_config=job_config).result())
-        client_name = client_rows[0]['client_name'] if client_rows else client_id
         
-        return jsonify({
+        with QueryBatch() as batch:
+            batch.submit('daily', query_daily, job_config, transform=table_transform())
+            batch.submit('totals', query_totals, job_config)
+            batch.submit('client', query_client, job_config, transform=first_row)
+            results = batch.results()
+        
+        return tables_response({
             "client_id": client_id,
-            "client_name": client_name,
-            "daily": daily_data,
-            "totals": totals_data
-        })
+            "client_name": results['client'].get('client_name', client_id),
+            "daily": results['daily'],
+            "totals": results['totals']
+        }, ('daily',))
+    except REQUEST_ERRORS:
+        raise
     except Exception as e:
         return jsonify({
             "error": str(e),
@@ -685,7 +1669,7 @@ def get_monthly():
 
     job_config = bigquery.QueryJobConfig(query_parameters=params) if params else None
     rows = client.query(query, job_config=job_config).result()
-    return jsonify([dict(row) for row in rows])
+    return jsonify_rows(rows)
 
 @app.route('/api/employees')
 @cache.cached(timeout=300, query_string=True)
@@ -717,7 +1701,7 @@ def get_employees():
     
     job_config = bigquery.QueryJobConfig(query_parameters=params) if params else None
     rows = client.query(query, job_config=job_config).result()
-    return jsonify([dict(row) for row in rows])
+    return jsonify_rows(rows)
 
 @app.route('/api/employees-breakdown')
 @cache.cached(timeout=300, query_string=True)
@@ -796,8 +1780,10 @@ def get_employee_detail(employee_id):
     """
     
     job_config = bigquery.QueryJobConfig(query_parameters=params)
-    rows = client.query(query, job_config=job_config).result()
-    return jsonify([dict(row) for row in rows])
+    with QueryBatch() as batch:
+        batch.submit('months', query, job_config)
+        results = batch.results()
+    return jsonify(results['months'])
 
 @app.route('/api/client/<client_id>')
 @cache.cached(timeout=300, query_string=True)
@@ -829,7 +1815,6 @@ def get_client_detail(client_id):
     ORDER BY 1 DESC
     LIMIT 12
     """
-    monthly = [dict(row) for row in client.query(query1, job_config=job_config).result()]
     
     query2 = f"""
     SELECT 
@@ -842,14 +1827,18 @@ def get_client_detail(client_id):
     GROUP BY 1
     ORDER BY 2 DESC
     """
-    team_rows = client.query(query2, job_config=job_config).result()
+    
+    with QueryBatch() as batch:
+        batch.submit('monthly', query1, job_config)
+        batch.submit('team', query2, job_config)
+        results = batch.results()
+    
     team = []
-    for row in team_rows:
-        r = dict(row)
+    for r in results['team']:
         r['hours'] = r.pop('total_hours')
         team.append(r)
     
-    return jsonify({"monthly": monthly, "team": team})
+    return jsonify({"monthly": results['monthly'], "team": team})
 
 @app.route('/api/alerts')
 @cache.cached(timeout=300)
@@ -862,7 +1851,7 @@ def get_alerts():
     LIMIT 20
     """
     rows = client.query(query).result()
-    return jsonify([dict(row) for row in rows])
+    return jsonify_rows(rows)
 
 @app.route('/api/date-range')
 @cache.cached(timeout=300)
@@ -910,7 +1899,7 @@ def get_health_latest():
           source_name
         """
         rows = client.query(query).result()
-        return jsonify([dict(row) for row in rows])
+        return jsonify_rows(rows)
     except Exception as e:
         print(f"Error fetching health data: {str(e)}")
         traceback.print_exc()
@@ -944,170 +1933,723 @@ def get_health_history():
         )
 
         rows = client.query(query, job_config=job_config).result()
-        return jsonify([dict(row) for row in rows])
+        return jsonify_rows(rows)
     except Exception as e:
         print(f"Error fetching health history: {str(e)}")
         traceback.print_exc()
         return jsonify({"error": "Failed to fetch health history"}), 500
 
 # ============================================================================
-# ANALYTICS ENDPOINTS
+# PERIOD COMPARISON
 # ============================================================================
 
-@app.route('/api/analytics/clients')
-@cache.cached(timeout=600)  # 10 minutes cache
-def get_analytics_clients():
-    """Get list of active clients for analytics - only those with at least one account mapped"""
-    try:
-        query = """
-        SELECT
-            client_id,
-            company_name as client_name,
-            alternative_name,
-            category,
-            country,
-            language,
-            active,
-            google_ads_accounts,
-            meta_ads_accounts,
-            linkedin_ads_accounts,
-            ga4_properties,
-            gsc_domains
-        FROM `mydigipal.company.client_accounts_mapping`
-        WHERE active = TRUE
-          AND (
-            google_ads_accounts IS NOT NULL
-            OR meta_ads_accounts IS NOT NULL
-            OR linkedin_ads_accounts IS NOT NULL
-            OR ga4_properties IS NOT NULL
-            OR gsc_domains IS NOT NULL
-          )
-        ORDER BY company_name ASC
-        """
+# Comparison modes accepted by analytics endpoints (?compare=...)
+# - previous: same-length period immediately before date_from (default)
+# - yoy: same dates one year earlier
+# - none: current period only, no *_change fields
+COMPARE_MODES = ('previous', 'yoy', 'none')
+
+# Summary metrics per platform. Each metric is aggregated for both periods in a
+# single scan; `key` drives the `<key>_change` field and `column` the current value.
+#   expr:  per-row expression, aggregated with `agg` (SUM by default, or AVG)
+#   ratio: (numerator key, denominator key) re-derived from the aggregated metrics
+META_SUMMARY_METRICS = [
+    {'key': 'impressions', 'column': 'total_impressions', 'expr': 'CAST(impressions AS INT64)'},
+    {'key': 'clicks', 'column': 'total_clicks', 'expr': 'CAST(clicks AS INT64)'},
+    {'key': 'ctr', 'column': 'avg_ctr', 'ratio': ('clicks', 'impressions'), 'scale': 100},
+    {'key': 'spend', 'column': 'total_spend', 'expr': 'CAST(spend AS FLOAT64)'},
+    {'key': 'cpc', 'column': 'avg_cpc', 'ratio': ('spend', 'clicks')},
+    {'key': 'conversions', 'column': 'total_conversions',
+     'expr': "IF(actions IS NOT NULL AND JSON_EXTRACT_SCALAR(actions, '$[0].value') IS NOT NULL, 1, 0)"},
+]
 
-        results = client.query(query).result()
-        clients_list = []
-        
-        for row in results:
-            client_data = dict(row)
-            
-            # Parse pipe-separated account strings into arrays for easier frontend handling
-            if client_data.get('google_ads_accounts'):
-                client_data['google_ads_accounts_list'] = [acc.strip() for acc in client_data['google_ads_accounts'].split('|')]
-            else:
-                client_data['google_ads_accounts_list'] = []
-                
-            if client_data.get('meta_ads_accounts'):
-                client_data['meta_ads_accounts_list'] = [acc.strip() for acc in client_data['meta_ads_accounts'].split('|')]
-            else:
-                client_data['meta_ads_accounts_list'] = []
-                
-            if client_data.get('linkedin_ads_accounts'):
-                client_data['linkedin_ads_accounts_list'] = [acc.strip() for acc in client_data['linkedin_ads_accounts'].split('|')]
-            else:
-                client_data['linkedin_ads_accounts_list'] = []
-                
-            if client_data.get('ga4_properties'):
-                client_data['ga4_properties_list'] = [prop.strip() for prop in client_data['ga4_properties'].split('|')]
-            else:
-                client_data['ga4_properties_list'] = []
-                
-            if client_data.get('gsc_domains'):
-                client_data['gsc_domains_list'] = [domain.strip() for domain in client_data['gsc_domains'].split('|')]
-            else:
-                client_data['gsc_domains_list'] = []
-            
-            clients_list.append(client_data)
+LINKEDIN_SUMMARY_METRICS = [
+    {'key': 'impressions', 'column': 'total_impressions', 'expr': 'impressions'},
+    {'key': 'clicks', 'column': 'total_clicks', 'expr': 'clicks'},
+    {'key': 'ctr', 'column': 'avg_ctr', 'ratio': ('clicks', 'impressions'), 'scale': 100},
+    {'key': 'spend', 'column': 'total_spend', 'expr': 'costInLocalCurrency'},
+    {'key': 'cpc', 'column': 'avg_cpc', 'ratio': ('spend', 'clicks')},
+    {'key': 'leads', 'column': 'total_leads', 'expr': 'COALESCE(oneClickLeads, 0) + COALESCE(oneClickLeadFormOpens, 0)'},
+    {'key': 'conversions', 'column': 'total_conversions', 'expr': 'COALESCE(externalWebsiteConversions, 0)'},
+]
 
-        return jsonify(clients_list)
-    except Exception as e:
-        print(f"Error fetching analytics clients: {str(e)}")
-        traceback.print_exc()
-        return jsonify({"error": "Failed to fetch clients"}), 500
+GOOGLE_ADS_SUMMARY_METRICS = [
+    {'key': 'impressions', 'column': 'total_impressions', 'expr': 'impressions'},
+    {'key': 'clicks', 'column': 'total_clicks', 'expr': 'clicks'},
+    {'key': 'ctr', 'column': 'avg_ctr', 'ratio': ('clicks', 'impressions'), 'scale': 100},
+    {'key': 'cost', 'column': 'total_cost', 'expr': 'cost'},
+    {'key': 'cpc', 'column': 'avg_cpc', 'ratio': ('cost', 'clicks')},
+    {'key': 'conversions', 'column': 'total_conversions', 'expr': 'conversions'},
+    {'key': 'conversion_value', 'column': 'total_conversion_value', 'expr': 'conversions_value'},
+    {'key': 'cost_per_conversion', 'column': 'cost_per_conversion', 'ratio': ('cost', 'conversions')},
+]
 
+GA4_TRAFFIC_METRICS = [
+    {'key': 'sessions', 'column': 'sessions', 'expr': 'SAFE_CAST(sessions AS INT64)'},
+    {'key': 'users', 'column': 'users', 'expr': 'SAFE_CAST(totalUsers AS INT64)'},
+    {'key': 'new_users', 'column': 'new_users', 'expr': 'SAFE_CAST(newUsers AS INT64)'},
+    {'key': 'pageviews', 'column': 'pageviews', 'expr': 'SAFE_CAST(screenPageViews AS INT64)'},
+    {'key': 'engaged_sessions', 'column': 'engaged_sessions', 'expr': 'SAFE_CAST(engagedSessions AS INT64)'},
+    {'key': 'engagement_rate', 'column': 'engagement_rate', 'ratio': ('engaged_sessions', 'sessions'), 'scale': 100},
+    {'key': 'pages_per_session', 'column': 'pages_per_session', 'ratio': ('pageviews', 'sessions')},
+    {'key': 'bounce_rate', 'column': 'bounce_rate', 'expr': 'SAFE_CAST(bounceRate AS FLOAT64)', 'agg': 'AVG'},
+    {'key': 'avg_session_duration', 'column': 'avg_session_duration',
+     'expr': 'SAFE_CAST(averageSessionDuration AS FLOAT64)', 'agg': 'AVG'},
+]
 
-@app.route('/api/analytics/meta-ads')
-@cache.cached(timeout=300, query_string=True)  # 5 minutes cache
-def get_meta_ads_analytics():
-    """Get Meta Ads analytics for a client"""
-    try:
-        client_id = request.args.get('client_id')
-        date_from = request.args.get('date_from')
-        date_to = request.args.get('date_to')
+GA4_EVENT_METRICS = [
+    {'key': 'leads', 'column': 'leads', 'expr': "IF(event_category = 'LEAD', SAFE_CAST(eventCount AS INT64), 0)"},
+    {'key': 'conversions', 'column': 'conversions', 'expr': "IF(event_category = 'CONVERSION', SAFE_CAST(eventCount AS INT64), 0)"},
+    {'key': 'engagement_events', 'column': 'engagement_events',
+     'expr': "IF(event_category = 'ENGAGEMENT', SAFE_CAST(eventCount AS INT64), 0)"},
+]
 
-        if not client_id or not date_from or not date_to:
-            return jsonify({'error': 'Missing required parameters: client_id, date_from, date_to'}), 400
+GSC_SUMMARY_METRICS = [
+    {'key': 'clicks', 'column': 'total_clicks', 'expr': 'clicks'},
+    {'key': 'impressions', 'column': 'total_impressions', 'expr': 'impressions'},
+    {'key': 'ctr', 'column': 'avg_ctr', 'expr': 'ctr * 100', 'agg': 'AVG'},
+    {'key': 'position', 'column': 'avg_position', 'expr': 'position', 'agg': 'AVG'},
+]
 
-        # Get client accounts from Google Sheet
-        accounts_map = get_client_accounts_from_sheet()
-        client_data = accounts_map.get(client_id)
 
-        if not client_data or not client_data.get('meta_ads_accounts'):
-            return jsonify({'error': 'No Meta Ads accounts found for this client'}), 404
+def get_compare_mode():
+    mode = request.args.get('compare', 'previous').lower()
+    return mode if mode in COMPARE_MODES else 'previous'
 
-        accounts = [acc.strip() for acc in client_data['meta_ads_accounts'].split('|')]
 
-        # Calculate period length for comparison
-        from datetime import datetime as dt
-        date_from_dt = dt.strptime(date_from, '%Y-%m-%d')
-        date_to_dt = dt.strptime(date_to, '%Y-%m-%d')
-        period_days = (date_to_dt - date_from_dt).days + 1
+def shift_years(d, years):
+    try:
+        return d.replace(year=d.year + years)
+    except ValueError:  # 29 February
+        return d.replace(year=d.year + years, day=28)
+
+
+def comparison_window(date_from, date_to, mode='previous'):
+    """Return (compare_from, compare_to) dates for the period [date_from, date_to] (YYYY-MM-DD)."""
+    start = datetime.strptime(date_from, '%Y-%m-%d').date()
+    end = datetime.strptime(date_to, '%Y-%m-%d').date()
+    if mode == 'yoy':
+        return shift_years(start, -1), shift_years(end, -1)
+    period_days = (end - start).days + 1
+    return start - timedelta(days=period_days), start - timedelta(days=1)
+
+
+def comparison_params(date_from, date_to, mode, param_type='DATE', date_format='%Y-%m-%d'):
+    """@compare_from / @compare_to query parameters (empty when mode is 'none')."""
+    if mode == 'none':
+        return []
+    compare_from, compare_to = comparison_window(date_from, date_to, mode)
+    return [
+        bigquery.ScalarQueryParameter("compare_from", param_type, compare_from.strftime(date_format)),
+        bigquery.ScalarQueryParameter("compare_to", param_type, compare_to.strftime(date_format))
+    ]
+
+
+def comparison_info(date_from, date_to, mode):
+    """Describe the comparison period for API responses."""
+    if mode == 'none':
+        return {'mode': mode}
+    compare_from, compare_to = comparison_window(date_from, date_to, mode)
+    return {
+        'mode': mode,
+        'date_from': compare_from.strftime('%Y-%m-%d'),
+        'date_to': compare_to.strftime('%Y-%m-%d')
+    }
+
+
+def build_comparison_query(table, date_expr, where, metrics, mode='previous'):
+    """
+    Build a summary query that reads the combined [previous, current] window once and
+    splits it with conditional aggregation, instead of scanning the table per period.
 
-        # Get summary data with comparison to previous period
-        summary_query = """
-        WITH current_period AS (
-            SELECT
-                SUM(CAST(impressions AS INT64)) as total_impressions,
-                SUM(CAST(clicks AS INT64)) as total_clicks,
-                SAFE_DIVIDE(SUM(CAST(clicks AS INT64)), SUM(CAST(impressions AS INT64))) * 100 as avg_ctr,
-                SUM(CAST(spend AS FLOAT64)) as total_spend,
-                SAFE_DIVIDE(SUM(CAST(spend AS FLOAT64)), SUM(CAST(clicks AS INT64))) as avg_cpc,
-                COUNTIF(actions IS NOT NULL AND JSON_EXTRACT_SCALAR(actions, '$[0].value') IS NOT NULL) as total_conversions
-            FROM `mydigipal.meta_ads_v2.adsMetrics`
-            WHERE account_name IN UNNEST(@accounts)
-              AND date_start BETWEEN @date_from AND @date_to
-        ),
-        previous_period AS (
+    Expects @date_from/@date_to (current period) and, unless mode is 'none',
+    @compare_from/@compare_to (see comparison_params). Returns one row with each
+    metric's `column` for the current period plus `<key>_change` in percent.
+    """
+    in_current = f"{date_expr} BETWEEN @date_from AND @date_to"
+    in_previous = f"{date_expr} BETWEEN @compare_from AND @compare_to"
+
+    if mode == 'none':
+        window = in_current
+    elif mode == 'previous':
+        # Previous period ends the day before date_from: one contiguous range
+        window = f"{date_expr} BETWEEN @compare_from AND @date_to"
+    else:
+        window = f"({in_current} OR {in_previous})"
+
+    periods = [('cur', in_current)] if mode == 'none' else [('cur', in_current), ('prev', in_previous)]
+
+    aggregates = []
+    for metric in metrics:
+        if 'expr' not in metric:
+            continue
+        agg = metric.get('agg', 'SUM')
+        for prefix, condition in periods:
+            aggregates.append(f"{agg}(IF({condition}, {metric['expr']}, NULL)) AS {prefix}_{metric['key']}")
+
+    def value(metric, prefix):
+        if 'ratio' in metric:
+            numerator, denominator = metric['ratio']
+            ratio = f"SAFE_DIVIDE({prefix}_{numerator}, {prefix}_{denominator})"
+            return f"{ratio} * {metric['scale']}" if metric.get('scale') else ratio
+        return f"{prefix}_{metric['key']}"
+
+    columns = []
+    for metric in metrics:
+        current = value(metric, 'cur')
+        # Averages stay NULL without data, like the per-period AVG they replace
+        if metric.get('agg') == 'AVG':
+            columns.append(f"{current} AS {metric['column']}")
+        else:
+            columns.append(f"COALESCE({current}, 0) AS {metric['column']}")
+        if mode != 'none':
+            previous = value(metric, 'prev')
+            columns.append(
+                f"ROUND(SAFE_DIVIDE(({current}) - ({previous}), NULLIF({previous}, 0)) * 100, 1) AS {metric['key']}_change"
+            )
+
+    aggregates_sql = ',\n                '.join(aggregates)
+    columns_sql = ',\n            '.join(columns)
+    return f"""
+        WITH periods AS (
             SELECT
-                SUM(CAST(impressions AS INT64)) as total_impressions,
-                SUM(CAST(clicks AS INT64)) as total_clicks,
-                SAFE_DIVIDE(SUM(CAST(clicks AS INT64)), SUM(CAST(impressions AS INT64))) * 100 as avg_ctr,
-                SUM(CAST(spend AS FLOAT64)) as total_spend,
-                SAFE_DIVIDE(SUM(CAST(spend AS FLOAT64)), SUM(CAST(clicks AS INT64))) as avg_cpc,
-                COUNTIF(actions IS NOT NULL AND JSON_EXTRACT_SCALAR(actions, '$[0].value') IS NOT NULL) as total_conversions
-            FROM `mydigipal.meta_ads_v2.adsMetrics`
-            WHERE account_name IN UNNEST(@accounts)
-              AND date_start BETWEEN DATE_SUB(CAST(@date_from AS DATE), INTERVAL @period_days DAY)
-                                  AND DATE_SUB(CAST(@date_from AS DATE), INTERVAL 1 DAY)
+                {aggregates_sql}
+            FROM {table}
+            WHERE {where}
+              AND {window}
+        )
+        SELECT
+            {columns_sql}
+        FROM periods
+        """
+
+
+def change_fields(row):
+    """Keep only the *_change fields of a comparison row."""
+    return {k: v for k, v in row.items() if k.endswith('_change')}
+
+
+# ============================================================================
+# TIMELINE RESAMPLING
+# ============================================================================
+
+# ?granularity=week|month (or auto) regroups daily timelines by period start. Additive
+# metrics are summed, ratios are re-derived from the summed metrics and averages are
+# weighted, so a monthly CTR is clicks / impressions of the month rather than an average
+# of daily CTRs. Other text columns (employee...) stay group keys. ?max_points=N then keeps
+# at most N rows chosen with Largest-Triangle-Three-Buckets over all metric series.
+TIMELINE_GRANULARITIES = ('day', 'week', 'month', 'auto')
+TIMELINE_AUTO_MAX_POINTS = 120
+TIMELINE_MIN_POINTS = 3  # LTTB keeps at least the first, one middle and the last point
+
+# Summed per period (users are summed daily users, GA4 does not expose period uniques here)
+TIMELINE_SUM_METRICS = {
+    'impressions', 'clicks', 'cost', 'spend', 'conversions', 'leads', 'value', 'conversion_value',
+    'sessions', 'users', 'new_users', 'pageviews', 'engaged_sessions', 'hours'
+}
+# Re-derived from summed metrics: (numerator candidates, denominator, scale)
+TIMELINE_RATIO_METRICS = {
+    'ctr': (('clicks',), 'impressions', 100),
+    'cpc': (('cost', 'spend'), 'clicks', 1)
+}
+# Averaged with a weight column
+TIMELINE_WEIGHTED_METRICS = {
+    'position': 'impressions',
+    'bounce_rate': 'sessions',
+    'avg_session_duration': 'sessions'
+}
+
+
+class InvalidTimelineParameterError(ValueError):
+    """?granularity= or ?max_points= has a value timelines cannot be resampled with."""
+
+
+@app.errorhandler(InvalidTimelineParameterError)
+def handle_invalid_timeline_parameter(e):
+    return jsonify({"error": str(e)}), 400
+
+
+def get_timeline_resampling():
+    """(granularity, max_points) requested for timelines; ('day', None) leaves them untouched."""
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in TIMELINE_GRANULARITIES:
+        raise InvalidTimelineParameterError(
+            f"Unknown granularity '{granularity}'. Available: {', '.join(TIMELINE_GRANULARITIES)}"
+        )
+    max_points = request.args.get('max_points')
+    if max_points is not None:
+        try:
+            max_points = int(max_points)
+        except ValueError:
+            max_points = 0
+        if max_points < TIMELINE_MIN_POINTS:
+            raise InvalidTimelineParameterError(f"max_points must be an integer >= {TIMELINE_MIN_POINTS}")
+    return granularity, max_points
+
+
+def parse_timeline_dates(values):
+    """Dates (date objects, 'YYYY-MM-DD' or GA4 'YYYYMMDD') as datetime64[D], plus the text format."""
+    texts = [str(value) for value in values]
+    compact = bool(texts) and len(texts[0]) == 8
+    if compact:
+        texts = [f"{text[:4]}-{text[4:6]}-{text[6:]}" for text in texts]
+    return np.array(texts, dtype='datetime64[D]'), compact
+
+
+def format_timeline_dates(days, compact):
+    texts = np.datetime_as_string(days, unit='D')
+    return [text.replace('-', '') for text in texts.tolist()] if compact else texts.tolist()
+
+
+def period_starts(days, granularity):
+    """First day of the week (Monday) or month of each day."""
+    if granularity == 'month':
+        return days.astype('datetime64[M]').astype('datetime64[D]')
+    if granularity == 'week':
+        # 1970-01-01 was a Thursday
+        return days - (days.astype('int64') + 3) % 7
+    return days
+
+
+def auto_granularity(days):
+    """Finest granularity with at most TIMELINE_AUTO_MAX_POINTS periods."""
+    for granularity in ('day', 'week'):
+        if len(np.unique(period_starts(days, granularity))) <= TIMELINE_AUTO_MAX_POINTS:
+            return granularity
+    return 'month'
+
+
+def metric_array(values):
+    """Numeric column as float64, None as NaN."""
+    return np.array([np.nan if value is None else float(value) for value in values], dtype=np.float64)
+
+
+def metric_values(array, integral):
+    values = array.tolist()
+    if integral:
+        return [None if value != value else int(round(value)) for value in values]
+    return [None if value != value else value for value in values]
+
+
+def is_metric_column(values):
+    return all(value is None or (isinstance(value, (int, float, Decimal)) and not isinstance(value, bool))
+               for value in values)
+
+
+def aggregate_periods(columns, days, compact, granularity):
+    """Regroup a daily columnar table into periods (and its text key columns)."""
+    if granularity == 'day' and len(np.unique(days)) == len(days):
+        return columns
+
+    names = [name for name in columns if name != 'date']
+    metrics = [name for name in names if is_metric_column(columns[name])]
+    keys = [name for name in names if name not in metrics]
+
+    # One integer code per key column, then one group per distinct (period, keys...)
+    codes = [period_starts(days, granularity).astype('int64')]
+    for name in keys:
+        _, key_codes = np.unique(np.array([str(value) for value in columns[name]]), return_inverse=True)
+        codes.append(key_codes)
+    groups, first, inverse = np.unique(np.stack(codes, axis=1), axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    count = len(groups)
+
+    arrays = {name: metric_array(columns[name]) for name in metrics}
+    sums = {
+        name: np.bincount(inverse, weights=np.nan_to_num(array), minlength=count)
+        for name, array in arrays.items()
+    }
+
+    result = {'date': format_timeline_dates(groups[:, 0].astype('datetime64[D]'), compact)}
+    for name in keys:
+        result[name] = [columns[name][i] for i in first.tolist()]
+    for name in metrics:
+        array = arrays[name]
+        ratio = TIMELINE_RATIO_METRICS.get(name)
+        numerator = next((n for n in ratio[0] if n in sums), None) if ratio else None
+        weight = TIMELINE_WEIGHTED_METRICS.get(name)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if name in TIMELINE_SUM_METRICS:
+                values = sums[name]
+            elif numerator and ratio[1] in sums:
+                values = sums[numerator] / sums[ratio[1]] * ratio[2]
+            elif weight in arrays:
+                present = ~np.isnan(array)
+                weights = np.where(present, np.nan_to_num(arrays[weight]), 0)
+                values = (np.bincount(inverse, weights=np.nan_to_num(array) * weights, minlength=count)
+                          / np.bincount(inverse, weights=weights, minlength=count))
+            else:
+                values = sums[name] / np.bincount(inverse, weights=~np.isnan(array), minlength=count)
+        values[~np.isfinite(values)] = np.nan
+
+        integral = all(isinstance(value, int) for value in columns[name] if value is not None)
+        result[name] = metric_values(values, integral and name in TIMELINE_SUM_METRICS)
+    return result
+
+
+def lttb_indices(x, series, threshold):
+    """
+    Indices kept by Largest-Triangle-Three-Buckets. With several series (rows of
+    `series`, each scaled to [0, 1]) a point's area is summed over all of them.
+    """
+    n = len(x)
+    if threshold >= n:
+        return np.arange(n)
+
+    low = series.min(axis=1, keepdims=True)
+    span = series.max(axis=1, keepdims=True) - low
+    series = (series - low) / np.where(span == 0, 1, span)
+
+    # threshold - 2 buckets between the first and last points, which are always kept
+    every = (n - 2) / (threshold - 2)
+    edges = (np.arange(threshold - 1) * every).astype(np.int64) + 1
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = series[:, end:next_end].mean(axis=1, keepdims=True)
+        area = np.abs(
+            (x[a] - avg_x) * (series[:, start:end] - series[:, [a]])
+            - (x[a] - x[start:end]) * (avg_y - series[:, [a]])
+        ).sum(axis=0)
+        a = start + int(np.argmax(area))
+        kept[i + 1] = a
+    return kept
+
+
+def downsample_timeline(columns, max_points):
+    """Keep at most max_points rows of a one-row-per-date table (LTTB over its metrics)."""
+    metrics = [name for name in columns if name != 'date' and is_metric_column(columns[name])]
+    if len(columns['date']) <= max_points or not metrics or len(metrics) != len(columns) - 1:
+        return columns
+
+    days, _ = parse_timeline_dates(columns['date'])
+    series = np.nan_to_num(np.stack([metric_array(columns[name]) for name in metrics]))
+    kept = lttb_indices(days.astype(np.float64), series, max_points).tolist()
+    return {name: [values[i] for i in kept] for name, values in columns.items()}
+
+
+def resample_timeline(columns, granularity, max_points):
+    """Timeline table (columnar) at the requested granularity, then downsampled.
+
+    Returns (columns, granularity used), 'auto' being resolved from the date range.
+    """
+    if 'date' not in columns or not columns['date']:
+        return columns, granularity
+    days, compact = parse_timeline_dates(columns['date'])
+    if granularity == 'auto':
+        granularity = auto_granularity(days)
+    columns = aggregate_periods(columns, days, compact, granularity)
+    if max_points:
+        columns = downsample_timeline(columns, max_points)
+    return columns, granularity
+
+
+def columns_to_records(columns):
+    """{column: [values]} back to a list of row dicts."""
+    names = list(columns)
+    return [dict(zip(names, values)) for values in zip(*columns.values())]
+
+
+# ============================================================================
+# ANALYTICS SECTIONS
+# ============================================================================
+
+# Analytics endpoints are split into sections (summary, timeline, campaigns...).
+# ?sections=summary,timeline (alias ?fields=) only runs the BigQuery jobs those
+# sections need. Each section is cached on its own, so sections fetched later reuse
+# what is already cached instead of recomputing the whole payload.
+SECTION_CACHE_TIMEOUT = 600  # 10 minutes
+
+# Arguments that select what to return rather than what to compute
+SECTION_KEY_IGNORED_ARGS = {'sections', 'fields', 'granularity', 'max_points', 'stream'}
+
+# A BigQuery job of an endpoint, and a section built from one or more of those jobs
+Query = namedtuple('Query', ['sql', 'job_config', 'transform', 'optional'], defaults=[rows_to_dicts, False])
+Section = namedtuple('Section', ['queries', 'build'])
+
+
+class UnknownSectionError(ValueError):
+    """?sections= named a section the endpoint does not have."""
+
+
+@app.errorhandler(UnknownSectionError)
+def handle_unknown_section(e):
+    return jsonify({"error": str(e)}), 400
+
+
+class DataTableRequestError(ValueError):
+    """A data table was requested with missing parameters or for a client without accounts."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+@app.errorhandler(DataTableRequestError)
+def handle_data_table_request_error(e):
+    return jsonify({"error": str(e)}), e.status
+
+
+# Errors that endpoints let through to the app-level handlers instead of turning into a 500
+REQUEST_ERRORS = (QueryDeadlineExceeded, ClientDisconnected, UnknownSectionError, UnsupportedFormatError,
+                  InvalidTimelineParameterError, DataTableRequestError, CircuitOpenError)
+
+
+def passthrough_sections(queries):
+    """One section per query, named after it, holding the query result as-is."""
+    return {name: Section((name,), lambda results, name=name: results[name]) for name in queries}
+
+
+def get_requested_sections(available):
+    """Sections requested with ?sections= / ?fields=, in endpoint order (all when absent)."""
+    available = list(available)
+    raw = request.args.get('sections') or request.args.get('fields')
+    if not raw:
+        return available
+    requested = {name.strip() for name in raw.split(',') if name.strip()}
+    unknown = requested - set(available)
+    if unknown:
+        raise UnknownSectionError(
+            f"Unknown sections: {', '.join(sorted(unknown))}. Available: {', '.join(available)}"
         )
+    return [name for name in available if name in requested]
+
+
+def section_cache_key(endpoint, section):
+    args = sorted((k, v) for k, v in request.args.items(multi=True) if k not in SECTION_KEY_IGNORED_ARGS)
+    digest = hashlib.md5(urlencode(args).encode('utf-8')).hexdigest()
+    return f"section:{endpoint}:{digest}:{section}"
+
+
+def iter_sections(endpoint, queries, sections, requested):
+    """
+    Yield (section, value) for the requested sections of an analytics endpoint as they
+    become available: cached sections first, then each other section as soon as the
+    last of its queries finishes. The jobs run concurrently, each query once even if
+    several sections are built from it.
+    """
+    missing = []
+    for name in requested:
+        value = cache.get(section_cache_key(endpoint, name))
+        if value is None:
+            missing.append(name)
+        else:
+            yield name, value
+    if not missing:
+        return
+
+    needed = {query_name for name in missing for query_name in sections[name].queries}
+    results = {}
+    with QueryBatch() as batch:
+        for query_name in needed:
+            query = queries[query_name]
+            batch.submit(query_name, query.sql, query.job_config, query.transform, optional=query.optional)
+
+        for query_name in batch.as_completed():
+            results[query_name] = batch.futures[query_name].result()
+            for name in [name for name in missing if all(q in results for q in sections[name].queries)]:
+                missing.remove(name)
+                value = sections[name].build(results)
+                if any(q in batch.errors for q in sections[name].queries):
+                    # Built without a failed optional query: served, but neither cached nor kept as stale fallback
+                    g.partial_response = True
+                else:
+                    cache.set(section_cache_key(endpoint, name), value, timeout=SECTION_CACHE_TIMEOUT)
+                yield name, value
+
+
+def is_complete_response(response):
+    """@cache.cached(response_filter=...): keep responses built from failed optional queries out of the cache."""
+    return not g.get('partial_response')
+
+
+def resolve_sections(endpoint, queries, sections, requested):
+    """
+    Return {section: value} for the requested sections of an analytics endpoint.
+    Cached sections are reused; the jobs needed by the others run concurrently,
+    each query once even if several sections are built from it.
+    """
+    values = dict(iter_sections(endpoint, queries, sections, requested))
+    return {name: values[name] for name in requested}
+
+
+# ?stream=ndjson|sse sends the sections of an analytics endpoint one by one instead of
+# waiting for the slowest query: a "meta" event with the fields that need no query,
+# one "section" event per section as soon as it is ready (cached ones immediately),
+# then "done", or "error" if a query fails. Each section event merges into the payload
+# the endpoint would return without ?stream=.
+STREAM_MIMETYPES = {'ndjson': 'application/x-ndjson', 'sse': 'text/event-stream'}
+
+
+def is_stream_request():
+    """@cache.cached(unless=...): streamed responses are built per request from the section cache."""
+    return 'stream' in request.args
+
+
+def get_stream_format():
+    stream = request.args.get('stream')
+    if stream is not None and stream not in STREAM_MIMETYPES:
+        raise UnsupportedFormatError(f"Unsupported stream '{stream}'. Available: {', '.join(STREAM_MIMETYPES)}")
+    return stream
+
+
+def stream_event(stream, event, data):
+    """One NDJSON line ({"event": ..., **data}) or one Server-Sent Event."""
+    if stream == 'sse':
+        return b'event: ' + event.encode('utf-8') + b'\ndata: ' + encode_json(data) + b'\n\n'
+    return encode_json({'event': event, **data}) + b'\n'
+
+
+def sections_response(endpoint, queries, sections, payload, tables):
+    """
+    Response of a sectioned analytics endpoint: its requested sections plus payload,
+    encoded by tables_response(), or streamed section by section with ?stream=.
+    """
+    requested = get_requested_sections(sections)
+    stream = get_stream_format()
+    if stream is None:
+        return tables_response({**resolve_sections(endpoint, queries, sections, requested), **payload}, tables)
+
+    def generate():
+        started = time.monotonic()
+        yield stream_event(stream, 'meta', {**payload, 'sections': requested})
+        try:
+            for name, value in iter_sections(endpoint, queries, sections, requested):
+                data = encode_tables({name: value}, tables) if name in tables else {name: value}
+                yield stream_event(stream, 'section', {'section': name, **data})
+            yield stream_event(stream, 'done', {'elapsed_ms': round((time.monotonic() - started) * 1000)})
+        except ClientDisconnected:
+            print(f"[Sections] Client disconnected, {endpoint} stream stopped")
+        except Exception as e:
+            print(f"[Sections] Stream error on {endpoint}: {e}")
+            traceback.print_exc()
+            yield stream_event(stream, 'error', {'error': str(e)})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype=STREAM_MIMETYPES[stream],
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+# ============================================================================
+# ANALYTICS ENDPOINTS
+# ============================================================================
+
+@app.route('/api/analytics/clients')
+@cache.cached(timeout=600)  # 10 minutes cache
+def get_analytics_clients():
+    """Get list of active clients for analytics - only those with at least one account mapped"""
+    try:
+        query = """
         SELECT
-            COALESCE(c.total_impressions, 0) as total_impressions,
-            COALESCE(c.total_clicks, 0) as total_clicks,
-            COALESCE(c.avg_ctr, 0) as avg_ctr,
-            COALESCE(c.total_spend, 0) as total_spend,
-            COALESCE(c.avg_cpc, 0) as avg_cpc,
-            COALESCE(c.total_conversions, 0) as total_conversions,
-            ROUND(SAFE_DIVIDE((c.total_impressions - p.total_impressions), NULLIF(p.total_impressions, 0)) * 100, 1) as impressions_change,
-            ROUND(SAFE_DIVIDE((c.total_clicks - p.total_clicks), NULLIF(p.total_clicks, 0)) * 100, 1) as clicks_change,
-            ROUND(SAFE_DIVIDE((c.avg_ctr - p.avg_ctr), NULLIF(p.avg_ctr, 0)) * 100, 1) as ctr_change,
-            ROUND(SAFE_DIVIDE((c.total_spend - p.total_spend), NULLIF(p.total_spend, 0)) * 100, 1) as spend_change,
-            ROUND(SAFE_DIVIDE((c.avg_cpc - p.avg_cpc), NULLIF(p.avg_cpc, 0)) * 100, 1) as cpc_change,
-            ROUND(SAFE_DIVIDE((c.total_conversions - p.total_conversions), NULLIF(p.total_conversions, 0)) * 100, 1) as conversions_change
-        FROM current_period c, previous_period p
+            client_id,
+            company_name as client_name,
+            alternative_name,
+            category,
+            country,
+            language,
+            active,
+            google_ads_accounts,
+            meta_ads_accounts,
+            linkedin_ads_accounts,
+            ga4_properties,
+            gsc_domains
+        FROM `mydigipal.company.client_accounts_mapping`
+        WHERE active = TRUE
+          AND (
+            google_ads_accounts IS NOT NULL
+            OR meta_ads_accounts IS NOT NULL
+            OR linkedin_ads_accounts IS NOT NULL
+            OR ga4_properties IS NOT NULL
+            OR gsc_domains IS NOT NULL
+          )
+        ORDER BY company_name ASC
         """
 
+        results = client.query(query).result()
+        clients_list = []
+        
+        for row in results:
+            client_data = dict(row)
+            
+            # Parse pipe-separated account strings into arrays for easier frontend handling
+            if client_data.get('google_ads_accounts'):
+                client_data['google_ads_accounts_list'] = [acc.strip() for acc in client_data['google_ads_accounts'].split('|')]
+            else:
+                client_data['google_ads_accounts_list'] = []
+                
+            if client_data.get('meta_ads_accounts'):
+                client_data['meta_ads_accounts_list'] = [acc.strip() for acc in client_data['meta_ads_accounts'].split('|')]
+            else:
+                client_data['meta_ads_accounts_list'] = []
+                
+            if client_data.get('linkedin_ads_accounts'):
+                client_data['linkedin_ads_accounts_list'] = [acc.strip() for acc in client_data['linkedin_ads_accounts'].split('|')]
+            else:
+                client_data['linkedin_ads_accounts_list'] = []
+                
+            if client_data.get('ga4_properties'):
+                client_data['ga4_properties_list'] = [prop.strip() for prop in client_data['ga4_properties'].split('|')]
+            else:
+                client_data['ga4_properties_list'] = []
+                
+            if client_data.get('gsc_domains'):
+                client_data['gsc_domains_list'] = [domain.strip() for domain in client_data['gsc_domains'].split('|')]
+            else:
+                client_data['gsc_domains_list'] = []
+            
+            clients_list.append(client_data)
+
+        return jsonify(clients_list)
+    except Exception as e:
+        print(f"Error fetching analytics clients: {str(e)}")
+        traceback.print_exc()
+        return jsonify({"error": "Failed to fetch clients"}), 500
+
+
+@app.route('/api/analytics/meta-ads')
+@cache.cached(timeout=300, query_string=True, unless=is_stream_request, response_filter=is_complete_response)  # 5 minutes cache
+def get_meta_ads_analytics():
+    """Get Meta Ads analytics for a client"""
+    try:
+        client_id = request.args.get('client_id')
+        date_from = request.args.get('date_from')
+        date_to = request.args.get('date_to')
+
+        if not client_id or not date_from or not date_to:
+            return jsonify({'error': 'Missing required parameters: client_id, date_from, date_to'}), 400
+
+        # Get client accounts from Google Sheet
+        accounts_map = get_client_accounts_from_sheet()
+        client_data = accounts_map.get(client_id)
+
+        if not client_data or not client_data.get('meta_ads_accounts'):
+            return jsonify({'error': 'No Meta Ads accounts found for this client'}), 404
+
+        accounts = [acc.strip() for acc in client_data['meta_ads_accounts'].split('|')]
+
+        # Get summary data with comparison (previous period or YoY) in a single scan
+        compare_mode = get_compare_mode()
+        summary_query = build_comparison_query(
+            '`mydigipal.meta_ads_v2.adsMetrics`', 'date_start', 'account_name IN UNNEST(@accounts)',
+            META_SUMMARY_METRICS, compare_mode
+        )
+
         job_config = bigquery.QueryJobConfig(
             query_parameters=[
                 bigquery.ArrayQueryParameter("accounts", "STRING", accounts),
                 bigquery.ScalarQueryParameter("date_from", "DATE", date_from),
-                bigquery.ScalarQueryParameter("date_to", "DATE", date_to),
-                bigquery.ScalarQueryParameter("period_days", "INT64", period_days)
-            ]
+                bigquery.ScalarQueryParameter("date_to", "DATE", date_to)
+            ] + comparison_params(date_from, date_to, compare_mode)
         )
 
-        summary_result = client.query(summary_query, job_config=job_config).result()
-        summary = dict(next(summary_result))
-
         # Get timeline data
         timeline_query = """
         SELECT
@@ -1130,9 +2672,6 @@ def get_meta_ads_analytics():
             ]
         )
 
-        timeline_result = client.query(timeline_query, job_config=job_config_timeline).result()
-        timeline = [dict(row) for row in timeline_result]
-
         # Get campaigns data
         campaigns_query = """
         SELECT
@@ -1151,9 +2690,6 @@ def get_meta_ads_analytics():
         LIMIT 50
         """
 
-        campaigns_result = client.query(campaigns_query, job_config=job_config_timeline).result()
-        campaigns = [dict(row) for row in campaigns_result]
-
         # Get conversions by type from dedicated table
         conversions_query = """
         SELECT
@@ -1167,21 +2703,25 @@ def get_meta_ads_analytics():
         ORDER BY count DESC
         """
 
-        conversions_result = client.query(conversions_query, job_config=job_config_timeline).result()
-        conversions_by_type = [dict(row) for row in conversions_result if row['count'] > 0]
+        def conversions_with_placeholder(rows):
+            conversions_by_type = [dict(row) for row in rows if row['count'] > 0]
+            # If no conversions data, create placeholder
+            return conversions_by_type or [{'type': 'No conversions tracked', 'count': 0}]
 
-        # If no conversions data, create placeholder
-        if not conversions_by_type:
-            conversions_by_type = [{'type': 'No conversions tracked', 'count': 0}]
-
-        return jsonify({
-            'summary': summary,
-            'timeline': timeline,
-            'campaigns': campaigns,
-            'conversions_by_type': conversions_by_type,
+        queries = {
+            'summary': Query(summary_query, job_config, first_row),
+            'timeline': Query(timeline_query, job_config_timeline, table_transform()),
+            'campaigns': Query(campaigns_query, job_config_timeline),
+            'conversions_by_type': Query(conversions_query, job_config_timeline, conversions_with_placeholder)
+        }
+        sections = passthrough_sections(queries)
+        return sections_response('meta-ads', queries, sections, {
+            'comparison': comparison_info(date_from, date_to, compare_mode),
             'accounts': accounts
-        })
+        }, ('timeline',))
 
+    except REQUEST_ERRORS:
+        raise
     except Exception as e:
         print(f"Error fetching Meta Ads analytics: {str(e)}")
         traceback.print_exc()
@@ -1189,7 +2729,7 @@ def get_meta_ads_analytics():
 
 
 @app.route('/api/analytics/google-ads')
-@cache.cached(timeout=600, query_string=True)
+@cache.cached(timeout=600, query_string=True, unless=is_stream_request, response_filter=is_complete_response)
 def get_google_ads_analytics():
     try:
         client_id = request.args.get('client_id')
@@ -1209,22 +2749,6 @@ def get_google_ads_analytics():
         # Parse accounts (pipe-separated)
         accounts = [acc.strip() for acc in client_data['google_ads_accounts'].split('|')]
 
-        # Get summary data
-        summary_query = """
-        SELECT
-            SUM(impressions) as total_impressions,
-            SUM(clicks) as total_clicks,
-            SAFE_DIVIDE(SUM(clicks), SUM(impressions)) * 100 as avg_ctr,
-            SUM(cost) as total_cost,
-            SAFE_DIVIDE(SUM(cost), SUM(clicks)) as avg_cpc,
-            SUM(conversions) as total_conversions,
-            SUM(conversions_value) as total_conversion_value,
-            SAFE_DIVIDE(SUM(cost), SUM(conversions)) as cost_per_conversion
-        FROM `mydigipal.googleAds_v2.campaignPerformance`
-        WHERE account IN UNNEST(@accounts)
-          AND PARSE_DATE('%Y-%m-%d', date) BETWEEN @date_from AND @date_to
-        """
-
         job_config = bigquery.QueryJobConfig(
             query_parameters=[
                 bigquery.ArrayQueryParameter("accounts", "STRING", accounts),
@@ -1233,9 +2757,16 @@ def get_google_ads_analytics():
             ]
         )
 
-        summary_result = client.query(summary_query, job_config=job_config).result()
-        summary_row = next(summary_result, None)
-        summary = dict(summary_row) if summary_row else {}
+        # Get summary data with comparison (previous period or YoY) in a single scan
+        compare_mode = get_compare_mode()
+        summary_query = build_comparison_query(
+            '`mydigipal.googleAds_v2.campaignPerformance`', "PARSE_DATE('%Y-%m-%d', date)",
+            'account IN UNNEST(@accounts)', GOOGLE_ADS_SUMMARY_METRICS, compare_mode
+        )
+
+        summary_job_config = bigquery.QueryJobConfig(
+            query_parameters=job_config.query_parameters + comparison_params(date_from, date_to, compare_mode)
+        )
 
         # Get timeline data (daily aggregates)
         timeline_query = """
@@ -1252,9 +2783,6 @@ def get_google_ads_analytics():
         ORDER BY date ASC
         """
 
-        timeline_result = client.query(timeline_query, job_config=job_config).result()
-        timeline = [dict(row) for row in timeline_result]
-
         # Get leads and conversions breakdown by date for timeline
         timeline_conv_query = """
         SELECT
@@ -1269,35 +2797,6 @@ def get_google_ads_analytics():
         ORDER BY date
         """
 
-        timeline_conv_result = client.query(timeline_conv_query, job_config=job_config).result()
-
-        # Build mapping of date -> {leads, conversions}
-        timeline_conv_map = {}
-        for row in timeline_conv_result:
-            date_str = str(row['date'])
-            if date_str not in timeline_conv_map:
-                timeline_conv_map[date_str] = {'leads': 0, 'conversions': 0}
-
-            conv_type = row['conversion_type'].lower() if row['conversion_type'] else ''
-            is_lead = 'lead' in conv_type or 'formulaire' in conv_type or 'form' in conv_type
-
-            if is_lead:
-                timeline_conv_map[date_str]['leads'] += row['count']
-            else:
-                timeline_conv_map[date_str]['conversions'] += row['count']
-
-        # Enrich timeline with leads and conversions breakdown
-        for day in timeline:
-            date_str = str(day['date'])
-            if date_str in timeline_conv_map:
-                day['leads'] = timeline_conv_map[date_str]['leads']
-                day['conversions'] = timeline_conv_map[date_str]['conversions']
-            else:
-                day['leads'] = 0
-                # Keep original conversions value if no breakdown available
-                if 'conversions' not in day:
-                    day['conversions'] = 0
-
         # Get campaigns data
         campaigns_query = """
         SELECT
@@ -1317,9 +2816,6 @@ def get_google_ads_analytics():
         LIMIT 50
         """
 
-        campaigns_result = client.query(campaigns_query, job_config=job_config).result()
-        campaigns = [dict(row) for row in campaigns_result]
-
         # Get conversions by type per campaign
         campaigns_conversions_query = """
         SELECT
@@ -1334,29 +2830,6 @@ def get_google_ads_analytics():
         ORDER BY campaign_name, count DESC
         """
 
-        campaigns_conversions_result = client.query(campaigns_conversions_query, job_config=job_config).result()
-
-        # Build a mapping of campaign_name -> conversions_by_type array
-        campaigns_conv_map = {}
-        for row in campaigns_conversions_result:
-            campaign_name = row['campaign_name']
-            if campaign_name not in campaigns_conv_map:
-                campaigns_conv_map[campaign_name] = []
-            campaigns_conv_map[campaign_name].append({'type': row['type'], 'count': row['count']})
-
-        # Enrich campaigns with conversions_by_type
-        for campaign in campaigns:
-            conv_types = campaigns_conv_map.get(campaign['campaign_name'], [])
-
-            # Fallback: if no conversion types but conversions > 0, use generic label
-            if not conv_types and campaign.get('conversions', 0) > 0:
-                conv_types = [{
-                    'type': 'Conversions (type non spécifié)',
-                    'count': int(campaign['conversions'])
-                }]
-
-            campaign['conversions_by_type'] = conv_types
-
         # Get keywords data
         keywords_query = """
         SELECT
@@ -1375,9 +2848,6 @@ def get_google_ads_analytics():
         LIMIT 50
         """
 
-        keywords_result = client.query(keywords_query, job_config=job_config).result()
-        keywords = [dict(row) for row in keywords_result]
-
         # Get conversions by type
         conversions_query = """
         SELECT
@@ -1392,28 +2862,100 @@ def get_google_ads_analytics():
         ORDER BY count DESC
         """
 
-        conversions_result = client.query(conversions_query, job_config=job_config).result()
-        conversions_by_type = [dict(row) for row in conversions_result if row['count'] > 0]
-
-        # Fallback: if no conversion type details but total_conversions > 0, use generic label
-        if not conversions_by_type and summary.get('total_conversions', 0) > 0:
-            conversions_by_type = [{
-                'type': 'Conversions (type non spécifié)',
-                'count': int(summary['total_conversions']),
-                'value': summary.get('total_conversion_value')
-            }]
-        elif not conversions_by_type:
-            conversions_by_type = [{'type': 'No conversions tracked', 'count': 0, 'value': 0}]
-
-        return jsonify({
-            'summary': summary,
-            'timeline': timeline,
-            'campaigns': campaigns,
-            'keywords': keywords,
-            'conversions_by_type': conversions_by_type,
+        def build_timeline(results):
+            timeline = results['timeline']
+
+            # Build mapping of date -> {leads, conversions}
+            timeline_conv_map = {}
+            for row in results['timeline_conv']:
+                date_str = str(row['date'])
+                if date_str not in timeline_conv_map:
+                    timeline_conv_map[date_str] = {'leads': 0, 'conversions': 0}
+
+                conv_type = row['conversion_type'].lower() if row['conversion_type'] else ''
+                is_lead = 'lead' in conv_type or 'formulaire' in conv_type or 'form' in conv_type
+
+                if is_lead:
+                    timeline_conv_map[date_str]['leads'] += row['count']
+                else:
+                    timeline_conv_map[date_str]['conversions'] += row['count']
+
+            # Enrich timeline with leads and conversions breakdown
+            for day in timeline:
+                date_str = str(day['date'])
+                if date_str in timeline_conv_map:
+                    day['leads'] = timeline_conv_map[date_str]['leads']
+                    day['conversions'] = timeline_conv_map[date_str]['conversions']
+                else:
+                    day['leads'] = 0
+                    # Keep original conversions value if no breakdown available
+                    if 'conversions' not in day:
+                        day['conversions'] = 0
+            return timeline
+
+        def build_campaigns(results):
+            campaigns = results['campaigns']
+
+            # Build a mapping of campaign_name -> conversions_by_type array
+            campaigns_conv_map = {}
+            for row in results['campaigns_conversions']:
+                campaign_name = row['campaign_name']
+                if campaign_name not in campaigns_conv_map:
+                    campaigns_conv_map[campaign_name] = []
+                campaigns_conv_map[campaign_name].append({'type': row['type'], 'count': row['count']})
+
+            # Enrich campaigns with conversions_by_type
+            for campaign in campaigns:
+                conv_types = campaigns_conv_map.get(campaign['campaign_name'], [])
+
+                # Fallback: if no conversion types but conversions > 0, use generic label
+                if not conv_types and campaign.get('conversions', 0) > 0:
+                    conv_types = [{
+                        'type': 'Conversions (type non spécifié)',
+                        'count': int(campaign['conversions'])
+                    }]
+
+                campaign['conversions_by_type'] = conv_types
+            return campaigns
+
+        def build_conversions_by_type(results):
+            summary = results['summary']
+            conversions_by_type = [row for row in results['conversions'] if row['count'] > 0]
+
+            # Fallback: if no conversion type details but total_conversions > 0, use generic label
+            if not conversions_by_type and summary.get('total_conversions', 0) > 0:
+                conversions_by_type = [{
+                    'type': 'Conversions (type non spécifié)',
+                    'count': int(summary['total_conversions']),
+                    'value': summary.get('total_conversion_value')
+                }]
+            elif not conversions_by_type:
+                conversions_by_type = [{'type': 'No conversions tracked', 'count': 0, 'value': 0}]
+            return conversions_by_type
+
+        queries = {
+            'summary': Query(summary_query, summary_job_config, first_row),
+            'timeline': Query(timeline_query, job_config),
+            'timeline_conv': Query(timeline_conv_query, job_config),
+            'campaigns': Query(campaigns_query, job_config),
+            'campaigns_conversions': Query(campaigns_conversions_query, job_config),
+            'keywords': Query(keywords_query, job_config),
+            'conversions': Query(conversions_query, job_config)
+        }
+        sections = {
+            'summary': Section(('summary',), lambda results: results['summary']),
+            'timeline': Section(('timeline', 'timeline_conv'), build_timeline),
+            'campaigns': Section(('campaigns', 'campaigns_conversions'), build_campaigns),
+            'keywords': Section(('keywords',), lambda results: results['keywords']),
+            'conversions_by_type': Section(('conversions', 'summary'), build_conversions_by_type)
+        }
+        return sections_response('google-ads', queries, sections, {
+            'comparison': comparison_info(date_from, date_to, compare_mode),
             'accounts': accounts
-        })
+        }, ('timeline',))
 
+    except REQUEST_ERRORS:
+        raise
     except Exception as e:
         print(f"Error fetching Google Ads analytics: {str(e)}")
         traceback.print_exc()
@@ -1421,7 +2963,7 @@ def get_google_ads_analytics():
 
 
 @app.route('/api/analytics/linkedin-ads')
-@cache.cached(timeout=300, query_string=True)
+@cache.cached(timeout=300, query_string=True, unless=is_stream_request, response_filter=is_complete_response)
 def get_linkedin_ads_analytics():
     """Get LinkedIn Ads analytics for a client"""
     try:
@@ -1441,70 +2983,28 @@ def get_linkedin_ads_analytics():
 
         accounts = [acc.strip() for acc in client_data['linkedin_ads_accounts'].split('|')]
 
-        # Calculate period length for comparison
-        from datetime import datetime as dt
-        date_from_dt = dt.strptime(date_from, '%Y-%m-%d')
-        date_to_dt = dt.strptime(date_to, '%Y-%m-%d')
-        period_days = (date_to_dt - date_from_dt).days + 1
-
-        # Get summary data with comparison to previous period
-        summary_query = """
-        WITH current_period AS (
-            SELECT
-                SUM(impressions) as total_impressions,
-                SUM(clicks) as total_clicks,
-                SAFE_DIVIDE(SUM(clicks), SUM(impressions)) * 100 as avg_ctr,
-                SUM(costInLocalCurrency) as total_spend,
-                SAFE_DIVIDE(SUM(costInLocalCurrency), SUM(clicks)) as avg_cpc,
-                SUM(COALESCE(oneClickLeads, 0) + COALESCE(oneClickLeadFormOpens, 0)) as total_leads,
-                SUM(COALESCE(externalWebsiteConversions, 0)) as total_conversions
-            FROM `mydigipal.linkedin_ads_v2.AdMetrics`
-            WHERE account_name IN UNNEST(@accounts)
-              AND date_start BETWEEN @date_from AND @date_to
-        ),
-        previous_period AS (
-            SELECT
-                SUM(impressions) as total_impressions,
-                SUM(clicks) as total_clicks,
-                SAFE_DIVIDE(SUM(clicks), SUM(impressions)) * 100 as avg_ctr,
-                SUM(costInLocalCurrency) as total_spend,
-                SAFE_DIVIDE(SUM(costInLocalCurrency), SUM(clicks)) as avg_cpc,
-                SUM(COALESCE(oneClickLeads, 0) + COALESCE(oneClickLeadFormOpens, 0)) as total_leads,
-                SUM(COALESCE(externalWebsiteConversions, 0)) as total_conversions
-            FROM `mydigipal.linkedin_ads_v2.AdMetrics`
-            WHERE account_name IN UNNEST(@accounts)
-              AND date_start BETWEEN DATE_SUB(CAST(@date_from AS DATE), INTERVAL @period_days DAY)
-                                  AND DATE_SUB(CAST(@date_from AS DATE), INTERVAL 1 DAY)
+        # Get summary data with comparison (previous period or YoY) in a single scan
+        compare_mode = get_compare_mode()
+        summary_query = build_comparison_query(
+            '`mydigipal.linkedin_ads_v2.AdMetrics`', 'date_start', 'account_name IN UNNEST(@accounts)',
+            LINKEDIN_SUMMARY_METRICS, compare_mode
         )
-        SELECT
-            COALESCE(c.total_impressions, 0) as total_impressions,
-            COALESCE(c.total_clicks, 0) as total_clicks,
-            COALESCE(c.avg_ctr, 0) as avg_ctr,
-            COALESCE(c.total_spend, 0) as total_spend,
-            COALESCE(c.avg_cpc, 0) as avg_cpc,
-            COALESCE(c.total_leads, 0) as total_leads,
-            COALESCE(c.total_conversions, 0) as total_conversions,
-            ROUND(SAFE_DIVIDE((c.total_impressions - p.total_impressions), NULLIF(p.total_impressions, 0)) * 100, 1) as impressions_change,
-            ROUND(SAFE_DIVIDE((c.total_clicks - p.total_clicks), NULLIF(p.total_clicks, 0)) * 100, 1) as clicks_change,
-            ROUND(SAFE_DIVIDE((c.avg_ctr - p.avg_ctr), NULLIF(p.avg_ctr, 0)) * 100, 1) as ctr_change,
-            ROUND(SAFE_DIVIDE((c.total_spend - p.total_spend), NULLIF(p.total_spend, 0)) * 100, 1) as spend_change,
-            ROUND(SAFE_DIVIDE((c.avg_cpc - p.avg_cpc), NULLIF(p.avg_cpc, 0)) * 100, 1) as cpc_change,
-            ROUND(SAFE_DIVIDE((c.total_leads - p.total_leads), NULLIF(p.total_leads, 0)) * 100, 1) as leads_change,
-            ROUND(SAFE_DIVIDE((c.total_conversions - p.total_conversions), NULLIF(p.total_conversions, 0)) * 100, 1) as conversions_change
-        FROM current_period c, previous_period p
-        """
 
         job_config_summary = bigquery.QueryJobConfig(
             query_parameters=[
                 bigquery.ArrayQueryParameter("accounts", "STRING", accounts),
                 bigquery.ScalarQueryParameter("date_from", "DATE", date_from),
-                bigquery.ScalarQueryParameter("date_to", "DATE", date_to),
-                bigquery.ScalarQueryParameter("period_days", "INT64", period_days)
-            ]
+                bigquery.ScalarQueryParameter("date_to", "DATE", date_to)
+            ] + comparison_params(date_from, date_to, compare_mode)
         )
 
-        summary_result = client.query(summary_query, job_config=job_config_summary).result()
-        summary = dict(next(summary_result))
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ArrayQueryParameter("accounts", "STRING", accounts),
+                bigquery.ScalarQueryParameter("date_from", "DATE", date_from),
+                bigquery.ScalarQueryParameter("date_to", "DATE", date_to)
+            ]
+        )
 
         # Get timeline data
         timeline_query = """
@@ -1522,9 +3022,6 @@ def get_linkedin_ads_analytics():
         ORDER BY date_start
         """
 
-        timeline_result = client.query(timeline_query, job_config=job_config_summary).result()
-        timeline = [dict(row) for row in timeline_result]
-
         # Get campaigns performance (campaign_name is now enriched directly in AdMetrics)
         campaigns_query = """
         SELECT
@@ -1547,26 +3044,6 @@ def get_linkedin_ads_analytics():
         LIMIT 50
         """
 
-        campaigns_result = client.query(campaigns_query, job_config=job_config_summary).result()
-        campaigns = [dict(row) for row in campaigns_result]
-
-        print(f"[LinkedIn Ads] Client {client_id}: Found {len(campaigns)} campaigns")
-        if len(campaigns) == 0:
-            # Debug: check if campaign_name is NULL
-            debug_query = """
-            SELECT
-                COUNT(*) as total_rows,
-                COUNT(campaign_name) as rows_with_campaign,
-                COUNT(DISTINCT campaign_name) as unique_campaigns
-            FROM `mydigipal.linkedin_ads_v2.AdMetrics`
-            WHERE account_name IN UNNEST(@accounts)
-              AND date_start BETWEEN @date_from AND @date_to
-            """
-            debug_result = client.query(debug_query, job_config=job_config_summary).result()
-            debug_data = dict(next(debug_result))
-            print(f"[LinkedIn Ads] Debug: {debug_data}")
-
-
         # Get detailed conversion metrics
         conversions_detail_query = """
         SELECT
@@ -1579,51 +3056,82 @@ def get_linkedin_ads_analytics():
           AND date_start BETWEEN @date_from AND @date_to
         """
 
-        conversions_detail_result = client.query(conversions_detail_query, job_config=job_config_summary).result()
-        conversions_detail = dict(next(conversions_detail_result))
-
-        # Build detailed conversion types
-        conversion_types = []
-
-        if conversions_detail.get('one_click_leads', 0) > 0:
-            conversion_types.append({
-                'type': 'OneClick Leads',
-                'count': int(conversions_detail['one_click_leads']),
-                'is_lead': True
-            })
+        def build_campaigns(results):
+            campaigns = results['campaigns']
+            print(f"[LinkedIn Ads] Client {client_id}: Found {len(campaigns)} campaigns")
+            if len(campaigns) == 0:
+                # Debug: check if campaign_name is NULL
+                debug_query = """
+                SELECT
+                    COUNT(*) as total_rows,
+                    COUNT(campaign_name) as rows_with_campaign,
+                    COUNT(DISTINCT campaign_name) as unique_campaigns
+                FROM `mydigipal.linkedin_ads_v2.AdMetrics`
+                WHERE account_name IN UNNEST(@accounts)
+                  AND date_start BETWEEN @date_from AND @date_to
+                """
+                with QueryBatch() as debug_batch:
+                    debug_batch.submit('debug', debug_query, job_config, transform=first_row)
+                    print(f"[LinkedIn Ads] Debug: {debug_batch.results()['debug']}")
+            return campaigns
+
+        def build_conversion_types(results):
+            conversions_detail = results['conversions_detail']
+
+            # Build detailed conversion types
+            conversion_types = []
+
+            if conversions_detail.get('one_click_leads', 0) > 0:
+                conversion_types.append({
+                    'type': 'OneClick Leads',
+                    'count': int(conversions_detail['one_click_leads']),
+                    'is_lead': True
+                })
 
-        if conversions_detail.get('lead_form_opens', 0) > 0:
-            conversion_types.append({
-                'type': 'Lead Form Opens',
-                'count': int(conversions_detail['lead_form_opens']),
-                'is_lead': True
-            })
+            if conversions_detail.get('lead_form_opens', 0) > 0:
+                conversion_types.append({
+                    'type': 'Lead Form Opens',
+                    'count': int(conversions_detail['lead_form_opens']),
+                    'is_lead': True
+                })
 
-        if conversions_detail.get('post_click_conversions', 0) > 0:
-            conversion_types.append({
-                'type': 'External Website Conversions (Post-Click)',
-                'count': int(conversions_detail['post_click_conversions']),
-                'is_lead': False
-            })
+            if conversions_detail.get('post_click_conversions', 0) > 0:
+                conversion_types.append({
+                    'type': 'External Website Conversions (Post-Click)',
+                    'count': int(conversions_detail['post_click_conversions']),
+                    'is_lead': False
+                })
 
-        if conversions_detail.get('post_view_conversions', 0) > 0:
-            conversion_types.append({
-                'type': 'External Website Conversions (Post-View)',
-                'count': int(conversions_detail['post_view_conversions']),
-                'is_lead': False
-            })
+            if conversions_detail.get('post_view_conversions', 0) > 0:
+                conversion_types.append({
+                    'type': 'External Website Conversions (Post-View)',
+                    'count': int(conversions_detail['post_view_conversions']),
+                    'is_lead': False
+                })
 
-        if not conversion_types:
-            conversion_types = [{'type': 'No conversions tracked', 'count': 0, 'is_lead': False}]
+            if not conversion_types:
+                conversion_types = [{'type': 'No conversions tracked', 'count': 0, 'is_lead': False}]
+            return conversion_types
 
-        return jsonify({
-            'summary': summary,
-            'timeline': timeline,
-            'campaigns': campaigns,
-            'conversions_by_type': conversion_types,
+        queries = {
+            'summary': Query(summary_query, job_config_summary, first_row),
+            'timeline': Query(timeline_query, job_config, table_transform()),
+            'campaigns': Query(campaigns_query, job_config),
+            'conversions_detail': Query(conversions_detail_query, job_config, first_row)
+        }
+        sections = {
+            'summary': Section(('summary',), lambda results: results['summary']),
+            'timeline': Section(('timeline',), lambda results: results['timeline']),
+            'campaigns': Section(('campaigns',), build_campaigns),
+            'conversions_by_type': Section(('conversions_detail',), build_conversion_types)
+        }
+        return sections_response('linkedin-ads', queries, sections, {
+            'comparison': comparison_info(date_from, date_to, compare_mode),
             'accounts': accounts
-        })
+        }, ('timeline',))
 
+    except REQUEST_ERRORS:
+        raise
     except Exception as e:
         print(f"Error fetching LinkedIn Ads analytics: {str(e)}")
         traceback.print_exc()
@@ -1631,7 +3139,7 @@ def get_linkedin_ads_analytics():
 
 
 @app.route('/api/analytics/paid-media')
-@cache.cached(timeout=300, query_string=True)
+@cache.cached(timeout=300, query_string=True, unless=is_stream_request, response_filter=is_complete_response)
 def get_paid_media_analytics():
     """Get aggregated Paid Media analytics (Meta + Google Ads + LinkedIn) for a client"""
     try:
@@ -1663,28 +3171,24 @@ def get_paid_media_analytics():
         if client_data.get('linkedin_ads_accounts'):
             linkedin_accounts = [acc.strip() for acc in client_data['linkedin_ads_accounts'].split('|')]
 
-        # Initialize aggregated metrics
-        total_impressions = 0
-        total_clicks = 0
-        total_spend = 0
-        total_leads = 0
-        total_conversions = 0
-
-        timeline_data = {}  # {date: {impressions, clicks, spend, leads, conversions}}
-        platform_breakdown = []
-        all_campaigns = []
-
-        # Helper function to classify leads vs conversions
-        def is_lead(conversion_type):
-            if not conversion_type:
-                return False
-            lower_type = conversion_type.lower()
-            return 'lead' in lower_type or 'formulaire' in lower_type or 'form' in lower_type
-
-        # Fetch Meta Ads data
+        def platform_job_config(accounts):
+            return bigquery.QueryJobConfig(
+                query_parameters=[
+                    bigquery.ArrayQueryParameter("accounts", "STRING", accounts),
+                    bigquery.ScalarQueryParameter("date_from", "DATE", date_from),
+                    bigquery.ScalarQueryParameter("date_to", "DATE", date_to)
+                ]
+            )
+
+        # A failing platform is left out of the report instead of failing it (optional jobs)
+        queries = {}
+        daily_queries = []
+        totals_queries = []
+
+        # Meta Ads data
         if meta_accounts:
-            try:
-                meta_query = """
+            meta_job_config = platform_job_config(meta_accounts)
+            queries['meta_daily'] = Query("""
                 SELECT
                     'Meta Ads' as platform,
                     date_start as date,
@@ -1698,35 +3202,10 @@ def get_paid_media_analytics():
                   AND date_start BETWEEN @date_from AND @date_to
                 GROUP BY date_start
                 ORDER BY date_start
-                """
-
-                meta_job_config = bigquery.QueryJobConfig(
-                    query_parameters=[
-                        bigquery.ArrayQueryParameter("accounts", "STRING", meta_accounts),
-                        bigquery.ScalarQueryParameter("date_from", "DATE", date_from),
-                        bigquery.ScalarQueryParameter("date_to", "DATE", date_to)
-                    ]
-                )
-
-                meta_results = client.query(meta_query, job_config=meta_job_config).result()
+                """, meta_job_config, optional=True)
 
-                meta_totals = {'impressions': 0, 'clicks': 0, 'spend': 0}
-
-                for row in meta_results:
-                    date_key = str(row['date'])
-                    if date_key not in timeline_data:
-                        timeline_data[date_key] = {'impressions': 0, 'clicks': 0, 'spend': 0, 'leads': 0, 'conversions': 0}
-
-                    timeline_data[date_key]['impressions'] += row['impressions'] or 0
-                    timeline_data[date_key]['clicks'] += row['clicks'] or 0
-                    timeline_data[date_key]['spend'] += row['spend'] or 0
-
-                    meta_totals['impressions'] += row['impressions'] or 0
-                    meta_totals['clicks'] += row['clicks'] or 0
-                    meta_totals['spend'] += row['spend'] or 0
-
-                # Get Meta conversions by type
-                meta_conv_query = """
+            # Meta conversions by type
+            queries['meta_conv'] = Query("""
                 SELECT
                     conversion_type,
                     CAST(SUM(conversions) AS INT64) as count
@@ -1735,43 +3214,15 @@ def get_paid_media_analytics():
                   AND date_start BETWEEN @date_from AND @date_to
                   AND conversions > 0
                 GROUP BY conversion_type
-                """
-
-                meta_conv_results = client.query(meta_conv_query, job_config=meta_job_config).result()
-
-                meta_leads = 0
-                meta_conversions = 0
-
-                for row in meta_conv_results:
-                    count = row['count'] or 0
-                    if is_lead(row['conversion_type']):
-                        meta_leads += count
-                    else:
-                        meta_conversions += count
-
-                total_impressions += meta_totals['impressions']
-                total_clicks += meta_totals['clicks']
-                total_spend += meta_totals['spend']
-                total_leads += meta_leads
-                total_conversions += meta_conversions
-
-                platform_breakdown.append({
-                    'platform': 'Meta Ads',
-                    'impressions': meta_totals['impressions'],
-                    'clicks': meta_totals['clicks'],
-                    'spend': meta_totals['spend'],
-                    'leads': meta_leads,
-                    'conversions': meta_conversions,
-                    'ctr': (meta_totals['clicks'] / meta_totals['impressions'] * 100) if meta_totals['impressions'] > 0 else 0
-                })
+                """, meta_job_config, optional=True)
 
-            except Exception as e:
-                print(f"Error fetching Meta Ads: {e}")
+            daily_queries.append('meta_daily')
+            totals_queries += ['meta_daily', 'meta_conv']
 
-        # Fetch Google Ads data
+        # Google Ads data
         if google_accounts:
-            try:
-                google_query = """
+            google_job_config = platform_job_config(google_accounts)
+            queries['google_daily'] = Query("""
                 SELECT
                     'Google Ads' as platform,
                     PARSE_DATE('%Y-%m-%d', date) as date,
@@ -1785,35 +3236,10 @@ def get_paid_media_analytics():
                   AND PARSE_DATE('%Y-%m-%d', date) BETWEEN @date_from AND @date_to
                 GROUP BY date
                 ORDER BY date
-                """
-
-                google_job_config = bigquery.QueryJobConfig(
-                    query_parameters=[
-                        bigquery.ArrayQueryParameter("accounts", "STRING", google_accounts),
-                        bigquery.ScalarQueryParameter("date_from", "DATE", date_from),
-                        bigquery.ScalarQueryParameter("date_to", "DATE", date_to)
-                    ]
-                )
-
-                google_results = client.query(google_query, job_config=google_job_config).result()
-
-                google_totals = {'impressions': 0, 'clicks': 0, 'spend': 0}
-
-                for row in google_results:
-                    date_key = str(row['date'])
-                    if date_key not in timeline_data:
-                        timeline_data[date_key] = {'impressions': 0, 'clicks': 0, 'spend': 0, 'leads': 0, 'conversions': 0}
-
-                    timeline_data[date_key]['impressions'] += row['impressions'] or 0
-                    timeline_data[date_key]['clicks'] += row['clicks'] or 0
-                    timeline_data[date_key]['spend'] += row['spend'] or 0
+                """, google_job_config, optional=True)
 
-                    google_totals['impressions'] += row['impressions'] or 0
-                    google_totals['clicks'] += row['clicks'] or 0
-                    google_totals['spend'] += row['spend'] or 0
-
-                # Get Google Ads conversions by type
-                google_conv_query = """
+            # Google Ads conversions by type
+            queries['google_conv'] = Query("""
                 SELECT
                     conversion_type,
                     CAST(SUM(conversions) AS INT64) as count
@@ -1822,43 +3248,14 @@ def get_paid_media_analytics():
                   AND PARSE_DATE('%Y-%m-%d', date) BETWEEN @date_from AND @date_to
                   AND conversions > 0
                 GROUP BY conversion_type
-                """
-
-                google_conv_results = client.query(google_conv_query, job_config=google_job_config).result()
-
-                google_leads = 0
-                google_conversions = 0
-
-                for row in google_conv_results:
-                    count = row['count'] or 0
-                    if is_lead(row['conversion_type']):
-                        google_leads += count
-                    else:
-                        google_conversions += count
-
-                total_impressions += google_totals['impressions']
-                total_clicks += google_totals['clicks']
-                total_spend += google_totals['spend']
-                total_leads += google_leads
-                total_conversions += google_conversions
-
-                platform_breakdown.append({
-                    'platform': 'Google Ads',
-                    'impressions': google_totals['impressions'],
-                    'clicks': google_totals['clicks'],
-                    'spend': google_totals['spend'],
-                    'leads': google_leads,
-                    'conversions': google_conversions,
-                    'ctr': (google_totals['clicks'] / google_totals['impressions'] * 100) if google_totals['impressions'] > 0 else 0
-                })
+                """, google_job_config, optional=True)
 
-            except Exception as e:
-                print(f"Error fetching Google Ads: {e}")
+            daily_queries.append('google_daily')
+            totals_queries += ['google_daily', 'google_conv']
 
-        # Fetch LinkedIn Ads data
+        # LinkedIn Ads data (leads and conversions are columns of AdMetrics)
         if linkedin_accounts:
-            try:
-                linkedin_query = """
+            queries['linkedin_daily'] = Query("""
                 SELECT
                     'LinkedIn Ads' as platform,
                     date_start as date,
@@ -1872,94 +3269,276 @@ def get_paid_media_analytics():
                   AND date_start BETWEEN @date_from AND @date_to
                 GROUP BY date_start
                 ORDER BY date_start
-                """
+                """, platform_job_config(linkedin_accounts), optional=True)
 
-                linkedin_job_config = bigquery.QueryJobConfig(
-                    query_parameters=[
-                        bigquery.ArrayQueryParameter("accounts", "STRING", linkedin_accounts),
-                        bigquery.ScalarQueryParameter("date_from", "DATE", date_from),
-                        bigquery.ScalarQueryParameter("date_to", "DATE", date_to)
-                    ]
-                )
+            daily_queries.append('linkedin_daily')
+            totals_queries.append('linkedin_daily')
 
-                linkedin_results = client.query(linkedin_query, job_config=linkedin_job_config).result()
+        # Helper function to classify leads vs conversions
+        def is_lead(conversion_type):
+            if not conversion_type:
+                return False
+            lower_type = conversion_type.lower()
+            return 'lead' in lower_type or 'formulaire' in lower_type or 'form' in lower_type
 
-                linkedin_totals = {'impressions': 0, 'clicks': 0, 'spend': 0, 'leads': 0, 'conversions': 0}
+        def build_platform_breakdown(results):
+            platform_breakdown = []
+
+            for platform, daily_name, conv_name in (
+                ('Meta Ads', 'meta_daily', 'meta_conv'),
+                ('Google Ads', 'google_daily', 'google_conv'),
+                ('LinkedIn Ads', 'linkedin_daily', None),
+            ):
+                if daily_name not in queries:
+                    continue
+                daily_rows = results[daily_name]
+                conv_rows = results[conv_name] if conv_name else []
+                if daily_rows is None or conv_rows is None:
+                    print(f"Error fetching {platform}: skipped from report")
+                    continue
+
+                totals = {'impressions': 0, 'clicks': 0, 'spend': 0, 'leads': 0, 'conversions': 0}
+                for row in daily_rows:
+                    for metric in totals:
+                        totals[metric] += row[metric] or 0
+
+                # Meta / Google leads and conversions come from the conversion type tables
+                for row in conv_rows:
+                    count = row['count'] or 0
+                    if is_lead(row['conversion_type']):
+                        totals['leads'] += count
+                    else:
+                        totals['conversions'] += count
 
-                for row in linkedin_results:
-                    date_key = str(row['date'])
-                    if date_key not in timeline_data:
-                        timeline_data[date_key] = {'impressions': 0, 'clicks': 0, 'spend': 0, 'leads': 0, 'conversions': 0}
+                platform_breakdown.append({
+                    'platform': platform,
+                    **totals,
+                    'ctr': (totals['clicks'] / totals['impressions'] * 100) if totals['impressions'] > 0 else 0
+                })
 
-                    timeline_data[date_key]['impressions'] += row['impressions'] or 0
-                    timeline_data[date_key]['clicks'] += row['clicks'] or 0
-                    timeline_data[date_key]['spend'] += row['spend'] or 0
-                    timeline_data[date_key]['leads'] += row['leads'] or 0
-                    timeline_data[date_key]['conversions'] += row['conversions'] or 0
+            return platform_breakdown
 
-                    linkedin_totals['impressions'] += row['impressions'] or 0
-                    linkedin_totals['clicks'] += row['clicks'] or 0
-                    linkedin_totals['spend'] += row['spend'] or 0
-                    linkedin_totals['leads'] += row['leads'] or 0
-                    linkedin_totals['conversions'] += row['conversions'] or 0
+        def build_summary(results):
+            # Calculate summary metrics
+            summary = {'total_impressions': 0, 'total_clicks': 0, 'total_spend': 0, 'total_leads': 0, 'total_conversions': 0}
+            for platform in build_platform_breakdown(results):
+                for metric in ('impressions', 'clicks', 'spend', 'leads', 'conversions'):
+                    summary[f'total_{metric}'] += platform[metric]
 
-                total_impressions += linkedin_totals['impressions']
-                total_clicks += linkedin_totals['clicks']
-                total_spend += linkedin_totals['spend']
-                total_leads += linkedin_totals['leads']
-                total_conversions += linkedin_totals['conversions']
+            summary['avg_ctr'] = (summary['total_clicks'] / summary['total_impressions'] * 100) if summary['total_impressions'] > 0 else 0
+            summary['avg_cpc'] = (summary['total_spend'] / summary['total_clicks']) if summary['total_clicks'] > 0 else 0
+            return summary
 
-                platform_breakdown.append({
-                    'platform': 'LinkedIn Ads',
-                    'impressions': linkedin_totals['impressions'],
-                    'clicks': linkedin_totals['clicks'],
-                    'spend': linkedin_totals['spend'],
-                    'leads': linkedin_totals['leads'],
-                    'conversions': linkedin_totals['conversions'],
-                    'ctr': (linkedin_totals['clicks'] / linkedin_totals['impressions'] * 100) if linkedin_totals['impressions'] > 0 else 0
-                })
+        def build_timeline(results):
+            timeline_data = {}  # {date: {impressions, clicks, spend, leads, conversions}}
+            for name in daily_queries:
+                for row in results[name] or []:
+                    date_key = str(row['date'])
+                    if date_key not in timeline_data:
+                        timeline_data[date_key] = {'impressions': 0, 'clicks': 0, 'spend': 0, 'leads': 0, 'conversions': 0}
+                    for metric in timeline_data[date_key]:
+                        timeline_data[date_key][metric] += row[metric] or 0
 
-            except Exception as e:
-                print(f"Error fetching LinkedIn Ads: {e}")
-
-        # Convert timeline_data to array sorted by date
-        timeline = []
-        for date_key in sorted(timeline_data.keys()):
-            timeline.append({
-                'date': date_key,
-                **timeline_data[date_key]
-            })
+            # Convert timeline_data to array sorted by date
+            return [{'date': date_key, **timeline_data[date_key]} for date_key in sorted(timeline_data)]
 
-        # Calculate summary metrics
-        summary = {
-            'total_impressions': total_impressions,
-            'total_clicks': total_clicks,
-            'total_spend': total_spend,
-            'total_leads': total_leads,
-            'total_conversions': total_conversions,
-            'avg_ctr': (total_clicks / total_impressions * 100) if total_impressions > 0 else 0,
-            'avg_cpc': (total_spend / total_clicks) if total_clicks > 0 else 0
+        sections = {
+            'summary': Section(tuple(totals_queries), build_summary),
+            'timeline': Section(tuple(daily_queries), build_timeline),
+            'platform_breakdown': Section(tuple(totals_queries), build_platform_breakdown)
         }
-
-        return jsonify({
-            'summary': summary,
-            'timeline': timeline,
-            'platform_breakdown': platform_breakdown,
+        return sections_response('paid-media', queries, sections, {
             'platforms_available': {
                 'meta': len(meta_accounts) > 0,
                 'google': len(google_accounts) > 0,
                 'linkedin': len(linkedin_accounts) > 0
             }
-        })
+        }, ('timeline',))
 
+    except REQUEST_ERRORS:
+        raise
     except Exception as e:
         print(f"Error fetching Paid Media analytics: {str(e)}")
         traceback.print_exc()
         return jsonify({"error": f"Failed to fetch Paid Media data: {str(e)}"}), 500
 
 
+# SQL equivalent of is_lead() in get_paid_media_analytics
+LEAD_CONVERSION_SQL = "IFNULL(REGEXP_CONTAINS(LOWER(conversion_type), r'lead|formulaire|form'), FALSE)"
+
+PORTFOLIO_QUERIES = {
+    'meta': f"""
+    WITH metrics AS (
+        SELECT
+            account_name as account,
+            SUM(CAST(impressions AS INT64)) as impressions,
+            SUM(CAST(clicks AS INT64)) as clicks,
+            SUM(CAST(spend AS FLOAT64)) as spend
+        FROM `mydigipal.meta_ads_v2.adsMetrics`
+        WHERE account_name IN UNNEST(@accounts)
+          AND date_start BETWEEN @date_from AND @date_to
+        GROUP BY account_name
+    ),
+    conversions AS (
+        SELECT
+            account_name as account,
+            CAST(SUM(IF({LEAD_CONVERSION_SQL}, conversions, 0)) AS INT64) as leads,
+            CAST(SUM(IF({LEAD_CONVERSION_SQL}, 0, conversions)) AS INT64) as conversions
+        FROM `mydigipal.meta_ads_v2.adsMetricsWithConversionType`
+        WHERE account_name IN UNNEST(@accounts)
+          AND date_start BETWEEN @date_from AND @date_to
+          AND conversions > 0
+        GROUP BY account_name
+    )
+    SELECT account, m.impressions, m.clicks, m.spend, c.leads, c.conversions
+    FROM metrics m
+    FULL OUTER JOIN conversions c USING (account)
+    """,
+    'google': f"""
+    WITH metrics AS (
+        SELECT
+            account,
+            SUM(impressions) as impressions,
+            SUM(clicks) as clicks,
+            SUM(cost) as spend
+        FROM `mydigipal.googleAds_v2.campaignPerformance`
+        WHERE account IN UNNEST(@accounts)
+          AND PARSE_DATE('%Y-%m-%d', date) BETWEEN @date_from AND @date_to
+        GROUP BY account
+    ),
+    conversions AS (
+        SELECT
+            account,
+            CAST(SUM(IF({LEAD_CONVERSION_SQL}, conversions, 0)) AS INT64) as leads,
+            CAST(SUM(IF({LEAD_CONVERSION_SQL}, 0, conversions)) AS INT64) as conversions
+        FROM `mydigipal.googleAds_v2.campaignPerformanceWithConversionType`
+        WHERE account IN UNNEST(@accounts)
+          AND PARSE_DATE('%Y-%m-%d', date) BETWEEN @date_from AND @date_to
+          AND conversions > 0
+        GROUP BY account
+    )
+    SELECT account, m.impressions, m.clicks, m.spend, c.leads, c.conversions
+    FROM metrics m
+    FULL OUTER JOIN conversions c USING (account)
+    """,
+    'linkedin': """
+    SELECT
+        account_name as account,
+        SUM(impressions) as impressions,
+        SUM(clicks) as clicks,
+        SUM(costInLocalCurrency) as spend,
+        SUM(COALESCE(oneClickLeads, 0) + COALESCE(oneClickLeadFormOpens, 0)) as leads,
+        SUM(COALESCE(externalWebsiteConversions, 0)) as conversions
+    FROM `mydigipal.linkedin_ads_v2.AdMetrics`
+    WHERE account_name IN UNNEST(@accounts)
+      AND date_start BETWEEN @date_from AND @date_to
+    GROUP BY account_name
+    """,
+}
+
+PORTFOLIO_METRICS = ('impressions', 'clicks', 'spend', 'leads', 'conversions')
+
+
+def portfolio_cell():
+    return {metric: 0 for metric in PORTFOLIO_METRICS}
+
+
+def finalize_portfolio_cell(cell):
+    cell['ctr'] = (cell['clicks'] / cell['impressions'] * 100) if cell['impressions'] > 0 else 0
+    cell['cpc'] = (cell['spend'] / cell['clicks']) if cell['clicks'] > 0 else 0
+    return cell
+
+
+@app.route('/api/analytics/portfolio')
+@cache.cached(timeout=600, query_string=True)
+def get_portfolio_analytics():
+    """
+    Agency-wide paid media matrix (client x platform) for every client in the registry.
+    Runs one query per platform over all registered accounts, grouped by account,
+    then maps accounts back to clients with the account->client index.
+    """
+    try:
+        date_from = request.args.get('date_from')
+        date_to = request.args.get('date_to')
+
+        if not date_from or not date_to:
+            return jsonify({'error': 'Missing required parameters: date_from, date_to'}), 400
+
+        accounts_map = get_client_accounts_from_sheet()
+        account_index = get_account_client_index()
+
+        with QueryBatch() as batch:
+            for platform, query in PORTFOLIO_QUERIES.items():
+                accounts = sorted(account_index.get(platform, {}))
+                if not accounts:
+                    continue
+                job_config = bigquery.QueryJobConfig(
+                    query_parameters=[
+                        bigquery.ArrayQueryParameter("accounts", "STRING", accounts),
+                        bigquery.ScalarQueryParameter("date_from", "DATE", date_from),
+                        bigquery.ScalarQueryParameter("date_to", "DATE", date_to)
+                    ]
+                )
+                batch.submit(platform, query, job_config)
+            results = batch.results()
+
+        # One row per client that has at least one paid media account
+        matrix = {}
+        for client_id, data in accounts_map.items():
+            platforms = {
+                platform: portfolio_cell() if data.get(field) else None
+                for platform, field in PAID_MEDIA_PLATFORMS.items()
+            }
+            if any(platforms.values()):
+                matrix[client_id] = {
+                    'client_id': client_id,
+                    'client_name': data.get('company_name') or client_id,
+                    'platforms': platforms
+                }
+
+        for platform, rows in results.items():
+            for row in rows:
+                for client_id in account_index[platform].get(row['account'], []):
+                    cell = matrix[client_id]['platforms'][platform]
+                    for metric in PORTFOLIO_METRICS:
+                        cell[metric] += row[metric] or 0
+
+        platform_totals = {platform: portfolio_cell() for platform in PAID_MEDIA_PLATFORMS}
+        grand_total = portfolio_cell()
+        clients_list = []
+        for entry in matrix.values():
+            totals = portfolio_cell()
+            for platform, cell in entry['platforms'].items():
+                if cell is None:
+                    continue
+                for metric in PORTFOLIO_METRICS:
+                    totals[metric] += cell[metric]
+                    platform_totals[platform][metric] += cell[metric]
+                    grand_total[metric] += cell[metric]
+                finalize_portfolio_cell(cell)
+            entry['totals'] = finalize_portfolio_cell(totals)
+            clients_list.append(entry)
+
+        clients_list.sort(key=lambda entry: entry['totals']['spend'], reverse=True)
+
+        return jsonify({
+            'clients': clients_list,
+            'platform_totals': {platform: finalize_portfolio_cell(cell) for platform, cell in platform_totals.items()},
+            'totals': finalize_portfolio_cell(grand_total),
+            'date_from': date_from,
+            'date_to': date_to
+        })
+
+    except REQUEST_ERRORS:
+        raise
+    except Exception as e:
+        print(f"Error fetching portfolio analytics: {str(e)}")
+        traceback.print_exc()
+        return jsonify({"error": f"Failed to fetch portfolio data: {str(e)}"}), 500
+
+
 @app.route('/api/analytics/ga4')
-@cache.cached(timeout=300, query_string=True)
+@cache.cached(timeout=300, query_string=True, unless=is_stream_request, response_filter=is_complete_response)
 def get_ga4_analytics():
     """
     Get Google Analytics 4 data using NEW 5-table structure (Jan 2025):
@@ -1987,9 +3566,11 @@ def get_ga4_analytics():
             bigquery.ScalarQueryParameter("date_to", "STRING", date_to_formatted)
         ])
 
+        queries = {}
+
         # 1. Timeline data from traffic_daily (aggregate by date)
         # Note: All fields are STRING in BQ schema, must CAST to numeric for aggregation
-        timeline_query = """
+        queries['timeline'] = Query("""
         SELECT
             date,
             SUM(SAFE_CAST(sessions AS INT64)) as sessions,
@@ -2004,34 +3585,10 @@ def get_ga4_analytics():
           AND date BETWEEN @date_from AND @date_to
         GROUP BY date
         ORDER BY date
-        """
-        timeline_result = client.query(timeline_query, job_config=job_config).result()
-        timeline = [dict(row) for row in timeline_result]
-
-        # Calculate summary metrics
-        total_sessions = sum(row['sessions'] or 0 for row in timeline)
-        total_users = sum(row['users'] or 0 for row in timeline)
-        total_pageviews = sum(row['pageviews'] or 0 for row in timeline)
-        total_engaged = sum(row['engaged_sessions'] or 0 for row in timeline)
-        avg_bounce_rate = sum(row['bounce_rate'] or 0 for row in timeline) / len(timeline) if timeline else 0
-        avg_duration = sum(row['avg_session_duration'] or 0 for row in timeline) / len(timeline) if timeline else 0
-
-        engagement_rate = (total_engaged / total_sessions * 100) if total_sessions > 0 else 0
-
-        summary = {
-            'sessions': total_sessions,
-            'users': total_users,
-            'new_users': sum(row['new_users'] or 0 for row in timeline),
-            'pageviews': total_pageviews,
-            'engaged_sessions': total_engaged,
-            'engagement_rate': round(engagement_rate, 1),
-            'bounce_rate': round(avg_bounce_rate, 1),
-            'avg_session_duration': round(avg_duration, 0),
-            'pages_per_session': round(total_pageviews / total_sessions, 2) if total_sessions > 0 else 0
-        }
+        """, job_config)
 
         # 2. Traffic sources (channels) from traffic_daily
-        channels_query = """
+        queries['channels'] = Query("""
         SELECT
             sessionDefaultChannelGroup as channel,
             SUM(SAFE_CAST(sessions AS INT64)) as sessions,
@@ -2043,12 +3600,10 @@ def get_ga4_analytics():
           AND date BETWEEN @date_from AND @date_to
         GROUP BY sessionDefaultChannelGroup
         ORDER BY sessions DESC
-        """
-        channels_result = client.query(channels_query, job_config=job_config).result()
-        channels = [dict(row) for row in channels_result]
+        """, job_config)
 
         # 3. Events with categories (LEAD/CONVERSION/ENGAGEMENT)
-        events_query = """
+        queries['events'] = Query("""
         SELECT
             eventName,
             event_category,
@@ -2059,21 +3614,10 @@ def get_ga4_analytics():
           AND date BETWEEN @date_from AND @date_to
         GROUP BY eventName, event_category
         ORDER BY count DESC
-        """
-        events_result = client.query(events_query, job_config=job_config).result()
-        events = [dict(row) for row in events_result]
-
-        # Calculate leads and conversions totals
-        leads_total = sum(e['count'] or 0 for e in events if e.get('event_category') == 'LEAD')
-        conversions_total = sum(e['count'] or 0 for e in events if e.get('event_category') == 'CONVERSION')
-        engagement_total = sum(e['count'] or 0 for e in events if e.get('event_category') == 'ENGAGEMENT')
-
-        summary['leads'] = leads_total
-        summary['conversions'] = conversions_total
-        summary['engagement_events'] = engagement_total
+        """, job_config)
 
         # 4. Top pages from pages table
-        pages_query = """
+        queries['pages'] = Query("""
         SELECT
             pagePath as path,
             SUM(SAFE_CAST(screenPageViews AS INT64)) as views,
@@ -2085,12 +3629,10 @@ def get_ga4_analytics():
         GROUP BY pagePath
         ORDER BY views DESC
         LIMIT 20
-        """
-        pages_result = client.query(pages_query, job_config=job_config).result()
-        pages = [dict(row) for row in pages_result]
+        """, job_config)
 
         # 5. Audience - Device breakdown
-        devices_query = """
+        queries['devices'] = Query("""
         SELECT
             deviceCategory as device,
             SUM(SAFE_CAST(totalUsers AS INT64)) as users,
@@ -2100,12 +3642,10 @@ def get_ga4_analytics():
           AND date BETWEEN @date_from AND @date_to
         GROUP BY deviceCategory
         ORDER BY users DESC
-        """
-        devices_result = client.query(devices_query, job_config=job_config).result()
-        devices = [dict(row) for row in devices_result]
+        """, job_config)
 
         # 6. Audience - Country breakdown
-        countries_query = """
+        queries['countries'] = Query("""
         SELECT
             country,
             SUM(SAFE_CAST(totalUsers AS INT64)) as users,
@@ -2117,21 +3657,74 @@ def get_ga4_analytics():
         GROUP BY country
         ORDER BY users DESC
         LIMIT 10
-        """
-        countries_result = client.query(countries_query, job_config=job_config).result()
-        countries = [dict(row) for row in countries_result]
+        """, job_config)
+
+        # Period comparison of the summary metrics
+        compare_mode = get_compare_mode()
+        summary_queries = ('timeline', 'events')
+        if compare_mode != 'none':
+            compare_config = bigquery.QueryJobConfig(
+                query_parameters=job_config.query_parameters
+                + comparison_params(date_from, date_to, compare_mode, 'STRING', '%Y%m%d')
+            )
+            queries['traffic_comparison'] = Query(build_comparison_query(
+                '`mydigipal.googleAnalytics_v2.traffic_daily`', 'date', 'property_name = @property_name',
+                GA4_TRAFFIC_METRICS, compare_mode
+            ), compare_config, first_row)
+            queries['events_comparison'] = Query(build_comparison_query(
+                '`mydigipal.googleAnalytics_v2.events`', 'date', 'property_name = @property_name',
+                GA4_EVENT_METRICS, compare_mode
+            ), compare_config, first_row)
+            summary_queries += ('traffic_comparison', 'events_comparison')
+
+        def build_summary(results):
+            timeline = results['timeline']
+            events = results['events']
+
+            # Calculate summary metrics
+            total_sessions = sum(row['sessions'] or 0 for row in timeline)
+            total_users = sum(row['users'] or 0 for row in timeline)
+            total_pageviews = sum(row['pageviews'] or 0 for row in timeline)
+            total_engaged = sum(row['engaged_sessions'] or 0 for row in timeline)
+            avg_bounce_rate = sum(row['bounce_rate'] or 0 for row in timeline) / len(timeline) if timeline else 0
+            avg_duration = sum(row['avg_session_duration'] or 0 for row in timeline) / len(timeline) if timeline else 0
+
+            engagement_rate = (total_engaged / total_sessions * 100) if total_sessions > 0 else 0
+
+            summary = {
+                'sessions': total_sessions,
+                'users': total_users,
+                'new_users': sum(row['new_users'] or 0 for row in timeline),
+                'pageviews': total_pageviews,
+                'engaged_sessions': total_engaged,
+                'engagement_rate': round(engagement_rate, 1),
+                'bounce_rate': round(avg_bounce_rate, 1),
+                'avg_session_duration': round(avg_duration, 0),
+                'pages_per_session': round(total_pageviews / total_sessions, 2) if total_sessions > 0 else 0
+            }
 
-        return jsonify({
-            'summary': summary,
-            'timeline': timeline,
-            'channels': channels,
-            'events': events,
-            'pages': pages,
-            'devices': devices,
-            'countries': countries,
+            # Calculate leads and conversions totals
+            summary['leads'] = sum(e['count'] or 0 for e in events if e.get('event_category') == 'LEAD')
+            summary['conversions'] = sum(e['count'] or 0 for e in events if e.get('event_category') == 'CONVERSION')
+            summary['engagement_events'] = sum(e['count'] or 0 for e in events if e.get('event_category') == 'ENGAGEMENT')
+
+            for name in ('traffic_comparison', 'events_comparison'):
+                if name in results:
+                    summary.update(change_fields(results[name]))
+
+            return summary
+
+        sections = {
+            'summary': Section(summary_queries, build_summary),
+            **passthrough_sections(['timeline', 'channels', 'events', 'pages', 'devices', 'countries'])
+        }
+        return sections_response('ga4', queries, sections, {
+            'comparison': comparison_info(date_from, date_to, compare_mode),
             'property_name': property_name
-        })
+        }, ('timeline',))
 
+    except REQUEST_ERRORS:
+        raise
     except Exception as e:
         print(f"Error fetching GA4 analytics: {str(e)}")
         traceback.print_exc()
@@ -2139,7 +3732,7 @@ def get_ga4_analytics():
 
 
 @app.route('/api/analytics/search-console')
-@cache.cached(timeout=600, query_string=True)
+@cache.cached(timeout=600, query_string=True, unless=is_stream_request, response_filter=is_complete_response)
 def get_search_console_data():
     """Get Search Console data for a specific client and date range using global tables"""
     try:
@@ -2212,8 +3805,13 @@ def get_search_console_data():
           AND client_group != ''
         LIMIT 1
         """
-        check_result = client.query(check_query).result()
-        has_client_group = next(check_result).groups_count > 0
+        # Cached per domain set, so requests served from the section cache skip the check
+        check_cache_key = f"gsc_client_group:{','.join(sorted(domains_to_query))}"
+        has_client_group = cache.get(check_cache_key)
+        if has_client_group is None:
+            check_result = client.query(check_query).result()
+            has_client_group = next(check_result).groups_count > 0
+            cache.set(check_cache_key, has_client_group, timeout=SECTION_CACHE_TIMEOUT)
 
         # Build query filters
         if has_client_group:
@@ -2227,70 +3825,76 @@ def get_search_console_data():
         job_config = bigquery.QueryJobConfig(query_parameters=query_params)
 
         # Timeline
-        timeline_query = f"""
+        queries = {}
+        queries['timeline'] = Query(f"""
         SELECT date, SUM(clicks) as clicks, SUM(impressions) as impressions, AVG(ctr) * 100 as ctr, AVG(position) as position
         FROM `mydigipal.search_console_v2.gsc_date`
         WHERE 1=1 {client_filter} {domains_filter_sql} {date_filter}
         GROUP BY date ORDER BY date ASC
-        """
-        timeline = [dict(row) for row in client.query(timeline_query, job_config=job_config).result()]
+        """, job_config, table_transform())
 
         # Top queries
-        queries_query = f"""
+        queries['top_queries'] = Query(f"""
         SELECT query, SUM(clicks) as clicks, SUM(impressions) as impressions, AVG(ctr) * 100 as ctr, AVG(position) as position
         FROM `mydigipal.search_console_v2.gsc_date_query`
         WHERE 1=1 {client_filter} {domains_filter_sql} {date_filter}
         GROUP BY query ORDER BY clicks DESC LIMIT 100
-        """
-        top_queries = [dict(row) for row in client.query(queries_query, job_config=job_config).result()]
+        """, job_config)
 
         # Top pages
-        pages_query = f"""
+        queries['top_pages'] = Query(f"""
         SELECT page, SUM(clicks) as clicks, SUM(impressions) as impressions, AVG(ctr) * 100 as ctr, AVG(position) as position
         FROM `mydigipal.search_console_v2.gsc_date_page`
         WHERE 1=1 {client_filter} {domains_filter_sql} {date_filter}
         GROUP BY page ORDER BY clicks DESC LIMIT 100
-        """
-        top_pages = [dict(row) for row in client.query(pages_query, job_config=job_config).result()]
+        """, job_config)
 
         # Devices
-        device_query = f"""
+        queries['devices'] = Query(f"""
         SELECT device, SUM(clicks) as clicks, SUM(impressions) as impressions, AVG(ctr) * 100 as ctr, AVG(position) as position
         FROM `mydigipal.search_console_v2.gsc_date_device`
         WHERE 1=1 {client_filter} {domains_filter_sql} {date_filter}
         GROUP BY device ORDER BY clicks DESC
-        """
-        devices = [dict(row) for row in client.query(device_query, job_config=job_config).result()]
+        """, job_config)
 
         # Countries
-        country_query = f"""
+        queries['countries'] = Query(f"""
         SELECT country, SUM(clicks) as clicks, SUM(impressions) as impressions, AVG(ctr) * 100 as ctr, AVG(position) as position
         FROM `mydigipal.search_console_v2.gsc_date_country`
         WHERE 1=1 {client_filter} {domains_filter_sql} {date_filter}
         GROUP BY country ORDER BY clicks DESC LIMIT 20
-        """
-        countries = [dict(row) for row in client.query(country_query, job_config=job_config).result()]
+        """, job_config)
 
-        # Summary
-        summary_query = f"""
-        SELECT SUM(clicks) as total_clicks, SUM(impressions) as total_impressions, AVG(ctr) * 100 as avg_ctr, AVG(position) as avg_position
-        FROM `mydigipal.search_console_v2.gsc_date`
-        WHERE 1=1 {client_filter} {domains_filter_sql} {date_filter}
-        """
-        summary_results = client.query(summary_query, job_config=job_config).result()
-        summary = [dict(row) for row in summary_results][0] if summary_results.total_rows > 0 else {}
+        # Summary, with period comparison in the same scan when a full date range is given
+        if date_from and date_to:
+            compare_mode = get_compare_mode()
+            summary_query = build_comparison_query(
+                '`mydigipal.search_console_v2.gsc_date`', 'date',
+                f"1=1 {client_filter} {domains_filter_sql}", GSC_SUMMARY_METRICS, compare_mode
+            )
+            summary_job_config = bigquery.QueryJobConfig(
+                query_parameters=query_params + comparison_params(date_from, date_to, compare_mode, 'STRING')
+            )
+            comparison = comparison_info(date_from, date_to, compare_mode)
+        else:
+            summary_query = f"""
+            SELECT SUM(clicks) as total_clicks, SUM(impressions) as total_impressions, AVG(ctr) * 100 as avg_ctr, AVG(position) as avg_position
+            FROM `mydigipal.search_console_v2.gsc_date`
+            WHERE 1=1 {client_filter} {domains_filter_sql} {date_filter}
+            """
+            summary_job_config = job_config
+            comparison = {'mode': 'none'}
+        queries['summary'] = Query(summary_query, summary_job_config, first_row)
 
-        return jsonify({
-            'summary': summary,
-            'timeline': timeline,
-            'top_queries': top_queries,
-            'top_pages': top_pages,
-            'devices': devices,
-            'countries': countries,
+        sections = passthrough_sections(['summary', 'timeline', 'top_queries', 'top_pages', 'devices', 'countries'])
+        return sections_response('search-console', queries, sections, {
+            'comparison': comparison,
             'domains': domains_to_query,
             'available_domains': available_domains,
             'client_name': client_data.get('company_name', client_id)
-        })
+        }, ('timeline',))
+    except REQUEST_ERRORS:
+        raise
     except Exception as e:
         print(f"Error fetching Search Console data: {str(e)}")
         traceback.print_exc()
@@ -2298,97 +3902,977 @@ def get_search_console_data():
 
 
 # ============================================================================
-# AI REPORTS ENDPOINTS
+# BATCH API
 # ============================================================================
 
-def validate_sql_query(query):
-    """Valide que la requête SQL n'utilise que les tables autorisées"""
-    query_upper = query.upper()
+BATCH_MAX_REQUESTS = 20
+BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', '6'))
 
-    # Extraire les noms de tables de la requête
-    table_pattern = r'(?:FROM|JOIN)\s+`?([a-zA-Z0-9_]+\.[a-zA-Z0-9_]+\.[a-zA-Z0-9_]+)`?'
-    tables_in_query = re.findall(table_pattern, query_upper)
+# Separate from bq_executor: batch items themselves fan out BigQuery jobs there
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_CONCURRENCY, thread_name_prefix='batch')
 
-    # Vérifier que toutes les tables sont autorisées
-    for table in tables_in_query:
-        table_lower = table.lower()
-        if table_lower not in [t.lower() for t in ALLOWED_TABLES]:
-            print(f"[AI Chat] Unauthorized table: {table}")
-            return False
 
-    # Interdire certains mots-clés dangereux
-    dangerous_keywords = ['DROP', 'DELETE', 'TRUNCATE', 'INSERT', 'UPDATE', 'ALTER', 'CREATE']
-    for keyword in dangerous_keywords:
-        if keyword in query_upper:
-            print(f"[AI Chat] Dangerous keyword found: {keyword}")
-            return False
+class SingleFlight:
+    """Collapse concurrent calls for the same key into a single execution shared by all callers."""
 
-    return True
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
 
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
 
-def save_conversation(conversation_id, user_message, assistant_response, sql_executed, sql_results):
-    """Sauvegarde la conversation dans BigQuery"""
-    try:
-        table_id = 'mydigipal.company.ai_conversations'
 
-        rows_to_insert = [{
-            'conversation_id': conversation_id,
-            'timestamp': datetime.utcnow().isoformat(),
-            'user_message': user_message,
-            'assistant_response': assistant_response,
-            'sql_executed': sql_executed,
-            'sql_results_count': len(sql_results) if sql_results else 0,
-            'user_email': 'unknown'  # TODO: Get from session
-        }]
+batch_flight = SingleFlight()
 
-        errors = client.insert_rows_json(table_id, rows_to_insert)
 
-        if errors:
-            print(f"[AI Chat] Error saving conversation: {errors}")
+def batch_item_key(path, params):
+    return f"{path}?{urlencode(sorted(params.items()), doseq=True)}"
 
+
+def dispatch_batch_item(path, params):
+    """
+    Run a GET endpoint in its own request context, through the regular view stack
+    (so @cache.cached entries are shared with direct calls). Returns (status, payload).
+    """
+    try:
+        with app.test_request_context(path, method='GET', query_string=params):
+            response = app.make_response(app.full_dispatch_request())
+            return response.status_code, response.get_json(silent=True)
     except Exception as e:
-        print(f"[AI Chat] Failed to save conversation: {e}")
+        print(f"[Batch] Error resolving {path}: {e}")
+        traceback.print_exc()
+        return 500, {'error': str(e)}
 
 
-@app.route('/api/ai-reports/chat', methods=['POST'])
-def ai_chat():
-    """Chat avec Claude pour générer des rapports"""
-    try:
-        if not anthropic_client:
-            return jsonify({'error': 'Anthropic API key not configured'}), 500
+@app.route('/api/batch', methods=['POST'])
+def batch_api():
+    """
+    Resolve several GET resources in one HTTP round-trip.
 
-        data = request.json
-        user_message = data.get('message')
-        conversation_id = data.get('conversation_id')
-        history = data.get('history', [])
+    Body: {"requests": [{"id": "meta", "endpoint": "/api/analytics/meta-ads",
+                         "params": {"client_id": "...", "date_from": "...", "date_to": "..."}}, ...]}
+    Items run concurrently; identical items (same endpoint + params), in this batch or
+    in concurrent batches, are computed once. Each result carries its own status.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        items = data.get('requests')
+
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'requests must be a non-empty list'}), 400
+        if len(items) > BATCH_MAX_REQUESTS:
+            return jsonify({'error': f'At most {BATCH_MAX_REQUESTS} requests per batch'}), 400
+
+        adapter = app.url_map.bind('localhost')
+        results = [None] * len(items)
+        futures = {}
+
+        for i, item in enumerate(items):
+            item = item if isinstance(item, dict) else {}
+            item_id = item.get('id', i)
+            path = (item.get('endpoint') or '').split('?', 1)[0]
+            params = item.get('params') or {}
+            results[i] = {'id': item_id, 'endpoint': path}
+
+            if not path.startswith('/api/') or not isinstance(params, dict):
+                results[i].update(status=400, data={'error': 'Invalid endpoint or params'})
+                continue
+            try:
+                endpoint, _ = adapter.match(path, method='GET')
+            except Exception:
+                results[i].update(status=404, data={'error': f'Unknown GET endpoint: {path}'})
+                continue
+            if endpoint == 'batch_api':
+                results[i].update(status=400, data={'error': 'Nested batches are not allowed'})
+                continue
 
-        if not user_message:
-            return jsonify({'error': 'Message is required'}), 400
+            # Batch items are returned whole, never streamed
+            params = {k: v if isinstance(v, list) else str(v) for k, v in params.items() if k != 'stream'}
+            key = batch_item_key(path, params)
+            if key not in futures:
+                futures[key] = batch_executor.submit(batch_flight.do, key, lambda p=path, q=params: dispatch_batch_item(p, q))
+            results[i]['_key'] = key
 
-        # Générer conversation ID si nouveau
-        if not conversation_id:
-            conversation_id = f"conv_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        for result in results:
+            key = result.pop('_key', None)
+            if key is None:
+                continue
+            status, payload = futures[key].result()
+            result.update(status=status, data=payload)
 
-        # Préparer le contexte pour Claude
-        system_prompt = f"""Tu es un assistant spécialisé dans la création de rapports marketing pour MyDigipal, une agence marketing digital.
+        return jsonify({'results': results})
 
-Ta mission: Générer des rapports clients complets et professionnels basés sur les données analytics (Meta Ads, Google Ads, GA4, Search Console).
+    except Exception as e:
+        print(f"[Batch] Error: {e}")
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
 
-DONNÉES DISPONIBLES:
-{BIGQUERY_SCHEMA}
 
-PROCESSUS DE CRÉATION DE RAPPORT:
-1. **Identifier le client** mentionné dans la question
-2. **Filtrer les données** avec account_name, domain_name ou client_group pour isoler les comptes du client
-3. **Générer les requêtes SQL** appropriées pour chaque plateforme (Meta, Google Ads, GA4, Search Console)
-4. **Utiliser execute_sql** pour chaque requête
-5. **Analyser les résultats** et créer un rapport structuré
+# ============================================================================
+# DATA EXPORTS
+# ============================================================================
 
-STRUCTURE DE RÉPONSE IDÉALE:
-```
-# 📊 Rapport [Client] - [Période]
+# Full, uncapped versions of the dashboard tables (the endpoints stop at LIMIT 50/100).
+# Each table is one aggregated query over the client's accounts for @date_from..@date_to.
+# GET /api/export/<table> streams it page by page from BigQuery as CSV or Parquet, so an
+# export never sits in memory in full.
+DataTable = namedtuple('DataTable', ['sql', 'accounts', 'date_type'])
 
-## Vue d'ensemble
+DATA_TABLES = {
+    'meta-campaigns': DataTable("""
+        SELECT
+            campaign_name,
+            SUM(CAST(impressions AS INT64)) as impressions,
+            SUM(CAST(clicks AS INT64)) as clicks,
+            SAFE_DIVIDE(SUM(CAST(clicks AS INT64)), SUM(CAST(impressions AS INT64))) * 100 as ctr,
+            SUM(CAST(spend AS FLOAT64)) as spend,
+            SAFE_DIVIDE(SUM(CAST(spend AS FLOAT64)), SUM(CAST(clicks AS INT64))) as cpc,
+            COUNTIF(actions IS NOT NULL) as conversions
+        FROM `mydigipal.meta_ads_v2.adsMetrics`
+        WHERE account_name IN UNNEST(@accounts)
+          AND date_start BETWEEN @date_from AND @date_to
+        GROUP BY campaign_name
+        ORDER BY spend DESC
+        """, 'meta_ads_accounts', 'DATE'),
+    'google-campaigns': DataTable("""
+        SELECT
+            campaign_name,
+            SUM(impressions) as impressions,
+            SUM(clicks) as clicks,
+            SAFE_DIVIDE(SUM(clicks), SUM(impressions)) * 100 as ctr,
+            SUM(cost) as cost,
+            SAFE_DIVIDE(SUM(cost), SUM(clicks)) as cpc,
+            SUM(conversions) as conversions,
+            SUM(conversions_value) as conversion_value
+        FROM `mydigipal.googleAds_v2.campaignPerformance`
+        WHERE account IN UNNEST(@accounts)
+          AND PARSE_DATE('%Y-%m-%d', date) BETWEEN @date_from AND @date_to
+        GROUP BY campaign_name
+        ORDER BY cost DESC
+        """, 'google_ads_accounts', 'DATE'),
+    'linkedin-campaigns': DataTable("""
+        SELECT
+            COALESCE(campaign_name, 'Sans nom de campagne') as campaign_name,
+            campaign_id,
+            SUM(COALESCE(impressions, 0)) as impressions,
+            SUM(COALESCE(clicks, 0)) as clicks,
+            SAFE_DIVIDE(SUM(COALESCE(clicks, 0)), SUM(COALESCE(impressions, 0))) * 100 as ctr,
+            SUM(COALESCE(costInLocalCurrency, 0)) as cost,
+            SAFE_DIVIDE(SUM(COALESCE(costInLocalCurrency, 0)), SUM(COALESCE(clicks, 0))) as cpc,
+            SUM(COALESCE(oneClickLeads, 0) + COALESCE(oneClickLeadFormOpens, 0)) as leads,
+            SUM(COALESCE(externalWebsiteConversions, 0)) as conversions,
+            SUM(COALESCE(landingPageClicks, 0)) as landing_page_clicks,
+            SUM(COALESCE(totalEngagements, 0)) as total_engagements
+        FROM `mydigipal.linkedin_ads_v2.AdMetrics`
+        WHERE account_name IN UNNEST(@accounts)
+          AND date_start BETWEEN @date_from AND @date_to
+        GROUP BY campaign_name, campaign_id
+        ORDER BY cost DESC
+        """, 'linkedin_ads_accounts', 'DATE'),
+    'google-keywords': DataTable("""
+        SELECT
+            keyword as keyword_text,
+            SUM(impressions) as impressions,
+            SUM(clicks) as clicks,
+            SAFE_DIVIDE(SUM(clicks), SUM(impressions)) * 100 as ctr,
+            SUM(cost) as cost,
+            SAFE_DIVIDE(SUM(cost), SUM(clicks)) as cpc,
+            SUM(conversions) as conversions
+        FROM `mydigipal.googleAds_v2.keywordPerformance`
+        WHERE account IN UNNEST(@accounts)
+          AND PARSE_DATE('%Y-%m-%d', date) BETWEEN @date_from AND @date_to
+        GROUP BY keyword
+        ORDER BY clicks DESC
+        """, 'google_ads_accounts', 'DATE'),
+    # Search Console tables are filtered by the client's domains (not by client_group)
+    'gsc-queries': DataTable("""
+        SELECT query, SUM(clicks) as clicks, SUM(impressions) as impressions, AVG(ctr) * 100 as ctr, AVG(position) as position
+        FROM `mydigipal.search_console_v2.gsc_date_query`
+        WHERE domain_name IN UNNEST(@accounts)
+          AND date BETWEEN @date_from AND @date_to
+        GROUP BY query ORDER BY clicks DESC
+        """, 'gsc_domains', 'STRING'),
+    'gsc-pages': DataTable("""
+        SELECT page, SUM(clicks) as clicks, SUM(impressions) as impressions, AVG(ctr) * 100 as ctr, AVG(position) as position
+        FROM `mydigipal.search_console_v2.gsc_date_page`
+        WHERE domain_name IN UNNEST(@accounts)
+          AND date BETWEEN @date_from AND @date_to
+        GROUP BY page ORDER BY clicks DESC
+        """, 'gsc_domains', 'STRING'),
+    # client_id is optional here: all clients when absent
+    'timesheets': DataTable("""
+        SELECT
+          t.date,
+          t.client_id,
+          COALESCE(c.client_name, t.client_id) as client_name,
+          t.employee_id,
+          COALESCE(e.employee_name, t.employee_id) as employee_name,
+          ROUND(SUM(t.hours), 2) AS hours
+        FROM `mydigipal.company.timesheets_fct` t
+        LEFT JOIN `mydigipal.company.clients_dim` c ON t.client_id = c.client_id
+        LEFT JOIN `mydigipal.company.employees_dim` e ON t.employee_id = e.employee_id
+        WHERE t.hours > 0
+          AND (@client_id IS NULL OR t.client_id = @client_id)
+          AND t.date BETWEEN @date_from AND @date_to
+        GROUP BY 1, 2, 3, 4, 5
+        ORDER BY 1, 3, 5
+        """, None, 'DATE')
+}
+
+EXPORT_FORMATS = ('csv', 'parquet')
+EXPORT_PAGE_SIZE = 10000
+
+
+def data_table_job_config(name):
+    """QueryJobConfig of DATA_TABLES[name] for the request's client_id, date_from and date_to."""
+    if name not in DATA_TABLES:
+        raise DataTableRequestError(f"Unknown table '{name}'. Available: {', '.join(DATA_TABLES)}", 404)
+    table = DATA_TABLES[name]
+
+    client_id = request.args.get('client_id')
+    date_from = request.args.get('date_from')
+    date_to = request.args.get('date_to')
+    if not date_from or not date_to or (table.accounts and not client_id):
+        required = 'client_id, date_from, date_to' if table.accounts else 'date_from, date_to'
+        raise DataTableRequestError(f"Missing required parameters: {required}")
+
+    params = [
+        bigquery.ScalarQueryParameter("date_from", table.date_type, date_from),
+        bigquery.ScalarQueryParameter("date_to", table.date_type, date_to)
+    ]
+    if table.accounts:
+        client_data = get_client_accounts_from_sheet().get(client_id) or {}
+        accounts = [acc.strip() for acc in (client_data.get(table.accounts) or '').split('|') if acc.strip()]
+        if not accounts:
+            raise DataTableRequestError(f"No {table.accounts} found for client: {client_id}", 404)
+        params.append(bigquery.ArrayQueryParameter("accounts", "STRING", accounts))
+    else:
+        params.append(bigquery.ScalarQueryParameter("client_id", "STRING", client_id))
+    return bigquery.QueryJobConfig(query_parameters=params)
+
+
+def csv_chunks(rows):
+    """CSV text of a RowIterator, one chunk per BigQuery page (UTF-8 BOM for Excel)."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow([field.name for field in rows.schema])
+    for page in rows.pages:
+        for row in page:
+            writer.writerow(row_values(row))
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+class StreamSink:
+    """Write-only file object whose bytes are handed out as soon as they are written."""
+
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def parquet_chunks(rows):
+    """Parquet file of a RowIterator, one row group per BigQuery page."""
+    sink = StreamSink()
+    writer = None
+    for batch in rows.to_arrow_iterable():
+        if writer is None:
+            writer = pyarrow.parquet.ParquetWriter(sink, batch.schema, compression='snappy')
+        writer.write_table(pyarrow.Table.from_batches([batch]))
+        yield sink.take()
+    if writer is None:  # no rows: an empty file with the result schema
+        writer = pyarrow.parquet.ParquetWriter(sink, pyarrow.schema([]))
+    writer.close()
+    yield sink.take()
+
+
+@app.route('/api/export/<table>')
+def export_table(table):
+    """
+    Stream a full data table as CSV (default) or Parquet.
+
+    Query params: client_id, date_from, date_to, format=csv|parquet
+    Tables: meta-campaigns, google-campaigns, linkedin-campaigns, google-keywords,
+    gsc-queries, gsc-pages, timesheets (client_id optional)
+    """
+    try:
+        fmt = request.args.get('format', 'csv')
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({'error': f"Unknown format '{fmt}'. Available: {', '.join(EXPORT_FORMATS)}"}), 400
+        if fmt == 'parquet' and pyarrow is None:
+            return jsonify({'error': 'format=parquet is not available (pyarrow is not installed)'}), 400
+
+        job_config = data_table_job_config(table)
+        rows = client.query(DATA_TABLES[table].sql, job_config=job_config).result(page_size=EXPORT_PAGE_SIZE)
+        print(f"[Export] {table}: {rows.total_rows} rows as {fmt}")
+
+        def generate():
+            try:
+                yield from (parquet_chunks(rows) if fmt == 'parquet' else csv_chunks(rows))
+            except Exception as e:
+                # Headers are already sent: the truncated file is the only signal left
+                print(f"[Export] {table} interrupted: {e}")
+                traceback.print_exc()
+
+        parts = [table, request.args.get('client_id'), request.args.get('date_from'), request.args.get('date_to')]
+        filename = '_'.join(part for part in parts if part) + f'.{fmt}'
+        mimetype = 'application/vnd.apache.parquet' if fmt == 'parquet' else 'text/csv'
+        return Response(stream_with_context(generate()), mimetype=mimetype, headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'X-Total-Rows': str(rows.total_rows)
+        })
+
+    except REQUEST_ERRORS:
+        raise
+    except Exception as e:
+        print(f"[Export] Error exporting {table}: {e}")
+        traceback.print_exc()
+        return jsonify({'error': f"Failed to export {table}: {str(e)}"}), 500
+
+
+# ============================================================================
+# DATA EXPLORER
+# ============================================================================
+
+# GET /api/explore/<table> pages through the full DATA_TABLES results (long-tail campaigns,
+# keywords, queries, pages). Each (table, client, period) is queried once and kept in memory
+# as a TableSnapshot; sorting, search and pagination are then served from it without
+# further BigQuery jobs. Sort orders are computed on first use per column and reused.
+# Snapshots are bounded in memory (the API runs in one worker of a 512 MiB instance): a
+# result above EXPLORER_MAX_ROWS is refused (413, /api/export streams it instead) and the
+# cache evicts the least recently used snapshots past EXPLORER_MAX_BYTES (estimated).
+EXPLORER_CACHE_TIMEOUT = SECTION_CACHE_TIMEOUT
+EXPLORER_MAX_SNAPSHOTS = int(os.environ.get('EXPLORER_MAX_SNAPSHOTS', '32'))
+EXPLORER_MAX_ROWS = int(os.environ.get('EXPLORER_MAX_ROWS', '200000'))
+EXPLORER_MAX_BYTES = int(os.environ.get('EXPLORER_MAX_BYTES', str(128 * 1024 * 1024)))
+EXPLORER_SIZE_SAMPLE = 1000  # rows measured to estimate a snapshot's size
+EXPLORER_PAGE_SIZE = 50
+EXPLORER_MAX_PAGE_SIZE = 500
+
+
+class TableSnapshot:
+    """Full result of a data table: row tuples, per-column sort orders and a search index."""
+
+    def __init__(self, names, rows, search_column):
+        self.names = names
+        self.rows = rows
+        self.search_column = search_column
+        self.materialized_at = datetime.utcnow().isoformat()
+        self._lock = threading.Lock()
+        self._orders = {}
+
+        # Lower-cased search texts, plus the same texts sorted for prefix lookups by bisection
+        if search_column is None:
+            self._texts = []
+        else:
+            column = names.index(search_column)
+            self._texts = [str(row[column] or '').lower() for row in rows]
+        prefix_index = sorted(range(len(self._texts)), key=self._texts.__getitem__)
+        self._prefix_keys = [self._texts[i] for i in prefix_index]
+        self._prefix_rows = np.array(prefix_index, dtype=np.int64)
+        self.estimated_bytes = self._estimate_bytes()
+
+    def _estimate_bytes(self):
+        """Approximate memory held: rows and search texts measured on a sample, plus the index lists."""
+        if not self.rows:
+            return 0
+        step = max(len(self.rows) // EXPLORER_SIZE_SAMPLE, 1)
+        sample = range(0, len(self.rows), step)
+        per_row = sum(sys.getsizeof(self.rows[i]) + sum(sys.getsizeof(value) for value in self.rows[i])
+                      for i in sample) / len(sample)
+        if self._texts:
+            per_row += sum(sys.getsizeof(self._texts[i]) for i in sample) / len(sample)
+        # rows, _texts and _prefix_keys list slots, _prefix_rows, first sort order
+        return int(len(self.rows) * (per_row + 3 * 8 + 8 + 8))
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Build from a RowIterator; the first STRING column is the searchable one.
+        Raises DataTableRequestError (413) past EXPLORER_MAX_ROWS rows.
+        """
+        too_large = DataTableRequestError(
+            f"More than {EXPLORER_MAX_ROWS} rows: narrow the period or use /api/export instead", 413)
+        if rows.total_rows is not None and rows.total_rows > EXPLORER_MAX_ROWS:
+            raise too_large
+        values = []
+        for row in rows:
+            if len(values) == EXPLORER_MAX_ROWS:
+                raise too_large
+            values.append(row_values(row))
+        search_column = next((field.name for field in rows.schema if field.field_type == 'STRING'), None)
+        return cls([field.name for field in rows.schema], values, search_column)
+
+    def order(self, column, descending):
+        """Row indices sorted by column, nulls last (query order when column is None)."""
+        if column is None:
+            return np.arange(len(self.rows))
+        key = (column, descending)
+        with self._lock:
+            order = self._orders.get(key)
+        if order is not None:
+            return order
+
+        index = self.names.index(column)
+        values = [row[index] for row in self.rows]
+        if is_metric_column(values):
+            array = metric_array(values)
+            order = np.argsort(-array if descending else array, kind='stable')  # NaN sorts last
+        else:
+            present = [i for i, value in enumerate(values) if value is not None]
+            present.sort(key=lambda i: str(values[i]).lower(), reverse=descending)
+            order = np.array(present + [i for i, value in enumerate(values) if value is None], dtype=np.int64)
+
+        with self._lock:
+            self._orders[key] = order
+        return order
+
+    def matching(self, q, prefix):
+        """Boolean mask of the rows whose search column contains (or starts with) q."""
+        q = q.lower()
+        mask = np.zeros(len(self.rows), dtype=bool)
+        if prefix:
+            start = bisect.bisect_left(self._prefix_keys, q)
+            end = bisect.bisect_left(self._prefix_keys, q + '\U0010ffff', start)
+            mask[self._prefix_rows[start:end]] = True
+        else:
+            mask[[i for i, text in enumerate(self._texts) if q in text]] = True
+        return mask
+
+    def page(self, sort, descending, q, prefix, offset, limit):
+        """(rows as dicts, total matching rows) for one page of a sorted, filtered view."""
+        order = self.order(sort, descending)
+        if q:
+            order = order[self.matching(q, prefix)[order]]
+        return [dict(zip(self.names, self.rows[i])) for i in order[offset:offset + limit].tolist()], len(order)
+
+
+class SnapshotCache:
+    """
+    In-process LRU of TableSnapshots with a time-to-live (not pickled like the Flask cache),
+    bounded by count and by total estimated size (least recently used out first).
+    """
+
+    def __init__(self, max_size, timeout, max_bytes):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, snapshot)
+        self._bytes = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._pop(key)
+                entry = None
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def _pop(self, key):
+        _, snapshot = self._entries.pop(key)
+        self._bytes -= snapshot.estimated_bytes
+
+    def set(self, key, snapshot):
+        if snapshot.estimated_bytes > self.max_bytes:
+            return  # served once, not kept
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (time.monotonic() + self.timeout, snapshot)
+            self._bytes += snapshot.estimated_bytes
+            while len(self._entries) > self.max_size or self._bytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+
+explorer_snapshots = SnapshotCache(EXPLORER_MAX_SNAPSHOTS, EXPLORER_CACHE_TIMEOUT, EXPLORER_MAX_BYTES)
+explorer_flight = SingleFlight()
+
+
+def get_table_snapshot(table):
+    """Snapshot of a data table for the request's client and period, queried at most once at a time."""
+    job_config = data_table_job_config(table)
+    key = (table, request.args.get('client_id'), request.args.get('date_from'), request.args.get('date_to'))
+    snapshot = explorer_snapshots.get(key)
+    if snapshot is not None:
+        return snapshot
+
+    def materialize():
+        with QueryBatch() as batch:
+            batch.submit('table', DATA_TABLES[table].sql, job_config, transform=TableSnapshot.from_rows,
+                         page_size=EXPORT_PAGE_SIZE, max_results=EXPLORER_MAX_ROWS + 1)
+            snapshot = batch.results()['table']
+        explorer_snapshots.set(key, snapshot)
+        print(f"[Explorer] Materialized {table} for {key[1]}: {len(snapshot.rows)} rows, "
+              f"~{snapshot.estimated_bytes // 1024 // 1024} MiB")
+        return snapshot
+
+    return explorer_flight.do(key, materialize)
+
+
+def encode_explorer_cursor(materialized_at, offset):
+    return base64.urlsafe_b64encode(f"{materialized_at}|{offset}".encode()).decode()
+
+
+def decode_explorer_cursor(cursor):
+    materialized_at, _, offset = base64.urlsafe_b64decode(cursor.encode()).decode().partition('|')
+    return materialized_at, int(offset)
+
+
+@app.route('/api/explore/<table>')
+def explore_table(table):
+    """
+    Sort, search and page through a full data table from memory.
+
+    Query params: client_id, date_from, date_to (as /api/export/<table>),
+    sort=<column> (query order when absent), order=asc|desc, q=<text>,
+    match=substring|prefix, limit (<= 500), cursor=<next_cursor of the previous page>
+    """
+    try:
+        sort = request.args.get('sort') or None
+        order = request.args.get('order', 'desc')
+        q = request.args.get('q', '').strip()
+        match = request.args.get('match', 'substring')
+        if order not in ('asc', 'desc') or match not in ('substring', 'prefix'):
+            return jsonify({'error': 'order must be asc or desc, match substring or prefix'}), 400
+        try:
+            limit = min(max(int(request.args.get('limit', EXPLORER_PAGE_SIZE)), 1), EXPLORER_MAX_PAGE_SIZE)
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+
+        snapshot = get_table_snapshot(table)
+        if sort is not None and sort not in snapshot.names:
+            return jsonify({'error': f"Unknown sort column '{sort}'. Available: {', '.join(snapshot.names)}"}), 400
+
+        offset = 0
+        if request.args.get('cursor'):
+            try:
+                materialized_at, offset = decode_explorer_cursor(request.args['cursor'])
+            except (ValueError, UnicodeDecodeError):
+                return jsonify({'error': 'Invalid cursor'}), 400
+            if materialized_at != snapshot.materialized_at:
+                # The table was re-queried since the first page: continue at the same offset
+                print(f"[Explorer] Cursor from snapshot {materialized_at} used on {snapshot.materialized_at}")
+
+        rows, total = snapshot.page(sort, order == 'desc', q, match == 'prefix', offset, limit)
+        next_offset = offset + len(rows)
+        return jsonify({
+            'rows': rows,
+            'total': total,
+            'next_cursor': encode_explorer_cursor(snapshot.materialized_at, next_offset) if next_offset < total else None,
+            'columns': snapshot.names,
+            'search_column': snapshot.search_column,
+            'materialized_at': snapshot.materialized_at
+        })
+
+    except REQUEST_ERRORS:
+        raise
+    except Exception as e:
+        print(f"[Explorer] Error exploring {table}: {e}")
+        traceback.print_exc()
+        return jsonify({'error': f"Failed to explore {table}: {str(e)}"}), 500
+
+
+# ============================================================================
+# AI REPORTS ENDPOINTS
+# ============================================================================
+
+def extract_sql_tables(query):
+    """Noms complets (projet.dataset.table) des tables lues par la requête"""
+    table_pattern = r'(?:FROM|JOIN)\s+`?([a-zA-Z0-9_]+\.[a-zA-Z0-9_]+\.[a-zA-Z0-9_]+)`?'
+    return re.findall(table_pattern, query, flags=re.IGNORECASE)
+
+
+def validate_sql_query(query):
+    """Valide que la requête SQL n'utilise que les tables autorisées"""
+    query_upper = query.upper()
+
+    # Vérifier que toutes les tables sont autorisées
+    for table in extract_sql_tables(query):
+        table_lower = table.lower()
+        if table_lower not in [t.lower() for t in ALLOWED_TABLES]:
+            print(f"[AI Chat] Unauthorized table: {table}")
+            return False
+
+    # Interdire certains mots-clés dangereux
+    dangerous_keywords = ['DROP', 'DELETE', 'TRUNCATE', 'INSERT', 'UPDATE', 'ALTER', 'CREATE']
+    for keyword in dangerous_keywords:
+        if re.search(rf'\b{keyword}\b', query_upper):
+            print(f"[AI Chat] Dangerous keyword found: {keyword}")
+            return False
+
+    return True
+
+
+# Index local des conversations (SQLite): résumé par conversation + messages, mis à jour à
+# chaque sauvegarde. Évite d'agréger toute la table ai_conversations pour l'historique.
+# Les messages antérieurs à la création de l'index (indexed_since) restent dans BigQuery:
+# leurs totaux sont repris une fois par fichier d'index (backfill), leur détail est relu
+# dans BigQuery à la demande. Les messages plus récents sauvegardés ailleurs (autres
+# instances, révision précédente pendant un déploiement, écritures différées ou rejouées
+# en retard) sont repris toutes les AI_HISTORY_SYNC_INTERVAL secondes (sync), en relisant
+# les AI_HISTORY_SYNC_OVERLAP dernières secondes: un message déjà indexé est ignoré.
+AI_HISTORY_DB = os.environ.get('AI_HISTORY_DB', '/tmp/ai-conversations.sqlite3')
+AI_HISTORY_PAGE_SIZE = 50
+AI_HISTORY_MAX_PAGE_SIZE = 200
+AI_HISTORY_SYNC_INTERVAL = int(os.environ.get('AI_HISTORY_SYNC_INTERVAL', '300'))
+AI_HISTORY_SYNC_OVERLAP = 86400  # 1 jour
+AI_HISTORY_SYNC_RETRY = 30  # secondes avant de réessayer, doublé à chaque échec
+AI_HISTORY_SYNC_MAX_RETRY = 3600
+
+
+class ConversationIndex:
+    """Conversations indexées par conversation_id, listées par dernier message (pagination par curseur)."""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS conversations (
+        conversation_id TEXT PRIMARY KEY,
+        started_at TEXT NOT NULL,
+        last_message_at TEXT NOT NULL,
+        message_count INTEGER NOT NULL,
+        last_user_message TEXT,
+        last_assistant_response TEXT,
+        bytes_processed INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS conversations_by_last_message
+        ON conversations (last_message_at DESC, conversation_id DESC);
+    CREATE TABLE IF NOT EXISTS messages (
+        conversation_id TEXT NOT NULL,
+        timestamp TEXT NOT NULL,
+        user_message TEXT,
+        assistant_response TEXT,
+        sql_executed TEXT
+    );
+    CREATE TABLE IF NOT EXISTS index_state (key TEXT PRIMARY KEY, value TEXT);
+    """
+
+    # Même horodatage que la ligne BigQuery du message (voir save_conversation)
+    TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.executescript(self.SCHEMA)
+            # Index files created before the bytes_processed column
+            columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(conversations)")}
+            if 'bytes_processed' not in columns:
+                self._conn.execute(
+                    "ALTER TABLE conversations ADD COLUMN bytes_processed INTEGER NOT NULL DEFAULT 0")
+            # Un message par (conversation, horodatage): la synchronisation ne le compte qu'une fois
+            if self._conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'messages_by_conversation'"
+            ).fetchone():
+                self._conn.execute("""
+                    DELETE FROM messages WHERE rowid NOT IN (
+                        SELECT MIN(rowid) FROM messages GROUP BY conversation_id, timestamp)
+                """)
+                self._conn.execute("DROP INDEX messages_by_conversation")
+            self._conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS messages_by_conversation_timestamp ON messages (conversation_id, timestamp)")
+            # Début de l'index: maintenant, ou premier message d'un index créé avant ce repère
+            self._conn.execute(
+                "INSERT OR IGNORE INTO index_state SELECT 'indexed_since', COALESCE(MIN(timestamp), ?) FROM messages",
+                (datetime.utcnow().strftime(self.TIMESTAMP_FORMAT),)
+            )
+            self.indexed_since = self._conn.execute(
+                "SELECT value FROM index_state WHERE key = 'indexed_since'"
+            ).fetchone()['value']
+
+    def record(self, conversation_id, timestamp, user_message, assistant_response, sql_executed,
+               bytes_processed=0):
+        with self._lock, self._conn:
+            self._add_message(conversation_id, timestamp, user_message, assistant_response, sql_executed,
+                              bytes_processed)
+
+    def _add_message(self, conversation_id, timestamp, user_message, assistant_response, sql_executed,
+                     bytes_processed):
+        """Indexe un message (sous self._lock, dans une transaction); False s'il l'était déjà"""
+        inserted = self._conn.execute(
+            "INSERT OR IGNORE INTO messages VALUES (?, ?, ?, ?, ?)",
+            (conversation_id, timestamp, user_message, assistant_response, sql_executed)
+        ).rowcount
+        if not inserted:
+            return False
+        self._conn.execute("""
+            INSERT INTO conversations (conversation_id, started_at, last_message_at, message_count,
+                                       last_user_message, last_assistant_response, bytes_processed)
+            VALUES (?, ?, ?, 1, ?, ?, ?)
+            ON CONFLICT (conversation_id) DO UPDATE SET
+                started_at = MIN(started_at, excluded.started_at),
+                message_count = message_count + 1,
+                last_user_message = CASE WHEN excluded.last_message_at >= last_message_at
+                                         THEN excluded.last_user_message ELSE last_user_message END,
+                last_assistant_response = CASE WHEN excluded.last_message_at >= last_message_at
+                                               THEN excluded.last_assistant_response ELSE last_assistant_response END,
+                last_message_at = MAX(last_message_at, excluded.last_message_at),
+                bytes_processed = bytes_processed + excluded.bytes_processed
+        """, (conversation_id, timestamp, timestamp, user_message, assistant_response, bytes_processed))
+        return True
+
+    def bytes_processed(self, conversation_id):
+        """Octets analysés par les requêtes de l'IA sur toute la conversation"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT bytes_processed FROM conversations WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone()
+        return row['bytes_processed'] if row else 0
+
+    @staticmethod
+    def encode_cursor(row):
+        return base64.urlsafe_b64encode(f"{row['last_message_at']}|{row['conversation_id']}".encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        last_message_at, _, conversation_id = base64.urlsafe_b64decode(cursor.encode()).decode().partition('|')
+        return last_message_at, conversation_id
+
+    def page(self, limit, cursor=None):
+        """Conversations les plus récentes d'abord; retourne (conversations, curseur suivant ou None)"""
+        params = []
+        where = ""
+        if cursor:
+            where = "WHERE (last_message_at, conversation_id) < (?, ?)"
+            params.extend(self.decode_cursor(cursor))
+        with self._lock:
+            rows = self._conn.execute(f"""
+                SELECT * FROM conversations {where}
+                ORDER BY last_message_at DESC, conversation_id DESC
+                LIMIT ?
+            """, (*params, limit + 1)).fetchall()
+
+        next_cursor = self.encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return [self.summary(row) for row in rows[:limit]], next_cursor
+
+    @staticmethod
+    def summary(row):
+        return {
+            'conversation_id': row['conversation_id'],
+            'started_at': row['started_at'],
+            'last_message_at': row['last_message_at'],
+            'message_count': row['message_count'],
+            'bytes_processed': row['bytes_processed'],
+            'last_exchange': {
+                'user_message': row['last_user_message'],
+                'assistant_response': row['last_assistant_response']
+            }
+        }
+
+    def get(self, conversation_id):
+        """
+        Résumé et messages indexés localement. 'complete' est faux quand une partie des
+        messages n'existe que dans BigQuery (conversation commencée avant l'index).
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM conversations WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone()
+            messages = self._conn.execute(
+                "SELECT timestamp, user_message, assistant_response, sql_executed FROM messages "
+                "WHERE conversation_id = ? ORDER BY timestamp", (conversation_id,)
+            ).fetchall()
+        if row is None:
+            return None
+        messages = [dict(message) for message in messages]
+        complete = len(messages) >= row['message_count'] and row['started_at'] >= self.indexed_since
+        return {**self.summary(row), 'messages': messages, 'complete': complete}
+
+    def backfill(self):
+        """
+        Reprise des messages de BigQuery antérieurs à indexed_since, une seule fois par index.
+        Les conversations déjà indexées depuis (messages plus récents) reçoivent leur nombre
+        de messages, leur date de début et leurs octets antérieurs; leur dernier échange reste
+        celui de l'index.
+        """
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM index_state WHERE key = 'backfilled'").fetchone():
+                return
+        query = """
+        SELECT
+            conversation_id,
+            MIN(timestamp) as started_at,
+            MAX(timestamp) as last_message_at,
+            COUNT(*) as message_count,
+            ARRAY_AGG(STRUCT(user_message, assistant_response) ORDER BY timestamp DESC LIMIT 1)[OFFSET(0)] as last_exchange,
+            IFNULL(SUM(bytes_processed), 0) as bytes_processed
+        FROM `mydigipal.company.ai_conversations`
+        WHERE timestamp < @indexed_since
+        GROUP BY conversation_id
+        """
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ScalarQueryParameter("indexed_since", "TIMESTAMP", datetime.fromisoformat(self.indexed_since))
+        ])
+        rows = [
+            (row['conversation_id'], row['started_at'].strftime(self.TIMESTAMP_FORMAT),
+             row['last_message_at'].strftime(self.TIMESTAMP_FORMAT),
+             row['message_count'], row['last_exchange']['user_message'], row['last_exchange']['assistant_response'],
+             row['bytes_processed'])
+            for row in client.query(query, job_config=job_config).result()
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany("""
+                INSERT INTO conversations (conversation_id, started_at, last_message_at, message_count,
+                                           last_user_message, last_assistant_response, bytes_processed)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (conversation_id) DO UPDATE SET
+                    started_at = MIN(started_at, excluded.started_at),
+                    message_count = message_count + excluded.message_count,
+                    bytes_processed = bytes_processed + excluded.bytes_processed
+            """, rows)
+            self._conn.execute("INSERT OR REPLACE INTO index_state VALUES ('backfilled', ?)",
+                               (datetime.utcnow().isoformat(),))
+        print(f"[AI History] Backfilled {len(rows)} conversations from BigQuery")
+
+    def sync(self):
+        """
+        Reprise des messages de BigQuery depuis la dernière synchronisation (moins
+        AI_HISTORY_SYNC_OVERLAP, sans remonter avant indexed_since qui relève du backfill).
+        Retourne le nombre de messages ajoutés à l'index.
+        """
+        synced_at = datetime.utcnow()
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM index_state WHERE key = 'synced_until'").fetchone()
+        since = datetime.fromisoformat(self.indexed_since)
+        if row is not None:
+            since = max(since, datetime.fromisoformat(row['value']) - timedelta(seconds=AI_HISTORY_SYNC_OVERLAP))
+
+        query = """
+        SELECT conversation_id, timestamp, user_message, assistant_response, sql_executed,
+               IFNULL(bytes_processed, 0) as bytes_processed
+        FROM `mydigipal.company.ai_conversations`
+        WHERE timestamp >= @since
+        """
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ScalarQueryParameter("since", "TIMESTAMP", since)
+        ])
+        messages = list(client.query(query, job_config=job_config).result())
+        added = 0
+        with self._lock, self._conn:
+            for message in messages:
+                added += self._add_message(
+                    message['conversation_id'], message['timestamp'].strftime(self.TIMESTAMP_FORMAT),
+                    message['user_message'], message['assistant_response'], message['sql_executed'],
+                    message['bytes_processed'])
+            self._conn.execute("INSERT OR REPLACE INTO index_state VALUES ('synced_until', ?)",
+                               (synced_at.isoformat(),))
+        if added:
+            print(f"[AI History] Synced {added} messages from BigQuery")
+        return added
+
+    def keep_in_sync(self):
+        """Backfill puis sync toutes les AI_HISTORY_SYNC_INTERVAL secondes, réessayés plus tôt après un échec"""
+        retry = None
+        while True:
+            try:
+                self.backfill()
+                self.sync()
+                retry = None
+            except Exception as e:
+                retry = AI_HISTORY_SYNC_RETRY if retry is None else min(retry * 2, AI_HISTORY_SYNC_MAX_RETRY)
+                print(f"[AI History] Sync failed, retrying in {retry}s: {e}")
+            time.sleep(retry or AI_HISTORY_SYNC_INTERVAL)
+
+
+conversation_index = ConversationIndex(AI_HISTORY_DB)
+threading.Thread(target=conversation_index.keep_in_sync, name='ai-history-sync', daemon=True).start()
+
+
+def save_conversation(conversation_id, user_message, assistant_response, sql_executed, sql_results,
+                      bytes_processed=0):
+    """
+    Sauvegarde la conversation dans BigQuery (écriture différée, voir WriteBehindBuffer).
+    bytes_processed: octets analysés par les requêtes SQL de cet échange
+    (colonne ajoutée par bigquery/add_ai_conversations_bytes_processed.sql).
+    """
+    try:
+        table_id = 'mydigipal.company.ai_conversations'
+        timestamp = datetime.utcnow().strftime(ConversationIndex.TIMESTAMP_FORMAT)
+
+        conversation_index.record(conversation_id, timestamp, user_message, assistant_response, sql_executed,
+                                  bytes_processed)
+
+        bq_writer.insert(table_id, {
+            'conversation_id': conversation_id,
+            'timestamp': timestamp,
+            'user_message': user_message,
+            'assistant_response': assistant_response,
+            'sql_executed': sql_executed,
+            'sql_results_count': len(sql_results) if sql_results else 0,
+            'bytes_processed': bytes_processed,
+            'user_email': 'unknown'  # TODO: Get from session
+        })
+
+    except Exception as e:
+        print(f"[AI Chat] Failed to save conversation: {e}")
+
+
+# Contexte système envoyé à Claude: partie fixe (instructions + schéma complet, mise en cache
+# côté Anthropic), suivie de la liste des seules tables utiles à la question (voir build_ai_system)
+AI_SYSTEM_PROMPT = """Tu es un assistant spécialisé dans la création de rapports marketing pour MyDigipal, une agence marketing digital.
+
+Ta mission: Générer des rapports clients complets et professionnels basés sur les données analytics (Meta Ads, Google Ads, GA4, Search Console).
+
+Toutes les tables sont décrites dans SCHÉMA BIGQUERY; celles à utiliser pour cette question sont listées à la fin, dans DONNÉES DISPONIBLES.
+
+PROCESSUS DE CRÉATION DE RAPPORT:
+1. **Identifier le client** mentionné dans la question
+2. **Filtrer les données** avec account_name, domain_name ou client_group pour isoler les comptes du client
+3. **Générer les requêtes SQL** appropriées pour chaque plateforme (Meta, Google Ads, GA4, Search Console)
+4. **Utiliser execute_sql** pour chaque requête
+5. **Analyser les résultats** et créer un rapport structuré
+
+STRUCTURE DE RÉPONSE IDÉALE:
+```
+# 📊 Rapport [Client] - [Période]
+
+## Vue d'ensemble
 - Total impressions: X
 - Total clics: X
 - Dépense totale: X €
@@ -2479,238 +4963,978 @@ EXEMPLES DE QUESTIONS ATTENDUES:
 - "Analyse les performances Meta Ads de GGP sur les 30 derniers jours"
 - "Rapport complet Groupe Théobald du 1er au 15 janvier 2026"
 
-Réponds toujours en FRANÇAIS avec des données formatées et exploitables.
-"""
+Réponds toujours en FRANÇAIS avec des données formatées et exploitables.
+"""
+
+# Schéma par plateforme: dataset BigQuery, préfixe des NOTES IMPORTANTES, mots-clés de la question
+AI_SCHEMA_PLATFORMS = {
+    'meta': ('meta_ads_v2', 'Meta Ads', r'\bmeta\b|facebook|instagram|\bfb\b'),
+    'google': ('googleAds_v2', 'Google Ads', r'google(?!\s*analytics)|adwords|\bsea\b|mots?[- ]cl[ée]s|keywords?'),
+    'ga4': ('googleAnalytics_v2', 'GA4', r'\bga4\b|analytics|sessions?|trafic|traffic|utilisateurs|rebond|landing'),
+    'gsc': ('search_console_v2', 'Search Console', r'search console|\bgsc\b|\bseo\b|organique|requ[êe]tes|positions?'),
+}
+
+
+def split_schema(schema):
+    """Découpe BIGQUERY_SCHEMA en (en-tête, [(dataset, section)], notes)"""
+    chunks = re.split(r'\n(?=## |NOTES IMPORTANTES:)', schema.strip())
+    header, notes = chunks[0], chunks[-1]
+    sections = [(re.match(r'## (\w+)\.', chunk).group(1), chunk) for chunk in chunks[1:-1]]
+    return header, sections, notes
+
+
+SCHEMA_HEADER, SCHEMA_SECTIONS, SCHEMA_NOTES = split_schema(BIGQUERY_SCHEMA)
+
+
+def detect_platforms(question):
+    """Plateformes mentionnées dans la question (ensemble vide si aucune n'est citée)"""
+    question = (question or '').lower()
+    return {platform for platform, (_, _, pattern) in AI_SCHEMA_PLATFORMS.items() if re.search(pattern, question)}
+
+
+def retrieve_schema(question):
+    """
+    Tables des plateformes citées dans la question (plus la table clients), avec les
+    notes qui les concernent. Sans plateforme identifiable (ex: "rapport complet"): None.
+    """
+    platforms = detect_platforms(question)
+    if not platforms:
+        return None
+
+    datasets = {AI_SCHEMA_PLATFORMS[p][0] for p in platforms}
+    note_prefixes = tuple(f"- {AI_SCHEMA_PLATFORMS[p][1]}:" for p in platforms)
+
+    tables = [section.split('\n', 1)[0][3:] for dataset, section in SCHEMA_SECTIONS
+              if dataset == 'company' or dataset in datasets]
+    notes = [line for line in SCHEMA_NOTES.split('\n') if line.startswith(note_prefixes)]
+    return '\n'.join([f"- {table}" for table in tables] + notes)
+
+
+# Préfixe stable de tous les appels: le point de cache est posé après le schéma complet,
+# pour que outils + instructions + schéma dépassent la taille minimale d'un préfixe mis en
+# cache (2048 tokens pour les modèles Haiku, 1024 pour les autres); en dessous, Anthropic
+# ignore le point de cache. anthropic_stub.py vérifie que ce préfixe est bien relu.
+AI_CACHED_SYSTEM = [
+    {"type": "text", "text": AI_SYSTEM_PROMPT},
+    {"type": "text", "text": f"SCHÉMA BIGQUERY:\n{BIGQUERY_SCHEMA.strip()}", "cache_control": {"type": "ephemeral"}}
+]
+
+
+def build_ai_system(question):
+    """
+    Blocs système envoyés à Claude: le préfixe mis en cache (AI_CACHED_SYSTEM), puis la
+    seule partie qui varie, les tables retenues pour la question.
+    """
+    tables = retrieve_schema(question)
+    focus = (f"DONNÉES DISPONIBLES (tables à utiliser pour cette question):\n{tables}" if tables
+             else "DONNÉES DISPONIBLES: toutes les tables du SCHÉMA BIGQUERY.")
+    return [*AI_CACHED_SYSTEM, {"type": "text", "text": focus}]
+
+
+def with_cache_breakpoint(messages):
+    """
+    Copie des messages avec un point de cache sur le dernier bloc: au tour suivant de la
+    boucle agent, tout l'historique déjà envoyé est relu depuis le cache.
+    """
+    *previous, last = messages
+    content = last["content"]
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}]
+    content = [*content[:-1], {**content[-1], "cache_control": {"type": "ephemeral"}}]
+    return [*previous, {**last, "content": content}]
+
+
+def log_ai_usage(response):
+    usage = getattr(response, 'usage', None)
+    if usage is None:
+        return
+    print(
+        f"[AI Chat] Tokens: input={getattr(usage, 'input_tokens', 0)}"
+        f" cache_read={getattr(usage, 'cache_read_input_tokens', 0) or 0}"
+        f" cache_write={getattr(usage, 'cache_creation_input_tokens', 0) or 0}"
+        f" output={getattr(usage, 'output_tokens', 0)}"
+    )
+
+
+AI_MODEL = "claude-3-haiku-20240307"
+AI_MAX_TOKENS = 4096
+
+# Nombre maximum de tours d'outils par message (chaque tour peut lancer plusieurs requêtes SQL)
+AI_MAX_TOOL_ROUNDS = int(os.environ.get('AI_MAX_TOOL_ROUNDS', '8'))
+
+# Résultats SQL mémorisés par requête normalisée + date de dernière modification des tables
+AI_SQL_CACHE_TIMEOUT = 3600  # 1 hour
+TABLE_FRESHNESS_TIMEOUT = 300  # 5 minutes
+
+AI_TOOLS = [{
+    "name": "execute_sql",
+    "description": "Execute a BigQuery SQL query and return the results. Several independent queries can be requested in the same turn: they run in parallel.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "query": {
+                "type": "string",
+                "description": "The SQL query to execute"
+            }
+        },
+        "required": ["query"]
+    }
+}]
+
+# Taille des résultats SQL renvoyés à Claude: au-delà, un résumé statistique remplace les lignes
+AI_RESULT_MAX_ROWS = int(os.environ.get('AI_RESULT_MAX_ROWS', '200'))
+AI_RESULT_MAX_BYTES = int(os.environ.get('AI_RESULT_MAX_BYTES', '50000'))
+AI_RESULT_PAGE_SIZE = 1000
+AI_RESULT_SCAN_LIMIT = 100000  # lignes lues au plus pour le résumé
+AI_RESULT_SAMPLE_ROWS = 10
+AI_RESULT_TOP_VALUES = 5
+AI_RESULT_MAX_DISTINCT = 10000  # valeurs distinctes suivies par colonne
+
+# Garde-fou de coût: chaque requête de l'IA est estimée par un dry run avant exécution
+AI_MAX_BYTES_PER_QUERY = int(os.environ.get('AI_MAX_BYTES_PER_QUERY', str(10 * 1024 ** 3)))  # 10 GiB
+AI_DEFAULT_LOOKBACK_DAYS = 90
+
+# Filtre de date ajouté aux requêtes trop coûteuses, par dataset (GA4: format de date variable, pas de réécriture)
+AI_DATE_FILTERS = {
+    'meta_ads_v2': "date_start >= DATE_SUB(CURRENT_DATE(), INTERVAL {days} DAY)",
+    'googleads_v2': "PARSE_DATE('%Y-%m-%d', date) >= DATE_SUB(CURRENT_DATE(), INTERVAL {days} DAY)",
+    'search_console_v2': "date >= FORMAT_DATE('%Y-%m-%d', DATE_SUB(CURRENT_DATE(), INTERVAL {days} DAY))",
+}
+
+
+class QueryCostError(ValueError):
+    """Requête refusée par le garde-fou de coût (message destiné à Claude)."""
+
+
+# Littéraux et identifiants entre quotes, laissés intacts par la normalisation
+SQL_QUOTED_PATTERN = re.compile(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`)")
+ALLOWED_TABLES_BY_NAME = {table.lower(): table for table in ALLOWED_TABLES}
+
+
+def normalize_sql(query):
+    """Forme canonique d'une requête: commentaires retirés, espaces et casse unifiés hors littéraux"""
+    parts = SQL_QUOTED_PATTERN.split(query)
+    for i in range(0, len(parts), 2):
+        code = re.sub(r'--[^\n]*|#[^\n]*|/\*.*?\*/', ' ', parts[i], flags=re.DOTALL)
+        parts[i] = re.sub(r'\s+', ' ', code).lower()
+    return ''.join(parts).strip().rstrip(';').strip()
+
+
+def table_last_modified(table):
+    """Date de dernière modification d'une table autorisée (None si inconnue)"""
+    table = ALLOWED_TABLES_BY_NAME.get(table.lower(), table)
+    cache_key = f"table_modified:{table}"
+    modified = cache.get(cache_key)
+    if modified is None:
+        try:
+            modified = client.get_table(table).modified.isoformat()
+        except Exception as e:
+            print(f"[AI Chat] Cannot read last modification of {table}: {e}")
+            return None
+        cache.set(cache_key, modified, timeout=TABLE_FRESHNESS_TIMEOUT)
+    return modified
+
+
+def data_freshness_stamp(query):
+    """
+    Empreinte de fraîcheur des données lues par la requête: dernière modification de
+    chaque table, plus la date du jour si la requête dépend de CURRENT_DATE & co.
+    None si la fraîcheur ne peut pas être établie (pas de mise en cache).
+    """
+    stamps = []
+    for table in sorted({t.lower() for t in extract_sql_tables(query)}):
+        modified = table_last_modified(table)
+        if modified is None:
+            return None
+        stamps.append(f"{table}@{modified}")
+    if re.search(r'\bcurrent_(date|datetime|timestamp)\b', query, flags=re.IGNORECASE):
+        stamps.append(datetime.utcnow().strftime('%Y-%m-%d'))
+    return '|'.join(stamps)
+
+
+def ai_sql_cache_key(query):
+    stamp = data_freshness_stamp(query)
+    if stamp is None:
+        return None
+    digest = hashlib.md5(f"{normalize_sql(query)}\n{stamp}".encode('utf-8')).hexdigest()
+    return f"ai_sql:{digest}"
+
+
+def summarize_ai_rows(summary, row):
+    """Ajoute une ligne au résumé par colonne: min/max/somme des nombres et dates, valeurs fréquentes du texte"""
+    for column, value in row.items():
+        stats = summary.setdefault(column, {'count': 0, 'nulls': 0})
+        if value is None:
+            stats['nulls'] += 1
+            continue
+        stats['count'] += 1
+
+        if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+            value = float(value)
+            stats['sum'] = stats.get('sum', 0) + value
+        if isinstance(value, (float, date, datetime)):
+            stats['min'] = value if 'min' not in stats else min(stats['min'], value)
+            stats['max'] = value if 'max' not in stats else max(stats['max'], value)
+        else:
+            # Clés texte: les ARRAY/STRUCT (listes, dicts) ne sont pas hashables
+            key = str(value)
+            values = stats.setdefault('values', Counter())
+            if key in values or len(values) < AI_RESULT_MAX_DISTINCT:
+                values[key] += 1
+
+
+def finalize_ai_summary(summary):
+    for stats in summary.values():
+        if 'sum' in stats:
+            stats['mean'] = stats['sum'] / stats['count'] if stats['count'] else None
+        values = stats.pop('values', None)
+        if values is not None:
+            stats['distinct'] = len(values) if len(values) < AI_RESULT_MAX_DISTINCT else f">={AI_RESULT_MAX_DISTINCT}"
+            stats['top'] = values.most_common(AI_RESULT_TOP_VALUES)
+    return summary
+
+
+def shape_ai_result(rows):
+    """
+    Lit les lignes page par page et borne ce qui est renvoyé à Claude (AI_RESULT_MAX_ROWS
+    lignes, AI_RESULT_MAX_BYTES octets de JSON). Au-delà, seules les premières lignes sont
+    gardées comme échantillon et un résumé statistique par colonne les accompagne.
+    """
+    kept = []
+    size = 0
+    truncated = False
+    summary = {}
+    scanned = 0
+
+    for row in rows:
+        row = dict(row)
+        scanned += 1
+        summarize_ai_rows(summary, row)
+        if truncated:
+            continue
+        size += len(json.dumps(row, default=str))
+        if len(kept) >= AI_RESULT_MAX_ROWS or size > AI_RESULT_MAX_BYTES:
+            truncated = True
+            continue
+        kept.append(row)
+
+    total_rows = getattr(rows, 'total_rows', None) or scanned
+    if not truncated and total_rows <= scanned:
+        return {'rows': kept, 'total_rows': total_rows, 'truncated': False}
+
+    return {
+        'rows': kept[:AI_RESULT_SAMPLE_ROWS],
+        'total_rows': total_rows,
+        'truncated': True,
+        'scanned_rows': scanned,
+        'summary': finalize_ai_summary(summary)
+    }
+
+
+def ai_tool_content(result):
+    """Contenu du tool_result envoyé à Claude pour un résultat SQL mis en forme"""
+    if not result['truncated'] and not result.get('note'):
+        return json.dumps(result['rows'], default=str, ensure_ascii=False)
+    if not result['truncated']:
+        return json.dumps({'note': result['note'], 'rows': result['rows']}, default=str, ensure_ascii=False)
+    return json.dumps({
+        'truncated': True,
+        'cost_note': result.get('note'),
+        'note': (
+            f"Résultat tronqué: {result['total_rows']} lignes au total, seules les "
+            f"{len(result['rows'])} premières sont incluses. Le résumé porte sur les "
+            f"{result['scanned_rows']} premières lignes. Pour le détail, relance une requête "
+            f"agrégée ou avec LIMIT."
+        ),
+        'total_rows': result['total_rows'],
+        'sample_rows': result['rows'],
+        'summary': result['summary']
+    }, default=str, ensure_ascii=False)
+
+
+def format_bytes(num_bytes):
+    for unit in ('o', 'Ko', 'Mo', 'Go'):
+        if num_bytes < 1024:
+            return f"{num_bytes:.0f} {unit}" if unit == 'o' else f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} To"
+
+
+def dry_run_query(query):
+    """(octets à analyser, type d'instruction) estimés par BigQuery sans exécuter la requête"""
+    job = client.query(query, job_config=bigquery.QueryJobConfig(dry_run=True, use_query_cache=False))
+    return job.total_bytes_processed or 0, job.statement_type
+
+
+def add_date_filter(query):
+    """
+    Restreint une requête mono-table aux AI_DEFAULT_LOOKBACK_DAYS derniers jours.
+    None si la requête ne s'y prête pas (jointure, sous-requête, table sans filtre connu).
+    """
+    query = query.strip().rstrip(';')
+    tables = extract_sql_tables(query)
+    if len(tables) != 1 or len(re.findall(r'\bselect\b', query, flags=re.IGNORECASE)) != 1:
+        return None
+    condition = AI_DATE_FILTERS.get(tables[0].split('.')[1].lower())
+    if not condition:
+        return None
+    condition = condition.format(days=AI_DEFAULT_LOOKBACK_DAYS)
+
+    table_end = re.search(r'\bfrom\s+\S+', query, flags=re.IGNORECASE).end()
+    clause_end = re.search(r'\b(group\s+by|having|qualify|window|order\s+by|limit)\b|$',
+                           query[table_end:], flags=re.IGNORECASE).start() + table_end
+    where = re.search(r'\bwhere\b', query[table_end:clause_end], flags=re.IGNORECASE)
+    if where:
+        where_end = table_end + where.end()
+        return f"{query[:where_end]} ({condition}) AND ({query[where_end:clause_end].strip()}) {query[clause_end:]}".rstrip()
+    return f"{query[:clause_end].rstrip()} WHERE {condition} {query[clause_end:]}".rstrip()
+
+
+def gate_ai_query(query):
+    """
+    Estime la requête par un dry run. Au-delà de AI_MAX_BYTES_PER_QUERY, tente de la
+    restreindre aux derniers jours, sinon la refuse (QueryCostError).
+    Retourne (requête à exécuter, octets estimés, note pour Claude ou None).
+    """
+    estimated, statement_type = dry_run_query(query)
+    if statement_type and statement_type != 'SELECT':
+        raise QueryCostError("Requête SQL non autorisée: seules les requêtes SELECT sont acceptées.")
+    print(f"[AI Chat] Dry run: {format_bytes(estimated)}")
+    if estimated <= AI_MAX_BYTES_PER_QUERY:
+        return query, estimated, None
+
+    rewritten = add_date_filter(query)
+    if rewritten:
+        rewritten_bytes, _ = dry_run_query(rewritten)
+        if rewritten_bytes <= AI_MAX_BYTES_PER_QUERY:
+            return rewritten, rewritten_bytes, (
+                f"Requête trop coûteuse ({format_bytes(estimated)} à analyser): elle a été limitée "
+                f"aux {AI_DEFAULT_LOOKBACK_DAYS} derniers jours."
+            )
+
+    raise QueryCostError(
+        f"Requête refusée: {format_bytes(estimated)} à analyser, au-delà du budget de "
+        f"{format_bytes(AI_MAX_BYTES_PER_QUERY)} par requête. Ajoute un filtre de date, "
+        f"sélectionne moins de colonnes ou agrège davantage."
+    )
+
+
+def log_conversation_bytes(conversation_id, bytes_processed):
+    """Total des octets analysés par les requêtes de l'IA pour la conversation (échange courant déjà sauvegardé)"""
+    total = conversation_index.bytes_processed(conversation_id)
+    print(f"[AI Chat] {conversation_id}: {format_bytes(bytes_processed)} analysés ({format_bytes(total)} au total)")
+    return total
+
+
+def iter_ai_tool_calls(tool_uses):
+    """
+    Exécute tous les appels d'outils d'un tour du modèle en parallèle.
+    Produit (index, requête, résultat, erreur, octets analysés) pour chaque appel dès
+    qu'il est terminé (résultat: voir shape_ai_result);
+    une requête en erreur n'empêche pas les autres d'aboutir.
+    """
+    pending = {}  # nom du job -> [(index, requête, clé de cache)]
+
+    for i, block in enumerate(tool_uses):
+        if block.name != "execute_sql":
+            yield i, None, None, f"Outil inconnu: {block.name}", 0
+            continue
+        sql_query = (block.input or {}).get("query", "")
+        # Valider que la requête n'utilise que les tables autorisées
+        if not sql_query or not validate_sql_query(sql_query):
+            yield i, sql_query, None, "Requête SQL non autorisée. Seules certaines tables sont accessibles.", 0
+            continue
+
+        cache_key = ai_sql_cache_key(sql_query)
+        if cache_key is not None:
+            result = cache.get(cache_key)
+            if result is not None:
+                print(f"[AI Chat] SQL cache hit {cache_key}")
+                yield i, result.get('executed_sql', sql_query), result, None, 0
+                continue
+
+        # Une même requête demandée deux fois dans le tour n'est exécutée qu'une fois
+        pending.setdefault(cache_key or block.id, []).append((i, sql_query, cache_key))
+
+    # Dry runs en parallèle, puis exécution des requêtes acceptées avec un plafond de facturation
+    gates = {job_name: bq_executor.submit(gate_ai_query, calls[0][1]) for job_name, calls in pending.items()}
+    accepted = {}  # nom du job -> (requête exécutée, octets estimés, note)
+    job_config = bigquery.QueryJobConfig(maximum_bytes_billed=AI_MAX_BYTES_PER_QUERY)
+
+    with QueryBatch() as batch:
+        for job_name, gate in gates.items():
+            try:
+                accepted[job_name] = gate.result(timeout=max(batch.remaining(), 1))
+            except Exception as e:
+                error = str(e) if isinstance(e, QueryCostError) else f"Erreur lors de l'exécution SQL: {e}"
+                for i, sql_query, cache_key in pending[job_name]:
+                    yield i, sql_query, None, error, 0
+                continue
+            batch.submit(job_name, accepted[job_name][0], job_config, transform=shape_ai_result, optional=True,
+                         page_size=AI_RESULT_PAGE_SIZE, max_results=AI_RESULT_SCAN_LIMIT)
+
+        for job_name in batch.as_completed():
+            result = batch.futures[job_name].result()
+            error = batch.errors.get(job_name)
+            executed_sql, bytes_processed, note = accepted[job_name]
+            calls = pending[job_name]
+            if error is None:
+                if note:
+                    result.update(executed_sql=executed_sql, note=note)
+                if calls[0][2] is not None:
+                    cache.set(calls[0][2], result, timeout=AI_SQL_CACHE_TIMEOUT)
+            for n, (i, sql_query, cache_key) in enumerate(calls):
+                yield (i, executed_sql, result, f"Erreur lors de l'exécution SQL: {error}" if error else None,
+                       bytes_processed if n == 0 else 0)
+
+
+def ai_agent_events(messages, system, stream=False, tools=AI_TOOLS):
+    """
+    Boucle agent: Claude appelle execute_sql autant de fois que nécessaire (les appels
+    d'un même tour s'exécutent en parallèle) jusqu'à produire le rapport final, dans la
+    limite de AI_MAX_TOOL_ROUNDS tours. Sans outils (tools=None), un seul appel au modèle.
+
+    Produit des événements (type, données) au fil de l'eau:
+    - token: morceau de texte généré (uniquement avec stream=True)
+    - tool_start / tool_end: début et fin d'une requête SQL (nombre de lignes, octets analysés ou erreur)
+    - done: réponse finale, requêtes SQL exécutées, lignes obtenues et octets analysés
+    """
+    assistant_response = ""
+    sql_queries = []
+    sql_results = []
+    bytes_processed = 0
+    rounds = 0
+
+    while True:
+        params = dict(
+            model=AI_MODEL,
+            max_tokens=AI_MAX_TOKENS,
+            system=system,
+            messages=with_cache_breakpoint(messages)
+        )
+        if tools:
+            params['tools'] = tools
+        with breakers.get('anthropic').guard():
+            if stream:
+                with anthropic_client.messages.stream(**params) as response_stream:
+                    for text in response_stream.text_stream:
+                        yield 'token', {'text': text}
+                    response = response_stream.get_final_message()
+            else:
+                response = anthropic_client.messages.create(**params)
+        log_ai_usage(response)
+
+        text = "".join(block.text for block in response.content if block.type == "text")
+        if text:
+            assistant_response = text
+
+        tool_uses = [block for block in response.content if block.type == "tool_use"]
+        if not tool_uses:
+            break
+        if rounds >= AI_MAX_TOOL_ROUNDS:
+            print(f"[AI Chat] Tool round limit ({AI_MAX_TOOL_ROUNDS}) reached")
+            break
+        rounds += 1
+
+        for block in tool_uses:
+            yield 'tool_start', {'id': block.id, 'round': rounds, 'query': (block.input or {}).get("query")}
+
+        outcomes = [None] * len(tool_uses)
+        for i, sql_query, result, error, query_bytes in iter_ai_tool_calls(tool_uses):
+            outcomes[i] = (sql_query, result, error)
+            bytes_processed += query_bytes
+            yield 'tool_end', {
+                'id': tool_uses[i].id,
+                'round': rounds,
+                'row_count': result['total_rows'] if result is not None else 0,
+                'truncated': result['truncated'] if result is not None else False,
+                'bytes_processed': query_bytes,
+                'error': error
+            }
+
+        tool_results = []
+        for block, (sql_query, result, error) in zip(tool_uses, outcomes):
+            if error:
+                tool_results.append({
+                    "type": "tool_result",
+                    "tool_use_id": block.id,
+                    "content": error,
+                    "is_error": True
+                })
+                continue
+            sql_queries.append(sql_query)
+            sql_results.extend(result['rows'])
+            tool_results.append({
+                "type": "tool_result",
+                "tool_use_id": block.id,
+                "content": ai_tool_content(result)
+            })
+
+        if rounds == AI_MAX_TOOL_ROUNDS:
+            tool_results.append({
+                "type": "text",
+                "text": "Limite de requêtes atteinte: rédige maintenant le rapport final avec les données obtenues."
+            })
+
+        # Envoyer les résultats à Claude pour analyse
+        messages.append({"role": "assistant", "content": response.content})
+        messages.append({"role": "user", "content": tool_results})
+
+    yield 'done', {
+        'response': assistant_response,
+        'sql_queries': sql_queries,
+        'sql_results': sql_results,
+        'bytes_processed': bytes_processed
+    }
+
+
+def run_ai_agent(messages, system, tools=AI_TOOLS):
+    """Exécute la boucle agent sans streaming. Retourne les données de l'événement done."""
+    for event, payload in ai_agent_events(messages, system, tools=tools):
+        if event == 'done':
+            return payload
+
+
+def new_conversation_id():
+    return f"conv_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+
+
+def build_ai_messages(history, user_message):
+    """Historique envoyé à Claude: 10 derniers messages + message courant"""
+    messages = []
+    for msg in history[-10:]:  # Garder les 10 derniers messages
+        messages.append({"role": msg["role"], "content": msg["content"]})
+
+    messages.append({"role": "user", "content": user_message})
+    return messages
+
+
+def finish_ai_chat(conversation_id, user_message, result, template=None):
+    """Sauvegarde l'échange, cumule les octets analysés et construit la réponse du chat"""
+    sql_queries = result['sql_queries']
+    sql_executed = "\n\n".join(sql_queries) if sql_queries else None
+
+    # Sauvegarder la conversation dans BigQuery
+    save_conversation(conversation_id, user_message, result['response'], sql_executed, result['sql_results'],
+                      result['bytes_processed'])
+    conversation_bytes = log_conversation_bytes(conversation_id, result['bytes_processed'])
+
+    return {
+        'response': result['response'],
+        'conversation_id': conversation_id,
+        'sql_executed': sql_executed,
+        'sql_queries': sql_queries,
+        'bytes_processed': result['bytes_processed'],
+        'conversation_bytes_processed': conversation_bytes,
+        'template': template
+    }
+
+
+def sse_event(event, data):
+    """Formate un événement Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+# Chemin rapide "Rapport <client> <mois>": les données viennent des endpoints analytics
+# (et de leurs caches) au lieu de SQL écrit par le modèle, qui n'a plus qu'à rédiger.
+AI_TEMPLATE_REPORTS = os.environ.get('AI_TEMPLATE_REPORTS', 'true').lower() != 'false'
+TEMPLATE_REPORT_TOP_N = 10
+
+FRENCH_MONTHS = {
+    'janvier': 1, 'fevrier': 2, 'mars': 3, 'avril': 4, 'mai': 5, 'juin': 6, 'juillet': 7,
+    'aout': 8, 'septembre': 9, 'octobre': 10, 'novembre': 11, 'decembre': 12
+}
+
+# Sections demandées à chaque endpoint (les timelines journalières ne servent pas au rapport)
+TEMPLATE_REPORT_SOURCES = [
+    # (source, plateforme pour detect_platforms, champ du registre, endpoint, sections)
+    ('meta', 'meta', 'meta_ads_accounts', '/api/analytics/meta-ads', 'summary,campaigns,conversions_by_type'),
+    ('google_ads', 'google', 'google_ads_accounts', '/api/analytics/google-ads', 'summary,campaigns,keywords,conversions_by_type'),
+    ('linkedin', None, 'linkedin_ads_accounts', '/api/analytics/linkedin-ads', 'summary,campaigns,conversions_by_type'),
+    ('ga4', 'ga4', 'ga4_properties', '/api/analytics/ga4', 'summary,channels,pages,events'),
+    ('search_console', 'gsc', 'gsc_domains', '/api/analytics/search-console', 'summary,top_queries,top_pages'),
+]
+TEMPLATE_REPORT_DROPPED_KEYS = {'accounts', 'available_domains'}
+
+
+def detect_monthly_report(message):
+    """
+    Reconnaît une demande de rapport mensuel standard ("Rapport Vulcain décembre 2025").
+    Retourne {'client_id', 'company_name', 'client', 'date_from', 'date_to'} ou None.
+    """
+    text = re.sub(r'_+', '_', normalize_client_id(message or '') or '')
+    words = text.split('_')
+    if 'rapport' not in words:
+        return None
+    # Les périodes sur mesure ("du 1er au 15 janvier") passent par l'agent SQL
+    if re.search(r'\b\d{1,2}(er)?\s*(au|-)\s*\d{1,2}', (message or '').lower()):
+        return None
+
+    months = [FRENCH_MONTHS[word] for word in words if word in FRENCH_MONTHS]
+    if len(months) != 1:
+        return None
+    month = months[0]
+    years = [int(word) for word in words if re.fullmatch(r'20\d{2}', word)]
+    today = datetime.now().date()
+    year = years[0] if years else (today.year if month <= today.month else today.year - 1)
+
+    # Client: identifiant du registre le plus long présent dans le message
+    padded = f"_{text}_"
+    matches = [client_id for client_id in get_client_accounts_from_sheet() if f"_{client_id}_" in padded]
+    if not matches:
+        return None
+    client_id = max(matches, key=len)
+    client_data = get_client_accounts_from_sheet()[client_id]
+
+    date_from = date(year, month, 1)
+    date_to = (date_from + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return {
+        'client_id': client_id,
+        'company_name': client_data.get('company_name') or client_id,
+        'client': client_data,
+        'date_from': date_from.isoformat(),
+        'date_to': date_to.isoformat()
+    }
+
+
+def compact_report_value(value):
+    """Réduit une réponse analytics pour le modèle: listes limitées au top, flottants arrondis"""
+    if isinstance(value, list):
+        return [compact_report_value(item) for item in value[:TEMPLATE_REPORT_TOP_N]]
+    if isinstance(value, dict):
+        return {key: compact_report_value(item) for key, item in value.items()
+                if item is not None and key not in TEMPLATE_REPORT_DROPPED_KEYS}
+    if isinstance(value, float):
+        return round(value, 2)
+    return value
+
+
+def fetch_monthly_report_data(report, platforms):
+    """
+    Interroge en parallèle les endpoints analytics des plateformes du client (toutes, ou
+    seulement celles citées dans la question) et retourne {source: données compactes}.
+    """
+    client_data = report['client']
+    params = {'client_id': report['client_id'], 'date_from': report['date_from'], 'date_to': report['date_to']}
+
+    futures = {}
+    for source, platform, field, path, sections in TEMPLATE_REPORT_SOURCES:
+        if not client_data.get(field) or (platforms and platform not in platforms):
+            continue
+        if source == 'ga4':
+            source_params = {'property': report['company_name'], 'date_from': report['date_from'],
+                             'date_to': report['date_to'], 'sections': sections}
+        else:
+            source_params = {**params, 'sections': sections}
+        key = batch_item_key(path, source_params)
+        futures[source] = batch_executor.submit(
+            batch_flight.do, key, lambda p=path, q=source_params: dispatch_batch_item(p, q)
+        )
+
+    data = {}
+    for source, future in futures.items():
+        status, payload = future.result()
+        if status == 200 and payload:
+            data[source] = compact_report_value(payload)
+        else:
+            print(f"[AI Chat] Template report: {source} unavailable ({status})")
+    return data
+
+
+def prepare_template_report(user_message):
+    """
+    Chemin rapide pour "Rapport <client> <mois>". Retourne (blocs système, infos) quand la
+    demande est reconnue et que des données existent, sinon None (boucle agent SQL).
+    """
+    if not AI_TEMPLATE_REPORTS:
+        return None
+    report = detect_monthly_report(user_message)
+    if not report:
+        return None
+
+    data = fetch_monthly_report_data(report, detect_platforms(user_message))
+    if not data:
+        return None
+
+    info = {
+        'client_id': report['client_id'],
+        'company_name': report['company_name'],
+        'date_from': report['date_from'],
+        'date_to': report['date_to'],
+        'sources': list(data)
+    }
+    report_data = json.dumps({**info, 'data': data}, default=str, ensure_ascii=False, separators=(',', ':'))
+    system = [
+        *AI_CACHED_SYSTEM,
+        {"type": "text", "text": (
+            "DONNÉES DU RAPPORT (déjà agrégées depuis le dashboard, n'écris pas de SQL). "
+            "Les champs *_change sont les évolutions en % par rapport à la période de comparaison. "
+            "Rédige le rapport avec la structure habituelle, en ne couvrant que les plateformes présentes:\n"
+            + report_data
+        )}
+    ]
+    print(f"[AI Chat] Template report for {report['client_id']} {report['date_from']}: {', '.join(data)}")
+    return system, info
 
-        # Construire l'historique de messages
-        messages = []
-        for msg in history[-10:]:  # Garder les 10 derniers messages
-            messages.append({"role": msg["role"], "content": msg["content"]})
-
-        messages.append({"role": "user", "content": user_message})
-
-        # Définir le tool pour exécution SQL
-        tools = [{
-            "name": "execute_sql",
-            "description": "Execute a BigQuery SQL query and return the results",
-            "input_schema": {
-                "type": "object",
-                "properties": {
-                    "query": {
-                        "type": "string",
-                        "description": "The SQL query to execute"
-                    }
-                },
-                "required": ["query"]
-            }
-        }]
-
-        # Appel Claude avec tool calling
-        response = anthropic_client.messages.create(
-            model="claude-3-haiku-20240307",
-            max_tokens=4096,
-            system=system_prompt,
-            tools=tools,
-            messages=messages
-        )
 
-        # Traiter la réponse et exécuter SQL si nécessaire
-        assistant_response = ""
-        sql_executed = None
-        sql_results = None
+@app.route('/api/ai-reports/chat', methods=['POST'])
+def ai_chat():
+    """Chat avec Claude pour générer des rapports"""
+    try:
+        if not anthropic_client:
+            return jsonify({'error': 'Anthropic API key not configured'}), 500
+
+        data = request.json
+        user_message = data.get('message')
+        conversation_id = data.get('conversation_id')
+        history = data.get('history', [])
+
+        if not user_message:
+            return jsonify({'error': 'Message is required'}), 400
 
-        for block in response.content:
-            if block.type == "text":
-                assistant_response += block.text
-            elif block.type == "tool_use" and block.name == "execute_sql":
-                sql_query = block.input["query"]
+        # Générer conversation ID si nouveau
+        if not conversation_id:
+            conversation_id = new_conversation_id()
 
-                # Valider que la requête n'utilise que les tables autorisées
-                if not validate_sql_query(sql_query):
-                    return jsonify({
-                        'error': 'Requête SQL non autorisée. Seules certaines tables sont accessibles.'
-                    }), 403
+        # Construire l'historique de messages
+        messages = build_ai_messages(history, user_message)
 
-                # Exécuter la requête BigQuery
-                try:
-                    sql_executed = sql_query
-                    query_job = client.query(sql_query)
-                    results = query_job.result()
-
-                    # Convertir résultats en format JSON
-                    sql_results = [dict(row) for row in results]
-
-                    # Envoyer les résultats à Claude pour analyse
-                    messages.append({
-                        "role": "assistant",
-                        "content": response.content
-                    })
-                    messages.append({
-                        "role": "user",
-                        "content": [{
-                            "type": "tool_result",
-                            "tool_use_id": block.id,
-                            "content": json.dumps(sql_results, default=str)
-                        }]
-                    })
-
-                    # Deuxième appel à Claude pour analyser les résultats
-                    final_response = anthropic_client.messages.create(
-                        model="claude-3-haiku-20240307",
-                        max_tokens=4096,
-                        system=system_prompt,
-                        messages=messages
-                    )
-
-                    for final_block in final_response.content:
-                        if final_block.type == "text":
-                            assistant_response = final_block.text
-
-                except Exception as e:
-                    return jsonify({
-                        'error': f'Erreur lors de l\'exécution SQL: {str(e)}'
-                    }), 500
-
-        # Sauvegarder la conversation dans BigQuery
-        save_conversation(conversation_id, user_message, assistant_response, sql_executed, sql_results)
+        template = prepare_template_report(user_message)
+        if template:
+            system, template_info = template
+            result = run_ai_agent(messages, system, tools=None)
+        else:
+            template_info = None
+            result = run_ai_agent(messages, build_ai_system(user_message))
 
-        return jsonify({
-            'response': assistant_response,
-            'conversation_id': conversation_id,
-            'sql_executed': sql_executed
-        })
+        return jsonify(finish_ai_chat(conversation_id, user_message, result, template_info))
 
+    except REQUEST_ERRORS:
+        raise
     except Exception as e:
         print(f"[AI Chat] Error: {e}")
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/ai-reports/chat/stream', methods=['POST'])
+def ai_chat_stream():
+    """
+    Variante streaming de /api/ai-reports/chat (Server-Sent Events).
+    Événements: start, template (chemin rapide), token, tool_start, tool_end, done, error.
+    """
+    if not anthropic_client:
+        return jsonify({'error': 'Anthropic API key not configured'}), 500
+
+    data = request.json or {}
+    user_message = data.get('message')
+    conversation_id = data.get('conversation_id') or new_conversation_id()
+    history = data.get('history', [])
+
+    if not user_message:
+        return jsonify({'error': 'Message is required'}), 400
+
+    messages = build_ai_messages(history, user_message)
+
+    def generate():
+        yield sse_event('start', {'conversation_id': conversation_id})
+        try:
+            template = prepare_template_report(user_message)
+            if template:
+                system, template_info = template
+                tools = None
+                yield sse_event('template', template_info)
+            else:
+                system, template_info, tools = build_ai_system(user_message), None, AI_TOOLS
+
+            for event, payload in ai_agent_events(messages, system, stream=True, tools=tools):
+                if event != 'done':
+                    yield sse_event(event, payload)
+                    continue
+
+                yield sse_event('done', finish_ai_chat(conversation_id, user_message, payload, template_info))
+        except ClientDisconnected:
+            print("[AI Chat] Client disconnected, stream stopped")
+        except Exception as e:
+            print(f"[AI Chat] Stream error: {e}")
+            traceback.print_exc()
+            yield sse_event('error', {'error': str(e)})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 @app.route('/api/ai-reports/history')
-@cache.cached(timeout=60)
 def get_ai_history():
-    """Récupère l'historique des conversations"""
+    """
+    Récupère l'historique des conversations depuis l'index local, les plus récentes d'abord.
+    Pagination: ?limit=50&cursor=<next_cursor de la page précédente>
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', AI_HISTORY_PAGE_SIZE)), 1), AI_HISTORY_MAX_PAGE_SIZE)
+        try:
+            conversations, next_cursor = conversation_index.page(limit, request.args.get('cursor'))
+        except (ValueError, UnicodeDecodeError):
+            return jsonify({'error': 'Invalid cursor'}), 400
+
+        return jsonify({'conversations': conversations, 'next_cursor': next_cursor})
+
+    except Exception as e:
+        print(f"[AI History] Error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/ai-reports/history/<conversation_id>')
+def get_ai_conversation(conversation_id):
+    """Détail d'une conversation: résumé et messages"""
     try:
+        conversation = conversation_index.get(conversation_id)
+        if conversation and conversation.pop('complete'):
+            return jsonify(conversation)
+
+        # Conversation commencée avant l'index local: messages lus dans BigQuery, complétés par
+        # ceux de l'index que l'écriture différée n'y a pas encore envoyés
         query = """
-        SELECT
-            conversation_id,
-            MIN(timestamp) as started_at,
-            MAX(timestamp) as last_message_at,
-            COUNT(*) as message_count,
-            ARRAY_AGG(STRUCT(user_message, assistant_response) ORDER BY timestamp DESC LIMIT 1)[OFFSET(0)] as last_exchange
+        SELECT timestamp, user_message, assistant_response, sql_executed
         FROM `mydigipal.company.ai_conversations`
-        GROUP BY conversation_id
-        ORDER BY last_message_at DESC
-        LIMIT 50
+        WHERE conversation_id = @conversation_id
+        ORDER BY timestamp
         """
-
-        results = client.query(query).result()
-        conversations = [dict(row) for row in results]
-
-        return jsonify(conversations)
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ScalarQueryParameter("conversation_id", "STRING", conversation_id)
+        ])
+        messages = {}
+        for row in client.query(query, job_config=job_config).result():
+            message = dict(row)
+            message['timestamp'] = message['timestamp'].strftime(ConversationIndex.TIMESTAMP_FORMAT)
+            messages[message['timestamp']] = message
+        for message in (conversation or {}).get('messages', []):
+            messages.setdefault(message['timestamp'], message)
+        messages = [messages[timestamp] for timestamp in sorted(messages)]
+        if not messages:
+            return jsonify({'error': 'Conversation not found'}), 404
+
+        if conversation:
+            return jsonify({**conversation, 'message_count': max(conversation['message_count'], len(messages)),
+                            'messages': messages})
+        return jsonify({
+            'conversation_id': conversation_id,
+            'started_at': messages[0]['timestamp'],
+            'last_message_at': messages[-1]['timestamp'],
+            'message_count': len(messages),
+            'last_exchange': {
+                'user_message': messages[-1]['user_message'],
+                'assistant_response': messages[-1]['assistant_response']
+            },
+            'messages': messages
+        })
 
     except Exception as e:
         print(f"[AI History] Error: {e}")
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/api/ai-reports/export-html', methods=['POST'])
-def export_html():
-    """Génère HTML standalone du rapport"""
-    try:
-        data = request.json
-        conversation_id = data.get('conversation_id')
-        client_name = data.get('client_name', 'Client')
-        client_id = data.get('client_id', 'client')
-        report_content = data.get('report_content', '')
-        period = data.get('period', datetime.now().strftime('%B %Y'))
+# Rapports HTML exportés: gabarits Jinja2 compilés une fois au démarrage (le Dockerfile ne
+# copie que main.py, d'où les sources en chaînes). Chaque mise en page étend "base.html";
+# les couleurs de marque sont des variables CSS, surchargeables par requête.
+REPORT_MARKDOWN_EXTENSIONS = ['tables', 'fenced_code', 'sane_lists']
+REPORT_MARKDOWN_CACHE_SIZE = 256
+REPORT_DEFAULT_LAYOUT = 'mydigipal'
 
-        if not conversation_id:
-            return jsonify({'error': 'conversation_id is required'}), 400
+MYDIGIPAL_LOGO_URL = 'https://raw.githubusercontent.com/MyDigipal/website/main/images/logo-mydigipal.png'
+CLIENT_LOGO_URL = 'https://raw.githubusercontent.com/MyDigipal/website/main/images/logos-clients/{client_id}.png'
 
-        # Logo URLs
-        mydigipal_logo = 'https://raw.githubusercontent.com/MyDigipal/website/main/images/logo-mydigipal.png'
-        client_logo = f'https://raw.githubusercontent.com/MyDigipal/website/main/images/logos-clients/{client_id}.png'
+REPORT_BRAND_DEFAULTS = {
+    'primary': '#211F54',
+    'accent': '#0B6CD9',
+    'green': '#11845B',
+    'orange': '#D5691B',
+    'background': '#EFF0F6'
+}
+HEX_COLOR_PATTERN = re.compile(r'^#(?:[0-9a-fA-F]{3}|[0-9a-fA-F]{6})$')
 
-        # Template HTML
-        html_template = f"""<!DOCTYPE html>
+REPORT_TEMPLATE_SOURCES = {
+    'base.html': """<!DOCTYPE html>
 <html lang="fr">
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{client_name} - Rapport Marketing {period}</title>
+    <title>{{ client_name }} - Rapport Marketing {{ period }}</title>
     <link href="https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700;800&display=swap" rel="stylesheet">
     <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
     <style>
-        :root {{
-            --primary: #211F54;
-            --accent-blue: #0B6CD9;
-            --accent-green: #11845B;
-            --accent-orange: #D5691B;
-            --bg-light: #EFF0F6;
+        :root {
+            --primary: {{ brand.primary }};
+            --accent-blue: {{ brand.accent }};
+            --accent-green: {{ brand.green }};
+            --accent-orange: {{ brand.orange }};
+            --bg-light: {{ brand.background }};
             --text-dark: #1a1a2e;
             --text-muted: #6b7280;
             --white: #ffffff;
             --card-shadow: 0 4px 24px rgba(33, 31, 84, 0.08);
-            --gradient-hero: linear-gradient(135deg, #211F54 0%, #0B6CD9 50%, #11845B 100%);
+            --gradient-hero: linear-gradient(135deg, {{ brand.primary }} 0%, {{ brand.accent }} 50%, {{ brand.green }} 100%);
             --gradient-meta: linear-gradient(135deg, #1877F2 0%, #42B72A 100%);
             --gradient-google: linear-gradient(135deg, #F4B400 0%, #EA4335 100%);
-        }}
+        }
 
-        * {{ margin: 0; padding: 0; box-sizing: border-box; }}
+        * { margin: 0; padding: 0; box-sizing: border-box; }
 
-        body {{
+        body {
             font-family: 'Inter', -apple-system, sans-serif;
             background: var(--bg-light);
             color: var(--text-dark);
             line-height: 1.6;
-        }}
+        }
 
-        .header {{
+        .header {
             background: white;
             padding: 2rem;
             box-shadow: var(--card-shadow);
             display: flex;
             justify-content: space-between;
             align-items: center;
-        }}
+        }
 
-        .header-logos {{ display: flex; gap: 2rem; align-items: center; }}
-        .header-logos img {{ height: 60px; object-fit: contain; }}
+        .header-logos { display: flex; gap: 2rem; align-items: center; }
+        .header-logos img { height: 60px; object-fit: contain; }
 
-        .hero {{
+        .hero {
             background: var(--gradient-hero);
             padding: 4rem 2rem;
             color: white;
             text-align: center;
-        }}
+        }
 
-        .hero h1 {{
+        .hero h1 {
             font-size: 3rem;
             font-weight: 700;
             margin-bottom: 0.5rem;
-        }}
+        }
 
-        .hero .subtitle {{
+        .hero .subtitle {
             font-size: 1.3rem;
             opacity: 0.9;
-        }}
+        }
 
-        .container {{
+        .container {
             max-width: 1400px;
             margin: 2rem auto;
             padding: 0 2rem;
-        }}
+        }
 
-        .report-card {{
+        .report-card {
             background: white;
             border-radius: 16px;
             padding: 2rem;
             margin-bottom: 2rem;
             box-shadow: var(--card-shadow);
-        }}
+        }
 
-        .section-title {{
+        .section-title {
             font-size: 1.8rem;
             font-weight: 700;
             color: var(--primary);
@@ -2718,115 +5942,270 @@ def export_html():
             display: flex;
             align-items: center;
             gap: 1rem;
-        }}
+        }
 
-        .section-title::before {{
+        .section-title::before {
             content: '';
             width: 4px;
             height: 2rem;
             background: var(--accent-blue);
             border-radius: 4px;
-        }}
+        }
 
-        .summary-grid {{
+        .summary-grid {
             display: grid;
             grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
             gap: 1.5rem;
             margin-bottom: 2rem;
-        }}
+        }
 
-        .summary-item {{
+        .summary-item {
             text-align: center;
             padding: 1.5rem;
             background: var(--bg-light);
             border-radius: 12px;
-        }}
+        }
 
-        .summary-item .label {{
+        .summary-item .label {
             font-size: 0.85rem;
             color: var(--text-muted);
             text-transform: uppercase;
             letter-spacing: 0.5px;
             margin-bottom: 0.5rem;
-        }}
+        }
 
-        .summary-item .value {{
+        .summary-item .value {
             font-size: 2rem;
             font-weight: 700;
             color: var(--primary);
-        }}
+        }
 
-        table {{
+        table {
             width: 100%;
             border-collapse: collapse;
             margin: 1rem 0;
-        }}
+        }
 
-        th, td {{
+        th, td {
             padding: 1rem;
             text-align: left;
             border-bottom: 1px solid #e2e8f0;
-        }}
+        }
 
-        th {{
+        th {
             background: var(--bg-light);
             font-weight: 600;
             color: var(--primary);
-        }}
+        }
 
-        tr:hover {{ background: #f8fafc; }}
+        tr:hover { background: #f8fafc; }
 
-        .footer {{
+        .footer {
             background: var(--primary);
             color: white;
             padding: 2rem;
             text-align: center;
             margin-top: 4rem;
-        }}
+        }
 
-        .footer-logo {{
+        .footer-logo {
             font-weight: 700;
             font-size: 1.5rem;
             margin-bottom: 0.5rem;
-        }}
+        }
+        .content h1, .content h2, .content h3 {
+            color: var(--primary);
+            margin: 1.5rem 0 0.75rem;
+        }
+
+        .content h2 {
+            padding-left: 0.75rem;
+            border-left: 4px solid var(--accent-blue);
+        }
+
+        .content p, .content ul, .content ol { margin-bottom: 1rem; }
+        .content ul, .content ol { padding-left: 1.5rem; }
+
+        .content code {
+            background: var(--bg-light);
+            padding: 0.1rem 0.35rem;
+            border-radius: 4px;
+            font-size: 0.9em;
+        }
+
+        .content blockquote {
+            border-left: 4px solid var(--accent-green);
+            padding: 0.5rem 1rem;
+            color: var(--text-muted);
+            margin-bottom: 1rem;
+        }
+{% block styles %}{% endblock %}
     </style>
 </head>
 <body>
+{% block header %}
     <div class="header">
         <div class="header-logos">
-            <img src="{mydigipal_logo}" alt="MyDigipal" onerror="this.style.display='none'">
-            <img src="{client_logo}" alt="{client_name}" onerror="this.style.display='none'">
+            <img src="{{ mydigipal_logo }}" alt="MyDigipal" onerror="this.style.display='none'">
+            <img src="{{ client_logo }}" alt="{{ client_name }}" onerror="this.style.display='none'">
         </div>
         <div style="text-align: right;">
             <div style="font-size: 0.85rem; color: var(--text-muted);">Généré le</div>
-            <div style="font-weight: 600;">{datetime.now().strftime('%d %B %Y')}</div>
+            <div style="font-weight: 600;">{{ generated_at }}</div>
         </div>
     </div>
-
+{% endblock %}
+{% block hero %}
     <div class="hero">
-        <h1>{client_name}</h1>
-        <div class="subtitle">Rapport Marketing - {period}</div>
+        <h1>{{ client_name }}</h1>
+        <div class="subtitle">Rapport Marketing - {{ period }}</div>
     </div>
+{% endblock %}
 
     <div class="container">
         <div class="report-card">
             <div class="content">
-                {report_content}
+                {{ content }}
             </div>
         </div>
     </div>
-
+{% block footer %}
     <div class="footer">
         <div class="footer-logo">MyDigipal</div>
         <p style="opacity: 0.8; font-size: 0.9rem;">Rapport généré automatiquement par AI Reports</p>
     </div>
+{% endblock %}
 </body>
-</html>"""
+</html>
+""",
+    # Mise en page historique: en-tête deux logos, bandeau dégradé
+    'mydigipal.html': """{% extends "base.html" %}""",
+    # Sobre et imprimable: fond blanc, pas de dégradé, pied de page discret
+    'minimal.html': """{% extends "base.html" %}
+{% block styles %}
+        body { background: var(--white); }
+        .hero { background: none; color: var(--primary); padding: 2rem 2rem 0; text-align: left; }
+        .container { max-width: 900px; }
+        .report-card { box-shadow: none; padding: 0; }
+        .footer { background: none; color: var(--text-muted); border-top: 1px solid #e2e8f0; margin-top: 2rem; }
+        @media print {
+            .header { box-shadow: none; }
+            .report-card { page-break-inside: auto; }
+        }
+{% endblock %}
+{% block footer %}
+    <div class="footer">
+        <p style="font-size: 0.85rem;">MyDigipal - {{ client_name }} - {{ period }}</p>
+    </div>
+{% endblock %}
+""",
+    # Co-brandée: logo du client en avant, couleurs du client (paramètre brand)
+    'client.html': """{% extends "base.html" %}
+{% block styles %}
+        .hero img { max-height: 90px; margin-bottom: 1.5rem; background: var(--white); border-radius: 12px; padding: 0.75rem; }
+        .footer { background: var(--accent-blue); }
+{% endblock %}
+{% block header %}{% endblock %}
+{% block hero %}
+    <div class="hero">
+        <img src="{{ client_logo }}" alt="{{ client_name }}" onerror="this.style.display='none'">
+        <h1>{{ client_name }}</h1>
+        <div class="subtitle">Rapport Marketing - {{ period }} · {{ generated_at }}</div>
+    </div>
+{% endblock %}
+{% block footer %}
+    <div class="footer">
+        <p style="opacity: 0.9; font-size: 0.9rem;">Rapport préparé par MyDigipal pour {{ client_name }}</p>
+    </div>
+{% endblock %}
+"""
+}
+
+report_env = Environment(loader=DictLoader(REPORT_TEMPLATE_SOURCES), autoescape=True)
+
+# Compilés ici, une seule fois par processus: une erreur de gabarit bloque le démarrage
+REPORT_LAYOUTS = {
+    name[:-len('.html')]: report_env.get_template(name)
+    for name in REPORT_TEMPLATE_SOURCES if name != 'base.html'
+}
+
+
+class MarkdownCache:
+    """Rendu Markdown → HTML mémorisé (LRU) par hash du contenu"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def render(self, text):
+        key = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+                return html
+
+        # markdown.Markdown n'est pas thread-safe: une instance par rendu
+        html = Markup(markdown.markdown(text, extensions=REPORT_MARKDOWN_EXTENSIONS))
+        with self._lock:
+            self._entries[key] = html
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return html
+
+
+report_markdown = MarkdownCache(REPORT_MARKDOWN_CACHE_SIZE)
+
+
+def report_brand(overrides):
+    """Couleurs de marque par défaut, surchargées par les couleurs hex valides de la requête"""
+    brand = dict(REPORT_BRAND_DEFAULTS)
+    for key, value in (overrides or {}).items():
+        if key in brand and isinstance(value, str) and HEX_COLOR_PATTERN.match(value):
+            brand[key] = value
+    return brand
+
+
+def render_report_html(layout, client_name, client_id, period, report_content, brand=None):
+    """Rend le rapport complet avec une mise en page précompilée"""
+    return REPORT_LAYOUTS[layout].render(
+        client_name=client_name,
+        period=period,
+        brand=report_brand(brand),
+        mydigipal_logo=MYDIGIPAL_LOGO_URL,
+        client_logo=CLIENT_LOGO_URL.format(client_id=client_id),
+        generated_at=datetime.now().strftime('%d %B %Y'),
+        content=report_markdown.render(report_content)
+    )
+
+
+@app.route('/api/ai-reports/export-html', methods=['POST'])
+def export_html():
+    """Génère HTML standalone du rapport
+
+    Body optionnel: "layout" (mydigipal, minimal, client) et "brand"
+    ({"primary": "#...", "accent": "#...", "green", "orange", "background"}).
+    """
+    try:
+        data = request.json
+        conversation_id = data.get('conversation_id')
+        client_name = data.get('client_name', 'Client')
+        client_id = data.get('client_id', 'client')
+        report_content = data.get('report_content', '')
+        period = data.get('period', datetime.now().strftime('%B %Y'))
+        layout = data.get('layout', REPORT_DEFAULT_LAYOUT)
+
+        if not conversation_id:
+            return jsonify({'error': 'conversation_id is required'}), 400
+        if layout not in REPORT_LAYOUTS:
+            return jsonify({'error': f"Unknown layout '{layout}'", 'layouts': sorted(REPORT_LAYOUTS)}), 400
 
+        html = render_report_html(layout, client_name, client_id, period, report_content, data.get('brand'))
         filename = f'rapport_{client_id}_{period.replace(" ", "_")}.html'
 
         return jsonify({
-            'html': html_template,
+            'html': html,
             'filename': filename
         })
 
@@ -2836,6 +6215,142 @@ def export_html():
         return jsonify({'error': str(e)}), 500
 
 
+# Rapports partagés: objets adressés par le hash de leur contenu, donc un rapport identique
+# repartagé réutilise l'objet existant. Un seul client Cloud Storage par processus, HTML
+# stocké compressé (gzip, décompressé à la volée par GCS pour les clients qui ne l'acceptent
+# pas), URL signée générée en arrière-plan. REPORTS_STORAGE=local écrit sur disque (tests).
+REPORTS_STORAGE = os.environ.get('REPORTS_STORAGE', 'gcs')
+REPORTS_BUCKET = os.environ.get('REPORTS_BUCKET', 'mydigipal-reports')
+REPORTS_LOCAL_DIR = os.environ.get('REPORTS_LOCAL_DIR', '/tmp/shared-reports')
+REPORTS_PREFIX = 'reports'
+REPORT_SHARE_TTL = timedelta(days=30)
+REPORT_SHORT_ID_LENGTH = 16
+
+storage_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='storage')
+
+
+class GCSReportStorage:
+    """Bucket Cloud Storage avec un client partagé, créé au premier usage"""
+
+    def __init__(self, bucket_name):
+        self.bucket_name = bucket_name
+        self._lock = threading.Lock()
+        self._bucket = None
+
+    @property
+    def bucket(self):
+        with self._lock:
+            if self._bucket is None:
+                self._bucket = storage.Client().bucket(self.bucket_name)
+            return self._bucket
+
+    def exists(self, name):
+        with breakers.get('storage').guard():
+            return self.bucket.blob(name).exists()
+
+    def upload(self, name, data, content_type, content_encoding=None):
+        blob = self.bucket.blob(name)
+        blob.content_encoding = content_encoding
+        with breakers.get('storage').guard():
+            blob.upload_from_string(data, content_type=content_type)
+
+    def public_url(self, name):
+        return f'https://storage.googleapis.com/{self.bucket_name}/{name}'
+
+    def signed_url(self, name, expiration):
+        # La signature peut passer par l'API IAM (signBlob) sur Cloud Run
+        with breakers.get('storage').guard():
+            return self.bucket.blob(name).generate_signed_url(expiration=expiration)
+
+
+class LocalReportStorage:
+    """Même interface que GCSReportStorage, sur le système de fichiers local"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def exists(self, name):
+        return os.path.exists(self._path(name))
+
+    def upload(self, name, data, content_type, content_encoding=None):
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def public_url(self, name):
+        return f'file://{self._path(name)}'
+
+    def signed_url(self, name, expiration):
+        expires = int((datetime.utcnow() + expiration).timestamp())
+        return f'{self.public_url(name)}?expires={expires}'
+
+
+class ReportArtifactStore:
+    """Dépôt dédupliqué des rapports HTML partagés"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def put(self, html_content):
+        """
+        Stocke le rapport s'il est nouveau. Renvoie (short_id, nom de l'objet, créé).
+        L'existence est vérifiée à chaque partage: l'objet peut avoir été supprimé
+        (cycle de vie du bucket ou à la main) depuis le précédent.
+        """
+        data = html_content.encode('utf-8')
+        short_id = hashlib.sha256(data).hexdigest()[:REPORT_SHORT_ID_LENGTH]
+        name = f'{REPORTS_PREFIX}/{short_id}.html'
+
+        if self.backend.exists(name):
+            return short_id, name, False
+        # mtime=0: même contenu, mêmes octets compressés
+        self.backend.upload(name, gzip.compress(data, mtime=0), 'text/html; charset=utf-8',
+                            content_encoding='gzip')
+        return short_id, name, True
+
+    def sign_async(self, name, expiration=REPORT_SHARE_TTL):
+        return storage_executor.submit(self.backend.signed_url, name, expiration)
+
+
+if REPORTS_STORAGE == 'local':
+    report_store = ReportArtifactStore(LocalReportStorage(REPORTS_LOCAL_DIR))
+else:
+    report_store = ReportArtifactStore(GCSReportStorage(REPORTS_BUCKET))
+
+
+def record_shared_report(future, short_id, conversation_id, created_at):
+    """Enregistre le partage dans BigQuery une fois l'URL signée disponible"""
+    try:
+        url = future.result()
+    except Exception as e:
+        print(f"[AI Share] Failed to sign URL for {short_id}: {e}")
+        url = None
+
+    # Sauvegarder metadata dans BigQuery
+    try:
+        table_id = 'mydigipal.company.ai_shared_reports'
+        bq_writer.insert(table_id, {
+            'short_id': short_id,
+            'conversation_id': conversation_id,
+            'public_url': url,
+            'created_at': created_at.isoformat(),
+            'expires_at': (created_at + REPORT_SHARE_TTL).isoformat(),
+            'view_count': 0,
+            'last_viewed_at': None,
+            'created_by': 'unknown',
+            'client_name': '',
+            'report_type': ''
+        })
+    except Exception as e:
+        print(f"[AI Share] Failed to save metadata: {e}")
+
+
 @app.route('/api/ai-reports/share', methods=['POST'])
 def share_report():
     """Upload rapport vers Cloud Storage et génère lien public"""
@@ -2846,42 +6361,21 @@ def share_report():
         if not html_content:
             return jsonify({'error': 'html is required'}), 400
 
-        # Upload vers GCS bucket
-        storage_client = storage.Client()
-        bucket = storage_client.bucket('mydigipal-reports')
-
-        # Générer short ID unique
-        short_id = uuid.uuid4().hex[:8]
-
-        blob = bucket.blob(f'reports/{short_id}.html')
-        blob.upload_from_string(html_content, content_type='text/html')
-
-        # Rendre public avec signed URL (30 jours)
-        url = blob.generate_signed_url(expiration=timedelta(days=30))
+        short_id, name, created = report_store.put(html_content)
+        if not created:
+            print(f"[AI Share] Reusing stored report {short_id}")
 
-        # Sauvegarder metadata dans BigQuery
-        try:
-            table_id = 'mydigipal.company.ai_shared_reports'
-            rows_to_insert = [{
-                'short_id': short_id,
-                'conversation_id': data.get('conversation_id', ''),
-                'public_url': url,
-                'created_at': datetime.utcnow().isoformat(),
-                'expires_at': (datetime.utcnow() + timedelta(days=30)).isoformat(),
-                'view_count': 0,
-                'last_viewed_at': None,
-                'created_by': 'unknown',
-                'client_name': '',
-                'report_type': ''
-            }]
-            client.insert_rows_json(table_id, rows_to_insert)
-        except Exception as e:
-            print(f"[AI Share] Failed to save metadata: {e}")
+        # URL signée (30 jours) et metadata hors du chemin de la requête
+        created_at = datetime.utcnow()
+        conversation_id = data.get('conversation_id', '')
+        report_store.sign_async(name).add_done_callback(
+            lambda future: record_shared_report(future, short_id, conversation_id, created_at)
+        )
 
         return jsonify({
-            'share_url': f'https://storage.googleapis.com/mydigipal-reports/reports/{short_id}.html',
+            'share_url': report_store.backend.public_url(name),
             'short_id': short_id,
-            'expires_at': (datetime.utcnow() + timedelta(days=30)).strftime('%Y-%m-%d')
+            'expires_at': (created_at + REPORT_SHARE_TTL).strftime('%Y-%m-%d')
         })
 
     except Exception as e:
@@ -2890,6 +6384,332 @@ def share_report():
         return jsonify({'error': str(e)}), 500
 
 
+
+# ============================================================================
+# AI REPORT JOBS
+# ============================================================================
+
+# Full reports (chat + export HTML + share) run as background jobs instead of inside
+# request threads. Jobs are kept as one JSON file each in AI_JOBS_DIR, so they survive
+# restarts: queued or interrupted jobs are resubmitted at startup (single gunicorn worker)
+# and resume after their last completed step, except a job cut during its chat step, which
+# fails rather than running the agent (and saving a conversation) a second time. Month-end batches get their own, smaller
+# pool so they never occupy the workers of interactive jobs.
+AI_JOBS_DIR = os.environ.get('AI_JOBS_DIR', '/tmp/ai-report-jobs')
+AI_JOB_WORKERS = int(os.environ.get('AI_JOB_WORKERS', '2'))
+AI_BATCH_JOB_WORKERS = int(os.environ.get('AI_BATCH_JOB_WORKERS', '1'))
+AI_JOB_RETENTION = timedelta(days=7)
+
+FRENCH_MONTH_NAMES = ['janvier', 'février', 'mars', 'avril', 'mai', 'juin', 'juillet',
+                      'août', 'septembre', 'octobre', 'novembre', 'décembre']
+
+
+class ReportJobStore:
+    """Report jobs held in memory and mirrored to one JSON file per job."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._jobs = {}
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _load(self):
+        cutoff = (datetime.utcnow() - AI_JOB_RETENTION).isoformat()
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                with open(path) as f:
+                    job = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"[AI Jobs] Skipping unreadable job file {filename}: {e}")
+                continue
+            if job.get('finished_at') and job['finished_at'] < cutoff:
+                os.remove(path)
+                continue
+            self._jobs[job['id']] = job
+        print(f"[AI Jobs] Loaded {len(self._jobs)} jobs from {self.directory}")
+
+    def _write(self, job):
+        # Write then rename, so a crash never leaves a truncated job file
+        tmp_path = self._path(job['id']) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(job, f, default=str)
+        os.replace(tmp_path, self._path(job['id']))
+
+    def create(self, kind, steps, payload):
+        job = {
+            'id': f"job_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}",
+            'kind': kind,
+            'status': 'queued',
+            'steps': steps,
+            'step': None,
+            'request': payload,
+            'result': {},
+            'error': None,
+            'created_at': datetime.utcnow().isoformat(),
+            'started_at': None,
+            'finished_at': None
+        }
+        with self._lock:
+            self._jobs[job['id']] = job
+            self._write(job)
+        return dict(job)
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(fields)
+            self._write(job)
+            return dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list(self, status=None, limit=50):
+        with self._lock:
+            jobs = [dict(job) for job in self._jobs.values() if status is None or job['status'] == status]
+        return sorted(jobs, key=lambda job: job['created_at'], reverse=True)[:limit]
+
+    def unfinished(self):
+        return sorted(
+            (job for job in self.list(limit=None) if job['status'] in ('queued', 'running')),
+            key=lambda job: job['created_at']
+        )
+
+
+report_jobs = ReportJobStore(AI_JOBS_DIR)
+interactive_job_executor = ThreadPoolExecutor(max_workers=AI_JOB_WORKERS, thread_name_prefix='report-job')
+batch_job_executor = ThreadPoolExecutor(max_workers=AI_BATCH_JOB_WORKERS, thread_name_prefix='report-batch')
+
+
+def dispatch_job_step(path, body):
+    """Call a POST endpoint through the regular view stack; returns its JSON or raises on error."""
+    with app.test_request_context(path, method='POST', json=body):
+        response = app.make_response(app.full_dispatch_request())
+    data = response.get_json(silent=True) or {}
+    if response.status_code != 200:
+        raise RuntimeError(data.get('error') or f"{path} returned HTTP {response.status_code}")
+    return data
+
+
+def report_period_label(date_from):
+    """'2025-12-01' -> 'décembre 2025'"""
+    day = datetime.strptime(date_from, '%Y-%m-%d')
+    return f"{FRENCH_MONTH_NAMES[day.month - 1]} {day.year}"
+
+
+def run_report_job(job_id):
+    job = report_jobs.get(job_id)
+    if job['status'] == 'running' and job['step'] == 'chat' and 'chat' not in job['result']:
+        # The chat may have run (Claude + BigQuery) and saved its conversation before the restart
+        print(f"[AI Jobs] {job_id} interrupted during chat, not rerun")
+        report_jobs.update(job_id, status='failed', finished_at=datetime.utcnow().isoformat(),
+                           error='Interrupted by a restart during the chat step; submit the report again')
+        return
+
+    job = report_jobs.update(job_id, status='running', started_at=datetime.utcnow().isoformat(), error=None)
+    payload = job['request']
+    result = dict(job['result'])  # Steps finished before a restart are not run again
+
+    try:
+        for step in job['steps']:
+            if step in result:
+                continue
+            report_jobs.update(job_id, step=step)
+
+            if step == 'chat':
+                result['chat'] = dispatch_job_step('/api/ai-reports/chat', {
+                    'message': payload['message'],
+                    'conversation_id': payload.get('conversation_id'),
+                    'history': payload.get('history', [])
+                })
+            elif step == 'export_html':
+                chat = result['chat']
+                template = chat.get('template') or {}
+                result['export_html'] = dispatch_job_step('/api/ai-reports/export-html', {
+                    'conversation_id': chat['conversation_id'],
+                    'client_name': payload.get('client_name') or template.get('company_name', 'Client'),
+                    'client_id': payload.get('client_id') or template.get('client_id', 'client'),
+                    'period': payload.get('period') or (
+                        report_period_label(template['date_from']) if template.get('date_from')
+                        else datetime.now().strftime('%B %Y')
+                    ),
+                    'report_content': chat['response']
+                })
+            elif step == 'share':
+                result['share'] = dispatch_job_step('/api/ai-reports/share', {
+                    'conversation_id': result['chat']['conversation_id'],
+                    'html': result['export_html']['html']
+                })
+
+            report_jobs.update(job_id, result=result)
+
+        report_jobs.update(job_id, status='succeeded', step=None, finished_at=datetime.utcnow().isoformat())
+        print(f"[AI Jobs] {job_id} succeeded")
+
+    except Exception as e:
+        print(f"[AI Jobs] {job_id} failed: {e}")
+        traceback.print_exc()
+        report_jobs.update(job_id, status='failed', error=str(e), finished_at=datetime.utcnow().isoformat())
+
+
+def enqueue_report_job(kind, payload):
+    steps = ['chat']
+    if payload.get('export_html', True) or payload.get('share'):
+        steps.append('export_html')
+    if payload.get('share'):
+        steps.append('share')
+
+    job = report_jobs.create(kind, steps, payload)
+    executor = batch_job_executor if kind == 'batch' else interactive_job_executor
+    executor.submit(run_report_job, job['id'])
+    return job
+
+
+def job_status(job):
+    """Job as returned by the status endpoints (step outputs only through /result)."""
+    return {
+        **{key: value for key, value in job.items() if key not in ('request', 'result')},
+        'completed_steps': [step for step in job['steps'] if step in job['result']],
+        'message': job['request'].get('message')
+    }
+
+
+# Resume jobs interrupted by a restart
+for unfinished_job in report_jobs.unfinished():
+    print(f"[AI Jobs] Resuming {unfinished_job['id']}")
+    (batch_job_executor if unfinished_job['kind'] == 'batch' else interactive_job_executor).submit(
+        run_report_job, unfinished_job['id']
+    )
+
+
+@app.route('/api/ai-reports/jobs', methods=['POST'])
+def create_report_job():
+    """
+    Génère un rapport en arrière-plan (chat, puis export HTML et partage en option).
+    Body: {"message": "...", "conversation_id", "history", "client_name", "client_id",
+           "period", "export_html": true, "share": false}
+    """
+    try:
+        if not anthropic_client:
+            return jsonify({'error': 'Anthropic API key not configured'}), 500
+
+        data = request.get_json(silent=True) or {}
+        if not data.get('message'):
+            return jsonify({'error': 'Message is required'}), 400
+
+        job = enqueue_report_job('interactive', data)
+        return jsonify({
+            'job_id': job['id'],
+            'status': job['status'],
+            'steps': job['steps'],
+            'status_url': f"/api/ai-reports/jobs/{job['id']}",
+            'result_url': f"/api/ai-reports/jobs/{job['id']}/result"
+        }), 202
+
+    except Exception as e:
+        print(f"[AI Jobs] Error: {e}")
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/ai-reports/jobs/month-end', methods=['POST'])
+def create_month_end_jobs():
+    """
+    Rapports mensuels de tous les clients (ou de client_ids) via la file de jobs.
+    Body: {"year": 2025, "month": 12, "client_ids": [...], "export_html": true, "share": false}
+    Mois précédent par défaut.
+    """
+    try:
+        if not anthropic_client:
+            return jsonify({'error': 'Anthropic API key not configured'}), 500
+
+        data = request.get_json(silent=True) or {}
+        last_month = datetime.now().replace(day=1) - timedelta(days=1)
+        year = int(data.get('year') or last_month.year)
+        month = int(data.get('month') or last_month.month)
+        if not 1 <= month <= 12:
+            return jsonify({'error': 'month must be between 1 and 12'}), 400
+
+        clients = get_client_accounts_from_sheet()
+        client_ids = data.get('client_ids') or sorted(clients)
+        unknown = [client_id for client_id in client_ids if client_id not in clients]
+        if unknown:
+            return jsonify({'error': f"Unknown clients: {', '.join(unknown)}"}), 400
+
+        period = f"{FRENCH_MONTH_NAMES[month - 1]} {year}"
+        jobs = []
+        for client_id in client_ids:
+            company_name = clients[client_id].get('company_name') or client_id
+            job = enqueue_report_job('batch', {
+                'message': f"Rapport {company_name} {period}",
+                'client_name': company_name,
+                'client_id': client_id,
+                'period': period,
+                'export_html': data.get('export_html', True),
+                'share': data.get('share', False)
+            })
+            jobs.append({'client_id': client_id, 'job_id': job['id']})
+
+        return jsonify({'period': period, 'count': len(jobs), 'jobs': jobs}), 202
+
+    except Exception as e:
+        print(f"[AI Jobs] Error: {e}")
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/ai-reports/jobs')
+def list_report_jobs():
+    """Liste des jobs, les plus récents d'abord (?status=queued|running|succeeded|failed&limit=50)"""
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 500)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    return jsonify([job_status(job) for job in report_jobs.list(request.args.get('status'), limit)])
+
+
+@app.route('/api/ai-reports/jobs/<job_id>')
+def get_report_job(job_id):
+    job = report_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_status(job))
+
+
+@app.route('/api/ai-reports/jobs/<job_id>/result')
+def get_report_job_result(job_id):
+    job = report_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] == 'failed':
+        return jsonify({'error': job['error'], 'status': job['status']}), 500
+    if job['status'] != 'succeeded':
+        return jsonify({'error': 'Job not finished', 'status': job['status'], 'step': job['step']}), 409
+
+    result = job['result']
+    chat = result.get('chat', {})
+    return jsonify({
+        'job_id': job['id'],
+        'status': job['status'],
+        'conversation_id': chat.get('conversation_id'),
+        'response': chat.get('response'),
+        'sql_executed': chat.get('sql_executed'),
+        'template': chat.get('template'),
+        'html': result.get('export_html', {}).get('html'),
+        'filename': result.get('export_html', {}).get('filename'),
+        'share_url': result.get('share', {}).get('share_url'),
+        'expires_at': result.get('share', {}).get('expires_at')
+    })
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8080))
     app.run(host='0.0.0.0', port=port, debug=False)
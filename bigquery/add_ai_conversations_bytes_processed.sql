@@ -0,0 +1,11 @@
+-- Add the bytes scanned by the AI's SQL queries to each saved exchange
+-- Execute in BigQuery Console: https://console.cloud.google.com/bigquery?project=mydigipal
+-- (before deploying the API version that writes the field)
+
+ALTER TABLE `mydigipal.company.ai_conversations`
+ADD COLUMN IF NOT EXISTS bytes_processed INT64;
+
+-- Per-conversation totals
+-- SELECT conversation_id, SUM(bytes_processed) AS bytes_processed
+-- FROM `mydigipal.company.ai_conversations`
+-- GROUP BY conversation_id
@@ -51,23 +51,15 @@ class AIReportsManager {
         document.getElementById('aiSendMessage').disabled = true;
 
         try {
-            // Appel API
-            const response = await fetch(`${window.CONFIG.API_URL}/api/ai-reports/chat`, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    message: message,
-                    conversation_id: this.currentConversationId,
-                    history: this.conversationHistory
-                })
-            });
-
-            if (!response.ok) {
-                const errorData = await response.json();
-                throw new Error(errorData.error || 'API error');
-            }
-
-            const data = await response.json();
+            // Appel API (streaming SSE, réponse JSON classique si le navigateur ne sait pas lire le flux)
+            const payload = {
+                message: message,
+                conversation_id: this.currentConversationId,
+                history: this.conversationHistory
+            };
+            const data = window.ReadableStream
+                ? await this.streamChat(payload)
+                : await this.postChat(payload);
 
             // Afficher réponse assistant
             this.addMessageToChat('assistant', data.response, data.sql_executed, data.conversation_id);
@@ -91,6 +83,116 @@ class AIReportsManager {
         }
     }
 
+    async postChat(payload) {
+        const response = await fetch(`${window.CONFIG.API_URL}/api/ai-reports/chat`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(payload)
+        });
+
+        if (!response.ok) {
+            const errorData = await response.json();
+            throw new Error(errorData.error || 'API error');
+        }
+
+        return response.json();
+    }
+
+    async streamChat(payload) {
+        const response = await fetch(`${window.CONFIG.API_URL}/api/ai-reports/chat/stream`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(payload)
+        });
+
+        if (!response.ok) {
+            const errorData = await response.json();
+            throw new Error(errorData.error || 'API error');
+        }
+
+        const live = this.addLiveMessage();
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let result = null;
+
+        try {
+            while (!result) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+
+                // Les événements SSE sont séparés par une ligne vide
+                let separator;
+                while ((separator = buffer.indexOf('\n\n')) !== -1) {
+                    const raw = buffer.slice(0, separator);
+                    buffer = buffer.slice(separator + 2);
+
+                    let event = 'message';
+                    let data = '';
+                    raw.split('\n').forEach(line => {
+                        if (line.startsWith('event:')) event = line.slice(6).trim();
+                        else if (line.startsWith('data:')) data += line.slice(5).trim();
+                    });
+                    const eventData = data ? JSON.parse(data) : {};
+
+                    if (event === 'template') {
+                        const status = document.createElement('div');
+                        status.className = 'ai-tool-status';
+                        status.textContent = `📋 Rapport mensuel ${eventData.company_name} : données du dashboard (${eventData.sources.join(', ')})`;
+                        live.tools.appendChild(status);
+                    } else if (event === 'token') {
+                        live.text.textContent += eventData.text;
+                    } else if (event === 'tool_start') {
+                        // Le texte précédant un appel d'outil est intermédiaire
+                        live.text.textContent = '';
+                        const status = document.createElement('div');
+                        status.className = 'ai-tool-status';
+                        status.dataset.toolId = eventData.id;
+                        status.textContent = '⏳ Requête SQL en cours...';
+                        live.tools.appendChild(status);
+                    } else if (event === 'tool_end') {
+                        const status = live.tools.querySelector(`[data-tool-id="${eventData.id}"]`);
+                        if (status) {
+                            status.textContent = eventData.error
+                                ? `⚠️ ${eventData.error}`
+                                : `✅ ${eventData.row_count} ligne(s)`;
+                        }
+                    } else if (event === 'error') {
+                        throw new Error(eventData.error || 'API error');
+                    } else if (event === 'done') {
+                        result = eventData;
+                    }
+                }
+            }
+        } finally {
+            live.element.remove();
+        }
+
+        if (!result) throw new Error('Connexion interrompue');
+        return result;
+    }
+
+    addLiveMessage() {
+        const chatContainer = document.getElementById('aiChatMessages');
+        const messageDiv = document.createElement('div');
+        messageDiv.className = 'ai-message ai-message-assistant';
+        messageDiv.innerHTML = `
+            <div class="ai-message-content">
+                <div class="ai-tool-list"></div>
+                <div class="ai-live-text"></div>
+            </div>
+        `;
+        chatContainer.appendChild(messageDiv);
+        chatContainer.scrollTop = chatContainer.scrollHeight;
+
+        return {
+            element: messageDiv,
+            tools: messageDiv.querySelector('.ai-tool-list'),
+            text: messageDiv.querySelector('.ai-live-text')
+        };
+    }
+
     addMessageToChat(role, content, sqlQuery = null, conversationId = null) {
         const chatContainer = document.getElementById('aiChatMessages');
         const messageDiv = document.createElement('div');
@@ -162,7 +264,7 @@ class AIReportsManager {
             if (!response.ok) return;
 
             const data = await response.json();
-            console.log('[AI Reports] Conversation history loaded:', data.length);
+            console.log('[AI Reports] Conversation history loaded:', data.conversations.length);
             // TODO: Afficher liste des conversations passées dans sidebar
         } catch (error) {
             console.error('[AI Reports] Failed to load history:', error);
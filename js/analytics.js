@@ -8,6 +8,7 @@ class AnalyticsManager {
         this.currentDateFrom = null;
         this.currentDateTo = null;
         this.charts = {};
+        this.prefetched = new Map();
     }
 
     // Classify conversion as Lead or regular Conversion
@@ -85,6 +86,7 @@ class AnalyticsManager {
         if (clientSelect) {
             clientSelect.addEventListener('change', (e) => {
                 this.updateAvailableSources(e.target);
+                this.prefetchSources(e.target);
             });
         }
     }
@@ -160,6 +162,62 @@ class AnalyticsManager {
         console.log(`[Analytics] Updated sources for client ${clientData.client_name || selectedOption.value}`);
     }
 
+    // Fetch every source of the selected client in one /api/batch round-trip,
+    // so that the report loads instantly whichever source is picked next
+    prefetchSources(clientSelect) {
+        this.prefetched.clear();
+
+        const selectedOption = clientSelect.options[clientSelect.selectedIndex];
+        if (!selectedOption || !selectedOption.value || !window.apiClient) return;
+
+        let clientData = {};
+        try {
+            clientData = JSON.parse(selectedOption.dataset.clientData || '{}');
+        } catch (e) {
+            return;
+        }
+
+        const { dateFrom, dateTo } = this.getGlobalDates();
+        const params = { client_id: selectedOption.value, date_from: dateFrom, date_to: dateTo };
+        const requests = [];
+
+        if (clientData.meta_ads_accounts) requests.push({ id: 'meta', endpoint: '/api/analytics/meta-ads', params });
+        if (clientData.google_ads_accounts) requests.push({ id: 'google-ads', endpoint: '/api/analytics/google-ads', params });
+        if (clientData.linkedin_ads_accounts) requests.push({ id: 'linkedin-ads', endpoint: '/api/analytics/linkedin-ads', params });
+        if (clientData.meta_ads_accounts || clientData.google_ads_accounts || clientData.linkedin_ads_accounts) {
+            requests.push({ id: 'multi', endpoint: '/api/analytics/paid-media', params });
+        }
+        if (clientData.ga4_properties) {
+            const property = selectedOption.textContent.split('(')[0].trim();
+            requests.push({ id: 'ga4', endpoint: '/api/analytics/ga4', params: { property, date_from: dateFrom, date_to: dateTo } });
+        }
+        if (clientData.gsc_domains) requests.push({ id: 'search-console', endpoint: '/api/analytics/search-console', params });
+
+        if (requests.length === 0) return;
+
+        const batch = window.apiClient.batch(requests).catch(error => {
+            console.warn('[Analytics] Batch prefetch failed:', error);
+            return [];
+        });
+
+        requests.forEach((req, i) => {
+            this.prefetched.set(
+                this.prefetchKey(req.endpoint, req.params),
+                batch.then(results => (results[i] && results[i].status === 200) ? results[i].data : null)
+            );
+        });
+    }
+
+    prefetchKey(endpoint, params) {
+        return `${endpoint}?${new URLSearchParams(Object.entries(params).sort())}`;
+    }
+
+    // Resolves to the prefetched payload, or null if it was not (successfully) prefetched
+    async getPrefetched(endpoint, params) {
+        const pending = this.prefetched.get(this.prefetchKey(endpoint, params));
+        return pending ? await pending : null;
+    }
+
     setDefaultDates() {
         // No longer needed - using global dates from dashboard
     }
@@ -276,6 +334,9 @@ class AnalyticsManager {
     }
 
     async fetchMetaAdsData(clientId, dateFrom, dateTo) {
+        const prefetched = await this.getPrefetched('/api/analytics/meta-ads', { client_id: clientId, date_from: dateFrom, date_to: dateTo });
+        if (prefetched) return prefetched;
+
         const url = `${window.CONFIG.API_URL}/api/analytics/meta-ads?client_id=${clientId}&date_from=${dateFrom}&date_to=${dateTo}`;
         console.log(`[Analytics] Fetching Meta Ads data: ${url}`);
 
@@ -861,6 +922,9 @@ class AnalyticsManager {
 
     // Google Ads Data Fetching
     async fetchGoogleAdsData(clientId, dateFrom, dateTo) {
+        const prefetched = await this.getPrefetched('/api/analytics/google-ads', { client_id: clientId, date_from: dateFrom, date_to: dateTo });
+        if (prefetched) return prefetched;
+
         const url = `${window.CONFIG.API_URL}/api/analytics/google-ads?client_id=${clientId}&date_from=${dateFrom}&date_to=${dateTo}`;
         console.log(`[Analytics] Fetching Google Ads data: ${url}`);
 
@@ -1453,6 +1517,9 @@ class AnalyticsManager {
     }
 
     async fetchLinkedInAdsData(clientId, dateFrom, dateTo) {
+        const prefetched = await this.getPrefetched('/api/analytics/linkedin-ads', { client_id: clientId, date_from: dateFrom, date_to: dateTo });
+        if (prefetched) return prefetched;
+
         const url = `${CONFIG.API_URL}/api/analytics/linkedin-ads?client_id=${clientId}&date_from=${dateFrom}&date_to=${dateTo}`;
         const response = await fetch(url);
         if (!response.ok) throw new Error('Failed to fetch LinkedIn Ads data');
@@ -1946,6 +2013,9 @@ class AnalyticsManager {
     }
 
     async fetchPaidMediaData(clientId, dateFrom, dateTo) {
+        const prefetched = await this.getPrefetched('/api/analytics/paid-media', { client_id: clientId, date_from: dateFrom, date_to: dateTo });
+        if (prefetched) return prefetched;
+
         const url = `${CONFIG.API_URL}/api/analytics/paid-media?client_id=${clientId}&date_from=${dateFrom}&date_to=${dateTo}`;
         const response = await fetch(url);
         if (!response.ok) throw new Error('Failed to fetch Paid Media data');
@@ -2419,6 +2489,9 @@ class AnalyticsManager {
     }
 
     async fetchGA4Data(property, dateFrom, dateTo) {
+        const prefetched = await this.getPrefetched('/api/analytics/ga4', { property, date_from: dateFrom, date_to: dateTo });
+        if (prefetched) return prefetched;
+
         const url = `${CONFIG.API_URL}/api/analytics/ga4?property=${encodeURIComponent(property)}&date_from=${dateFrom}&date_to=${dateTo}`;
         const response = await fetch(url);
         if (!response.ok) throw new Error('Failed to fetch GA4 data');
@@ -2994,6 +3067,9 @@ class AnalyticsManager {
         }
         // If selectedAccounts is null or empty, API will use all available domains
 
+        const prefetched = await this.getPrefetched('/api/analytics/search-console', Object.fromEntries(params));
+        if (prefetched) return prefetched;
+
         const response = await fetch(`${window.CONFIG.API_URL}/api/analytics/search-console?${params}`);
 
         if (!response.ok) {
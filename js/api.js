@@ -64,21 +64,22 @@ class APIClient {
     const cacheKey = `${endpoint}${JSON.stringify(options)}`;
 
     // Check cache first
-    if (this.cache.has(cacheKey)) {
-      const cached = this.cache.get(cacheKey);
-      if (Date.now() - cached.timestamp < CONFIG.CACHE_DURATION) {
-        return cached.data;
-      }
+    const cached = this.cache.get(cacheKey);
+    if (cached && Date.now() - cached.timestamp < CONFIG.CACHE_DURATION) {
+      return cached.data;
     }
 
     try {
-      const response = await fetch(this.baseURL + endpoint, options);
+      // Expired entry: revalidate through the browser HTTP cache (If-None-Match → 304)
+      // instead of downloading the payload again when it has not changed
+      const fetchOptions = cached ? { cache: 'no-cache', ...options } : options;
+      const response = await fetch(this.baseURL + endpoint, fetchOptions);
 
       if (!response.ok) {
         throw new Error(`HTTP ${response.status}: ${response.statusText}`);
       }
 
-      const data = await response.json();
+      const data = await this.decodeTables(await response.json());
 
       // Cache successful response
       this.cache.set(cacheKey, {
@@ -104,6 +105,66 @@ class APIClient {
     }
   }
 
+  /**
+   * Decode the table fields of a ?format=columnar or ?format=arrow response
+   * (listed in columnar_fields) back into arrays of row objects, so callers
+   * get the same shape as with the default JSON format.
+   * @param {Object} data - Parsed response body
+   * @returns {Promise<Object>} Response with row-object tables
+   */
+  async decodeTables(data) {
+    if (!data || !Array.isArray(data.columnar_fields)) return data;
+
+    const { format, columnar_fields: fields, ...decoded } = data;
+    for (const field of fields) {
+      const columns = format === 'arrow' ? await this.decodeArrow(decoded[field]) : decoded[field];
+      decoded[field] = this.columnsToRows(columns);
+    }
+    return decoded;
+  }
+
+  /**
+   * Helper: {column: [values]} to [{column: value}]
+   * @param {Object} columns - Column arrays of equal length
+   * @returns {Array<Object>} Rows
+   */
+  columnsToRows(columns) {
+    const names = Object.keys(columns);
+    const length = names.length ? columns[names[0]].length : 0;
+    const rows = new Array(length);
+    for (let i = 0; i < length; i++) {
+      const row = {};
+      for (const name of names) row[name] = columns[name][i];
+      rows[i] = row;
+    }
+    return rows;
+  }
+
+  /**
+   * Helper: base64 Arrow IPC stream to {column: [values]}.
+   * apache-arrow is only loaded the first time an Arrow response arrives.
+   * @param {string} encoded - Base64 Arrow IPC stream
+   * @returns {Promise<Object>} Column arrays (INT64 values as numbers)
+   */
+  async decodeArrow(encoded) {
+    if (!this.arrowModule) {
+      this.arrowModule = import('https://cdn.jsdelivr.net/npm/apache-arrow@17/+esm');
+    }
+    const { tableFromIPC } = await this.arrowModule;
+
+    const bytes = Uint8Array.from(atob(encoded), c => c.charCodeAt(0));
+    const table = tableFromIPC(bytes);
+    const columns = {};
+    for (const field of table.schema.fields) {
+      const values = [];
+      for (const value of table.getChild(field.name)) {
+        values.push(typeof value === 'bigint' ? Number(value) : value);
+      }
+      columns[field.name] = values;
+    }
+    return columns;
+  }
+
   /**
    * Helper: Sleep for a given duration
    * @param {number} ms - Milliseconds to sleep
@@ -207,12 +268,14 @@ class APIClient {
    * @param {string} clientId - Client ID
    * @param {string} dateFrom - Start date
    * @param {string} dateTo - End date
+   * @param {string} format - Transfer format: 'json' (default), 'columnar' or 'arrow'
    * @returns {Promise<Object>} Client timeline data
    */
-  async getClientTimeline(clientId, dateFrom = null, dateTo = null) {
+  async getClientTimeline(clientId, dateFrom = null, dateTo = null, format = null) {
     const params = new URLSearchParams();
     if (dateFrom) params.append('date_from', dateFrom);
     if (dateTo) params.append('date_to', dateTo);
+    if (format && format !== 'json') params.append('format', format);
 
     const query = params.toString() ? `?${params.toString()}` : '';
     return this.fetchWithRetry(`/api/client-timeline/${clientId}${query}`);
@@ -254,6 +317,98 @@ class APIClient {
   async getAlerts() {
     return this.fetchWithRetry('/api/alerts');
   }
+
+  /**
+   * Page through a full data table (campaigns, keywords, GSC queries/pages) sorted and searched server-side
+   * @param {string} table - Table name (e.g. 'google-keywords', 'gsc-queries')
+   * @param {Object} params - client_id, date_from, date_to, sort, order, q, match, limit
+   * @param {string} cursor - next_cursor of the previous page
+   * @returns {Promise<Object>} {rows, total, next_cursor, columns, search_column, materialized_at}
+   */
+  async explore(table, params = {}, cursor = null) {
+    const query = new URLSearchParams();
+    for (const [key, value] of Object.entries(params)) {
+      if (value !== null && value !== undefined && value !== '') query.append(key, value);
+    }
+    if (cursor) query.append('cursor', cursor);
+    return this.fetchWithRetry(`/api/explore/${table}?${query.toString()}`);
+  }
+
+  /**
+   * Fetch several GET resources in one round-trip via POST /api/batch.
+   * Successful items are stored in the client-side cache under the same key
+   * fetchWithRetry() would use for a plain GET of that endpoint.
+   * @param {Array<{id: string, endpoint: string, params: Object}>} requests - Resources to fetch
+   * @returns {Promise<Array>} Results in request order: {id, endpoint, status, data}
+   */
+  async batch(requests) {
+    const response = await fetch(this.baseURL + '/api/batch', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ requests })
+    });
+
+    if (!response.ok) {
+      throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+    }
+
+    const { results } = await response.json();
+    for (const result of results) {
+      if (result.status === 200) result.data = await this.decodeTables(result.data);
+    }
+
+    results.forEach((result, i) => {
+      if (result.status === 200) {
+        const query = new URLSearchParams(requests[i].params || {}).toString();
+        const endpoint = query ? `${result.endpoint}?${query}` : result.endpoint;
+        this.cache.set(`${endpoint}${JSON.stringify({})}`, {
+          data: result.data,
+          timestamp: Date.now()
+        });
+      }
+    });
+
+    return results;
+  }
+
+  /**
+   * Fetch an analytics endpoint with ?stream=ndjson: each section is passed to
+   * onSection as soon as the server has it, instead of waiting for the slowest query.
+   * @param {string} endpoint - Analytics endpoint (e.g. '/api/analytics/google-ads')
+   * @param {Object} params - Query params (client_id, date_from, date_to, sections...)
+   * @param {Function} onSection - Called with (name, payload) where payload is the merged response so far
+   * @returns {Promise<Object>} Complete payload, same shape as a regular GET
+   */
+  async streamSections(endpoint, params = {}, onSection = () => {}) {
+    const query = new URLSearchParams({ ...params, stream: 'ndjson' }).toString();
+    const response = await fetch(`${this.baseURL}${endpoint}?${query}`);
+    if (!response.ok) {
+      throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+    }
+
+    const payload = {};
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = '';
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += value;
+
+      const lines = buffer.split('\n');
+      buffer = lines.pop();
+      for (const line of lines) {
+        if (!line.trim()) continue;
+        const { event, section, ...data } = JSON.parse(line);
+        if (event === 'error') throw new Error(data.error);
+        if (event === 'meta' || event === 'section') {
+          Object.assign(payload, await this.decodeTables(data));
+        }
+        if (event === 'section') onSection(section, payload);
+      }
+    }
+    delete payload.sections;
+    return payload;
+  }
 }
 
 // Create global API client instance
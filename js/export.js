@@ -119,6 +119,25 @@ class ExportManager {
       window.toastManager.error('Erreur lors de l\'export CSV');
     }
   }
+
+  /**
+   * Export a full data table from the API (no row cap), streamed by the server.
+   * The browser downloads it directly, so large exports never go through JS memory.
+   * @param {string} table - meta-campaigns, google-campaigns, linkedin-campaigns,
+   *   google-keywords, gsc-queries, gsc-pages or timesheets
+   * @param {Object} params - client_id, date_from, date_to
+   * @param {string} format - 'csv' (default) or 'parquet'
+   */
+  exportFullTable(table, params = {}, format = 'csv') {
+    const query = new URLSearchParams({ ...params, format });
+    const link = document.createElement('a');
+    link.href = `${CONFIG.API_URL}/api/export/${table}?${query.toString()}`;
+    link.style.display = 'none';
+
+    document.body.appendChild(link);
+    link.click();
+    document.body.removeChild(link);
+  }
 }
 
 // Create global export manager instance